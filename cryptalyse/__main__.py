@@ -0,0 +1,4 @@
+import sys
+from cryptalyse.cli import main
+
+sys.exit(main())
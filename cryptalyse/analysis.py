@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Single pass wallet analysis engine
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import copy
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from cryptalyse.tags import open_tag_store
+
+
+# Compact transaction record, only contains the fields used in the analysis
+#   inputs: list of (address, value, prev_txid, output_n) tuples
+#   outputs: list of (address, value, output_n) tuples
+TxRecord = namedtuple('TxRecord', ['date', 'txid', 'fee', 'inputs', 'outputs'])
+
+
+# Period granularity for snapshots and aggregates
+PERIODS = ('day', 'month', 'quarter', 'year')
+
+
+def period_index(d, period):
+    """
+    Sequential integer index of the period containing date d
+    """
+    if period == 'year':
+        return d.year
+    elif period == 'quarter':
+        return d.year * 4 + (d.month - 1) // 3
+    elif period == 'month':
+        return d.year * 12 + d.month - 1
+    elif period == 'day':
+        return d.toordinal()
+    raise ValueError("Unknown period %s, use one of %s" % (period, PERIODS))
+
+
+def period_label(idx, period):
+    """
+    Label for a period index: year as integer, '2021-Q3', '2021-07' or '2021-07-31'
+    """
+    if period == 'year':
+        return idx
+    elif period == 'quarter':
+        return '%d-Q%d' % (idx // 4, idx % 4 + 1)
+    elif period == 'month':
+        return '%d-%02d' % (idx // 12, idx % 12 + 1)
+    elif period == 'day':
+        return date.fromordinal(idx).isoformat()
+    raise ValueError("Unknown period %s, use one of %s" % (period, PERIODS))
+
+
+def period_end(idx, period):
+    """
+    Last day of a period index as date
+    """
+    if period == 'year':
+        return date(idx, 12, 31)
+    elif period == 'quarter':
+        return period_end((idx // 4) * 12 + (idx % 4) * 3 + 2, 'month')
+    elif period == 'month':
+        year, month = idx // 12, idx % 12 + 1
+        return (date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)) - timedelta(days=1)
+    elif period == 'day':
+        return date.fromordinal(idx)
+    raise ValueError("Unknown period %s, use one of %s" % (period, PERIODS))
+
+
+def month_start(idx):
+    """
+    First moment of a month index as datetime
+    """
+    return datetime(idx // 12, idx % 12 + 1, 1)
+
+
+def merge_input_totals(totals, partial, first_corrections=None):
+    """
+    Add input totals of later transactions to totals. Address sets and previous output lists in totals are updated
+    in place, the partial totals are not changed.
+
+    The first input of a name is counted differently than later inputs: a wallet input is added instead of
+    subtracted, and the total wallet input of the transaction is always added. first_corrections contains
+    {name: (value, total wallet input)} differences of the partial totals, which are subtracted if the name is
+    already in totals.
+    """
+    first_corrections = first_corrections or {}
+    for key, (value, total_wallet_input, addresses, prev_txs) in partial.items():
+        if key in totals:
+            t = totals[key]
+            t[2].update(addresses)
+            t[3].extend(prev_txs)
+            value_correction, wallet_input_correction = first_corrections.get(key, (0, 0))
+            totals[key] = (t[0] + value - value_correction, t[1] + total_wallet_input - wallet_input_correction,
+                           t[2], t[3])
+        else:
+            totals[key] = (value, total_wallet_input, set(addresses), list(prev_txs))
+
+
+def merge_output_totals(totals, partial):
+    """
+    Add output totals of later transactions to totals, the partial totals are not changed
+    """
+    for key, (value, address, txids, input_addresses) in partial.items():
+        if key in totals:
+            t = totals[key]
+            t[2].extend(txids)
+            totals[key] = (t[0] + value, t[1], t[2], input_addresses)
+        else:
+            totals[key] = (value, address, list(txids), input_addresses)
+
+
+def group_by_period(days, period, last_date=None):
+    """
+    Group sorted day ordinals by period. Yields (period index, [days]) for every period from the first day up to and
+    including the period of last_date, so periods without any days are included as well.
+    """
+    if not days:
+        return
+    last_idx = period_index(last_date if last_date else date.fromordinal(days[-1]), period)
+    pos = 0
+    for idx in range(period_index(date.fromordinal(days[0]), period), last_idx + 1):
+        period_days = []
+        while pos < len(days) and period_index(date.fromordinal(days[pos]), period) <= idx:
+            period_days.append(days[pos])
+            pos += 1
+        yield idx, period_days
+
+
+def tx_records(transactions):
+    """
+    Convert Transaction objects to TxRecord tuples
+    """
+    for t in transactions:
+        yield TxRecord(t.date, t.txid, t.fee or 0,
+                       [(i.address, i.value, i.prev_txid.hex(), i.output_n_int) for i in t.inputs],
+                       [(o.address, o.value, o.output_n) for o in t.outputs])
+
+
+class WalletAnalysis(object):
+    """
+    Streams the wallet transactions once and fills all accumulators used by the Cryptalyse reports: input and output
+    totals, correlated inputs, the transactions export list and the UTXO snapshots.
+
+    Transactions must be supplied in chronological order. Unconfirmed transactions without a date are included in
+    the totals, exports and correlated inputs, but not in the period totals and UTXO snapshots.
+
+    With partitions=True the input and output totals are also kept per month, so totals for any date range can be
+    derived with date_range() without reading all transactions again.
+    """
+
+    def __init__(self, wallet_name, wallet_addresses, tagged_addresses=None, date_from=None, date_to=None,
+                 keep_export=True, partitions=False):
+        self.wallet_name = wallet_name
+        self.wallet_addresses = wallet_addresses
+        # Dictionary, TagStore or tag store filename, see open_tag_store()
+        self.tagged_addresses = open_tag_store(tagged_addresses)
+        self.date_from = date_from
+        self.date_to = date_to
+        self.keep_export = keep_export
+        self.input_totals = {}
+        # Corrections for the first input per name in input_totals, see merge_input_totals()
+        self.input_first_corrections = {}
+        self.output_totals = {}
+        self.transactions_export = []
+        self._inputs_correlated = set()
+        self._cumulative_value = 0
+        self._day_totals = {}
+        self.utxo_snapshots = UtxoSnapshots(wallet_addresses)
+        self.tx_count = 0
+        # {month index: (input totals, output totals, input first corrections)} of the transactions in that month,
+        # transactions without a date are stored with month index None
+        self.month_totals = {} if partitions else None
+
+    def __getstate__(self):
+        # Wallet addresses and tags are not pickled, use bind() to restore them after loading
+        state = self.__dict__.copy()
+        state['wallet_addresses'] = state['tagged_addresses'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def bind(self, wallet_addresses, tagged_addresses):
+        """
+        Set the wallet addresses and tag store of an analysis loaded from a checkpoint or result cache
+        """
+        self.wallet_addresses = self.utxo_snapshots.wallet_addresses = wallet_addresses
+        self.tagged_addresses = open_tag_store(tagged_addresses)
+        return self
+
+    def in_date_range(self, date):
+        if not date:
+            return True
+        return not ((self.date_from and date < self.date_from) or (self.date_to and date > self.date_to))
+
+    @property
+    def inputs_correlated(self):
+        return list(self._inputs_correlated)
+
+    def run(self, records):
+        for tx in records:
+            self.add(tx)
+        return self
+
+    def export_rows(self, records):
+        """
+        Yields the transactions export rows per transaction as they are calculated. Only updates the cumulative
+        value and daily totals, so with keep_export=False memory use does not grow with the number of transactions.
+        """
+        wlt_addresses = self.wallet_addresses
+        for tx in records:
+            self.tx_count += 1
+            yield from self._add_export(tx, any(i[0] in wlt_addresses for i in tx.inputs))
+
+    def add(self, tx):
+        # Add transaction to all accumulators, returns the transactions export rows for this transaction
+        wlt_addresses = self.wallet_addresses
+        outgoing = any(i[0] in wlt_addresses for i in tx.inputs)
+        self.tx_count += 1
+        rows = self._add_export(tx, outgoing)
+        self.utxo_snapshots.add(tx)
+        if outgoing:
+            self._inputs_correlated.update(i[0] for i in tx.inputs if i[0] not in wlt_addresses)
+        if self.in_date_range(tx.date):
+            self._add_input_totals(tx, outgoing, self.input_totals, self.input_first_corrections)
+            if outgoing:
+                self._add_output_totals(tx, self.output_totals)
+        if self.month_totals is not None:
+            month_input_totals, month_output_totals, month_first_corrections = \
+                self.month_totals.setdefault(period_index(tx.date, 'month') if tx.date else None, ({}, {}, {}))
+            self._add_input_totals(tx, outgoing, month_input_totals, month_first_corrections)
+            if outgoing:
+                self._add_output_totals(tx, month_output_totals)
+        return rows
+
+    def _add_export(self, tx, outgoing):
+        # Same format as Wallet.transactions_export(skip_change=False), returns the rows for this transaction
+        wlt_addresses = self.wallet_addresses
+        input_addresses = [i[0] for i in tx.inputs]
+        rows = []
+        if outgoing:
+            self._cumulative_value -= tx.fee
+            fee_per_output = tx.fee / len(tx.outputs)
+            for o in tx.outputs:
+                o_value = 0 if o[0] in wlt_addresses else -o[1]
+                self._cumulative_value += o_value
+                rows.append((tx.date, tx.txid, 'out', input_addresses, [o[0]], o_value, self._cumulative_value,
+                             fee_per_output))
+        else:
+            for o in tx.outputs:
+                if o[0] not in wlt_addresses:
+                    continue
+                self._cumulative_value += o[1]
+                rows.append((tx.date, tx.txid, 'in', input_addresses, [o[0]], o[1], self._cumulative_value, 0))
+        if rows and tx.date:
+            # Totals in, totals out and closing balance per day, used for period totals
+            day_totals = self._day_totals.setdefault(tx.date.toordinal(), [0, 0, 0])
+            for tei in rows:
+                if tei[5] > 0:
+                    day_totals[0] += tei[5]
+                else:
+                    day_totals[1] -= tei[5]
+            day_totals[2] = self._cumulative_value
+        if self.keep_export:
+            self.transactions_export.extend(rows)
+        return rows
+
+    def _add_input_totals(self, tx, outgoing, totals, first_corrections):
+        wlt_addresses = self.wallet_addresses
+        total_wallet_input = sum([o[1] for o in tx.outputs if o[0] in wlt_addresses])
+        counted_wlt_input = False
+        for address, value, prev_txid, output_n in tx.inputs:
+            prev_tx = "%s:%s" % (prev_txid, output_n)
+            if address in wlt_addresses:
+                i_addr = self.wallet_name
+            else:
+                i_addr = self.tagged_addresses.get(address, address)
+            if i_addr in totals:
+                if outgoing and address in wlt_addresses:
+                    new_value = totals[i_addr][0] - value
+                else:
+                    new_value = totals[i_addr][0] + value
+                totals[i_addr][2].add(address)
+                totals[i_addr][3].append(prev_tx)
+                new_total_wallet_input = totals[i_addr][1]
+                if not counted_wlt_input:
+                    new_total_wallet_input = totals[i_addr][1] + total_wallet_input
+                    counted_wlt_input = True
+                totals[i_addr] = (new_value, new_total_wallet_input, totals[i_addr][2], totals[i_addr][3])
+            else:
+                value_correction = 2 * value if outgoing and address in wlt_addresses else 0
+                wallet_input_correction = total_wallet_input if counted_wlt_input else 0
+                if value_correction or wallet_input_correction:
+                    first_corrections[i_addr] = (value_correction, wallet_input_correction)
+                counted_wlt_input = True
+                totals[i_addr] = (value, total_wallet_input, {address}, [prev_tx])
+
+    def _add_output_totals(self, tx, totals):
+        input_addresses = set([i[0] for i in tx.inputs])
+        for address, value, _ in tx.outputs:
+            if address in self.wallet_addresses:
+                continue
+            o_addr = self.tagged_addresses.get(address, address)
+            if o_addr in totals:
+                totals[o_addr] = (totals[o_addr][0] + value, totals[o_addr][1], totals[o_addr][2] + [tx.txid],
+                                  input_addresses)
+            else:
+                totals[o_addr] = (value, address, [tx.txid], input_addresses)
+
+    def date_range(self, date_from, date_to, edge_records):
+        """
+        Copy of this analysis with the input and output totals of the transactions between date_from and date_to.
+        Requires month partitions. Totals of months within the range are merged from the partitions, the months at
+        the start and end of the range which are only partially included are analysed again: edge_records(start, end)
+        should return the records of the transactions with start <= date < end. Transactions without a date are
+        included in every date range, after the dated transactions.
+
+        All other results do not depend on the date range and are shared with this analysis.
+        """
+        if self.month_totals is None:
+            raise ValueError("Analysis has no month partitions, create it with partitions=True")
+        result = copy.copy(self).bind(self.wallet_addresses, self.tagged_addresses)
+        result.date_from = date_from
+        result.date_to = date_to
+        result.input_totals = {}
+        result.input_first_corrections = {}
+        result.output_totals = {}
+        result.month_totals = None
+        first = period_index(date_from, 'month') if date_from else None
+        last = period_index(date_to, 'month') if date_to else None
+        months = sorted(idx for idx in self.month_totals if idx is not None)
+        if None in self.month_totals:
+            months.append(None)
+        for idx in months:
+            if idx is None:
+                month_input_totals, month_output_totals, month_first_corrections = self.month_totals[idx]
+            elif (first is not None and idx < first) or (last is not None and idx > last):
+                continue
+            elif (date_from and date_from > month_start(idx)) or (date_to and date_to < month_start(idx + 1)):
+                start, end = month_start(idx), month_start(idx + 1)
+                edge = WalletAnalysis(self.wallet_name, self.wallet_addresses, self.tagged_addresses, date_from,
+                                      date_to, keep_export=False).run(edge_records(start, end))
+                month_input_totals, month_output_totals, month_first_corrections = \
+                    edge.input_totals, edge.output_totals, edge.input_first_corrections
+            else:
+                month_input_totals, month_output_totals, month_first_corrections = self.month_totals[idx]
+            for key, correction in month_first_corrections.items():
+                if key not in result.input_totals:
+                    result.input_first_corrections[key] = correction
+            merge_input_totals(result.input_totals, month_input_totals, month_first_corrections)
+            merge_output_totals(result.output_totals, month_output_totals)
+        return result
+
+    def period_totals(self, period='year', last_date=None):
+        """
+        Totals per period as dictionary {period: (total_in, total_out, fees, balance)}. Calculated in one pass over
+        the daily totals, periods without transactions get the balance carried forward.
+        """
+        totals = {}
+        last_balance = 0
+        for idx, days in group_by_period(sorted(self._day_totals), period, last_date):
+            total_in = total_out = 0
+            balance = last_balance
+            for day in days:
+                day_in, day_out, balance = self._day_totals[day]
+                total_in += day_in
+                total_out += day_out
+            fees = (total_in - total_out) - (balance - last_balance)
+            totals[period_label(idx, period)] = (total_in, total_out, fees, balance)
+            last_balance = balance
+        return totals
+
+    def utxos_year(self, last_year):
+        """
+        UTXO set at the end of each year as dictionary {year: {(txid, output_n): (value, address)}}
+        """
+        return dict(self.utxo_snapshots.snapshots('year', date(last_year, 12, 31)))
+
+
+class UtxoSnapshots(object):
+    """
+    Tracks the wallet's UTXO set and records the outputs created and spent per day. Snapshots and address balances
+    at the end of every day, month, quarter or year are derived from these deltas, without copying the UTXO set for
+    every transaction.
+
+    Transactions should be added in chronological order. If an output is spent before the transaction which created
+    it is added, the spend is matched when the output appears. A spend dated before the output is created is counted
+    on the creation day, so snapshots and balances never contain an output before it exists or after it is spent. The
+    inconsistent order is reported in the issues list.
+    """
+
+    def __init__(self, wallet_addresses):
+        self.wallet_addresses = wallet_addresses
+        self.utxos = {}
+        self._deltas = {}
+        self._spent_unknown = {}
+        self._issues = []
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['wallet_addresses'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+    def add(self, tx):
+        # Transactions without a date only update the current UTXO set, they are not part of the snapshots
+        day = tx.date.toordinal() if tx.date else None
+        added, removed = self._deltas.setdefault(day, ([], [])) if day is not None else ([], [])
+        for address, value, prev_txid, output_n in tx.inputs:
+            if address not in self.wallet_addresses:
+                continue
+            outpoint = (prev_txid, output_n)
+            utxo = self.utxos.pop(outpoint, None)
+            if utxo is None:
+                self._spent_unknown[outpoint] = (tx.txid, day)
+            else:
+                removed.append((outpoint, utxo))
+        for address, value, output_n in tx.outputs:
+            if address not in self.wallet_addresses:
+                continue
+            outpoint = (tx.txid, output_n)
+            added.append((outpoint, (value, address)))
+            if outpoint in self._spent_unknown:
+                # Record the spend on the creation day if it is dated before the output exists
+                spending_txid, spending_day = self._spent_unknown.pop(outpoint)
+                if day is not None and spending_day is not None:
+                    self._deltas.setdefault(max(spending_day, day), ([], []))[1].append((outpoint, (value, address)))
+                self._issues.append("Output %s:%d is spent in transaction %s before it is created" %
+                                    (tx.txid, output_n, spending_txid))
+            else:
+                self.utxos[outpoint] = (value, address)
+
+    @property
+    def issues(self):
+        """
+        List of messages describing inconsistent transaction order or spends of unknown outputs
+        """
+        return self._issues + ["Transaction %s spends unknown output %s:%d" % (txid, outpoint[0], outpoint[1])
+                               for outpoint, (txid, _) in self._spent_unknown.items()]
+
+    def _periods(self, period, last_date):
+        # Yields (period index, [(added, removed), ...]) for every period from the first transaction to last_date
+        for idx, days in group_by_period(sorted(self._deltas), period, last_date):
+            yield idx, [self._deltas[day] for day in days]
+
+    def snapshots(self, period='year', last_date=None):
+        """
+        Yields (period label, UTXO set) for the end of every period. A copy of the UTXO set is only made at the
+        period boundaries.
+        """
+        utxos = {}
+        for idx, deltas in self._periods(period, last_date):
+            for added, removed in deltas:
+                utxos.update(added)
+            for added, removed in deltas:
+                for outpoint, _ in removed:
+                    utxos.pop(outpoint, None)
+            yield period_label(idx, period), dict(utxos)
+
+    def balances(self, period='year', last_date=None):
+        """
+        Yields (period label, {address: balance}) for the end of every period
+        """
+        balances = {}
+        for idx, deltas in self._periods(period, last_date):
+            for added, removed in deltas:
+                for _, (value, address) in added:
+                    balances[address] = balances.get(address, 0) + value
+                for _, (value, address) in removed:
+                    balances[address] = balances.get(address, 0) - value
+            yield period_label(idx, period), dict((a, v) for a, v in balances.items() if v)
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Batch analysis of all wallets in a database with a process pool
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import re
+import json
+import time
+import fnmatch
+import traceback
+import multiprocessing
+from datetime import datetime
+from sqlalchemy import func
+from bitcoinlib.db import Db, DbWallet, DbTransaction
+from cryptalyse.cryptalyse import CryptalyseWallet
+from cryptalyse.prices import price_store
+
+
+# Output files per wallet
+#   totals: JSON file with input and output totals, period totals, correlated inputs and address clusters
+#   csv: transactions export as CSV file
+#   xlsx: Excel workbook, written in constant memory mode
+BATCH_EXPORTS = ('totals', 'csv', 'xlsx')
+
+# Report with the status of every wallet, written to the output directory
+batch_report_file = 'batch_report.json'
+
+
+def select_wallets(db_uri, wallets=None):
+    """
+    Wallet names in the database, largest wallets first so the long running jobs start early.
+
+    Wallets can be selected with a list of wallet names, IDs or shell style patterns like 'customer_*'. Select all
+    wallets if not specified. Multisig cosigner wallets are skipped.
+    """
+    session = Db(db_uri=db_uri).session
+    try:
+        tx_counts = dict(session.query(DbTransaction.wallet_id, func.count(DbTransaction.id)).
+                         group_by(DbTransaction.wallet_id).all())
+        db_wallets = [(w.id, w.name) for w in session.query(DbWallet).filter(DbWallet.parent_id.is_(None)).
+                      order_by(DbWallet.id).all()]
+    finally:
+        session.close()
+    if wallets is not None:
+        patterns = [str(w) for w in ([wallets] if isinstance(wallets, (str, int)) else wallets)]
+        db_wallets = [(wid, name) for wid, name in db_wallets
+                      if str(wid) in patterns or any(fnmatch.fnmatchcase(name, p) for p in patterns)]
+    return [name for wid, name in sorted(db_wallets, key=lambda w: -tx_counts.get(w[0], 0))]
+
+
+def _filename(wallet_name):
+    return re.sub(r'[^\w.-]', '_', wallet_name)
+
+
+def wallet_totals(wallet, analysis, totals_period='year'):
+    """
+    Input and output totals, period totals, correlated inputs and address clusters of an analysed wallet as JSON
+    serializable dictionary
+    """
+    input_totals = dict((key, {'value': value[0], 'wallet_input': value[1], 'addresses': sorted(value[2]),
+                               'previous_outputs': value[3]}) for key, value in analysis.input_totals.items())
+    output_totals = dict((key, {'value': value[0], 'address': value[1], 'txids': value[2],
+                                'wallet_addresses': sorted(value[3])}) for key, value in analysis.output_totals.items())
+    clusters = wallet.address_clusters(analysis)
+    return {
+        'wallet': wallet.name,
+        'network': wallet.network.name,
+        'transactions': analysis.tx_count,
+        'input_totals': input_totals,
+        'output_totals': output_totals,
+        'period_totals': dict((str(label), totals) for label, totals in
+                              wallet.export_period_totals(totals_period, analysis.date_to, analysis).items()),
+        'inputs_correlated': sorted(analysis.inputs_correlated),
+        'clusters': {
+            'stats': clusters.stats(),
+            'clusters': sorted([sorted(c) for c in clusters.clusters()], key=lambda c: (-len(c), c)),
+        },
+    }
+
+
+def _worker_init(fiat_currencies):
+    # Load the price stores once per worker process, shared by all wallets analysed by this worker
+    for currency in fiat_currencies:
+        price_store(currency)
+
+
+def analyse_wallet(wallet_name, db_uri, output_dir, tagged_addresses=None, date_from=None, date_to=None,
+                   fiat_currency='eur', exports=('totals', 'csv'), totals_period='year', fiat_currencies=None):
+    """
+    Analyse one wallet and write the requested exports to output_dir. Never raises, errors are returned in the
+    result dictionary.
+    """
+    result = {'wallet': wallet_name, 'status': 'ok', 'files': [], 'error': None, 'pid': os.getpid()}
+    start = time.time()
+    try:
+        date_from = date_from or datetime(2009, 1, 1)
+        date_to = date_to or datetime.today()
+        basename = os.path.join(output_dir, _filename(wallet_name))
+        with CryptalyseWallet(wallet_name, db_uri=db_uri, fiat_currency=fiat_currency) as w:
+            analysis = w.analyse(tagged_addresses, date_from, date_to)
+            result['transactions'] = analysis.tx_count
+            if 'totals' in exports:
+                fn = basename + '_totals.json'
+                with open(fn, 'w') as fp:
+                    json.dump(wallet_totals(w, analysis, totals_period), fp, indent=1)
+                result['files'].append(fn)
+            if 'csv' in exports:
+                fn = basename + '.csv'
+                with open(fn, 'w', newline='') as fp:
+                    w.transactions_export_csv(tagged_addresses, date_from, date_to, file=fp, analysis=analysis,
+                                              fiat_currencies=fiat_currencies)
+                result['files'].append(fn)
+            if 'xlsx' in exports:
+                fn = basename + '.xlsx'
+                w.export_to_excel(fn, tagged_addresses, date_from, date_to, totals_period=totals_period,
+                                  constant_memory=True, fiat_currencies=fiat_currencies)
+                result['files'].append(fn)
+    except Exception as e:
+        result['status'] = 'error'
+        result['error'] = "%s: %s" % (type(e).__name__, e)
+        result['traceback'] = traceback.format_exc()
+    result['seconds'] = round(time.time() - start, 3)
+    return result
+
+
+def _analyse_wallet_args(args):
+    return analyse_wallet(*args)
+
+
+def run_batch(db_uri, wallets=None, output_dir='.', processes=None, tagged_addresses=None, date_from=None,
+              date_to=None, fiat_currency='eur', exports=('totals', 'csv'), totals_period='year', fiat_currencies=None):
+    """
+    Analyse all selected wallets of a database in a process pool and write per wallet output files.
+
+    Every worker opens its own database connection per wallet and loads the price store once. Wallets are handed out
+    one at a time, largest first, so the work is spread evenly over the workers. Use processes=1 to run in the
+    current process.
+
+    Returns a list with a result dictionary per wallet, which is also written to batch_report.json in output_dir.
+    """
+    for export in exports:
+        if export not in BATCH_EXPORTS:
+            raise ValueError("Unknown export %s, use one of %s" % (export, BATCH_EXPORTS))
+    os.makedirs(output_dir, exist_ok=True)
+    wallet_names = select_wallets(db_uri, wallets)
+    tasks = [(name, db_uri, output_dir, tagged_addresses, date_from, date_to, fiat_currency, exports, totals_period,
+              fiat_currencies) for name in wallet_names]
+    if isinstance(fiat_currencies, str):
+        fiat_currencies = [fiat_currencies]
+    currencies = set([fiat_currency] + list(fiat_currencies or []))
+    start = time.time()
+    if processes == 1 or len(tasks) <= 1:
+        _worker_init(currencies)
+        results = [_analyse_wallet_args(task) for task in tasks]
+    else:
+        with multiprocessing.Pool(processes, initializer=_worker_init, initargs=(currencies,)) as pool:
+            results = list(pool.imap_unordered(_analyse_wallet_args, tasks, chunksize=1))
+    order = dict((name, n) for n, name in enumerate(wallet_names))
+    results.sort(key=lambda r: order[r['wallet']])
+
+    report = {
+        'date': datetime.today().isoformat(),
+        'seconds': round(time.time() - start, 3),
+        'wallets': len(results),
+        'errors': len([r for r in results if r['status'] != 'ok']),
+        'results': results,
+    }
+    with open(os.path.join(output_dir, batch_report_file), 'w') as fp:
+        json.dump(report, fp, indent=1)
+    for r in results:
+        if r['status'] != 'ok':
+            print("Error analysing wallet %s: %s" % (r['wallet'], r['error']))
+    return results
@@ -0,0 +1,389 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Benchmarks of the analysis and export methods on synthetic wallets
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import shutil
+import hashlib
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from bitcoinlib.keys import HDKey
+from bitcoinlib.encoding import pubkeyhash_to_addr_bech32
+from bitcoinlib.wallets import wallet_exists
+from bitcoinlib.db import DbTransaction, DbTransactionInput, DbTransactionOutput
+from cryptalyse.cryptalyse import CryptalyseWallet
+
+
+# Methods to benchmark. Each method is called with the wallet and a context dictionary with the tagged addresses,
+# date range and a temporary output directory.
+BENCHMARK_METHODS = {
+    'input_totals': lambda w, c: w.input_totals(c['tagged_addresses']),
+    'output_totals': lambda w, c: w.output_totals(c['tagged_addresses']),
+    'clusters': lambda w, c: w.clusters(),
+    'export_utxos_year': lambda w, c: w.export_utxos_year(),
+    'export_balance_totals': lambda w, c: w.export_balance_totals(),
+    'transactions_export_tuples': lambda w, c: w.transactions_export_tuples(c['tagged_addresses']),
+    'flow_graph_trace': lambda w, c: w.flow_graph().taint(list(w.address_index), 5),
+    'export_to_excel': lambda w, c: w.export_to_excel(os.path.join(c['output_dir'], 'benchmark.xlsx'),
+                                                      c['tagged_addresses'], c['date_from'], c['date_to']),
+}
+
+# Methods which need optional libraries
+BENCHMARK_REQUIREMENTS = {
+    'export_to_excel': ('pandas', 'xlsxwriter'),
+}
+
+# A scaling exponent above this value means the run time grows faster than n*log(n) with the number of transactions
+SCALING_WARNING = 1.5
+
+# Startup time budget in seconds of the command line interface, on top of the start of the Python interpreter. The
+# CLI must not import these modules before a command is run.
+STARTUP_BUDGET = 0.15
+STARTUP_HEAVY_MODULES = ('bitcoinlib', 'sqlalchemy', 'numpy', 'pandas', 'xlsxwriter', 'pyarrow', 'requests')
+
+benchmark_start_year = 2015
+
+
+def _external_address(rnd):
+    # Random P2WPKH address and locking script
+    address_hash = rnd.getrandbits(160).to_bytes(20, 'big')
+    return pubkeyhash_to_addr_bech32(address_hash), b'\x00\x14' + address_hash
+
+
+def synthetic_wallet(db_uri, n_transactions=1000, n_addresses=50, inputs_per_transaction=3, years=5, seed=1,
+                     name=None, n_external=None, fiat_currency='eur'):
+    """
+    Create a wallet with synthetic transactions directly in a bitcoinlib database, without network access.
+
+    Incoming transactions pay an external address to a wallet address, outgoing transactions spend 1 to
+    inputs_per_transaction unspent outputs of the wallet to an external address and a change address. The
+    transactions are spread over the given number of years. Wallets are deterministic for a given seed, an existing
+    wallet with the same name is reused.
+
+    Returns a tuple with the CryptalyseWallet and a dictionary of tagged external addresses.
+    """
+    rnd = random.Random(seed)
+    name = name or 'benchmark_%d_%d_%d_%d_%d' % (n_transactions, n_addresses, inputs_per_transaction, years, seed)
+    n_external = n_external or n_addresses
+    external = [_external_address(rnd) for _ in range(n_external)]
+    tagged_addresses = dict((a, 'Tag %d' % (n % 5)) for n, (a, _) in enumerate(external[::3]))
+    if wallet_exists(name, db_uri=db_uri):
+        return CryptalyseWallet(name, db_uri=db_uri, fiat_currency=fiat_currency), tagged_addresses
+
+    master = HDKey.from_seed(hashlib.sha256(b'cryptalyse benchmark %d' % seed).digest(), network='bitcoin')
+    w = CryptalyseWallet.create(name, keys=master, network='bitcoin', witness_type='segwit', db_uri=db_uri,
+                                fiat_currency=fiat_currency)
+    keys = [(k.key_id, k.address, b'\x00\x14' + k.key().hash160) for k in w.get_keys(number_of_keys=n_addresses)]
+
+    session = w.session
+    first_id = (session.query(func.max(DbTransaction.id)).scalar() or 0) + 1
+    span = timedelta(days=365.25 * years).total_seconds()
+    start = datetime(benchmark_start_year, 1, 1)
+    dates = sorted(start + timedelta(seconds=rnd.random() * span) for _ in range(n_transactions))
+    transactions, inputs, outputs = [], [], []
+    utxos = []
+    for n, date in enumerate(dates):
+        tx_id = first_id + n
+        txid = hashlib.sha256(b'%s %d' % (name.encode(), n)).digest()
+        ins, outs = [], []
+        fee = rnd.randint(200, 5000)
+        if utxos and rnd.random() < 0.4:
+            k = rnd.randint(1, min(inputs_per_transaction, len(utxos)))
+            spend = [utxos.pop(rnd.randrange(len(utxos))) for _ in range(k)]
+            total = sum(u[2] for u in spend)
+            fee = min(fee, total // 4)
+            for u in spend:
+                u[5]['spent'] = True
+                u[5]['spending_txid'] = txid
+            ins = [(u[3], u[4], u[0], u[1], u[2]) for u in spend]
+            pay = rnd.randint(1, max(1, (total - fee) // 2))
+            key = rnd.choice(keys)
+            address, script = rnd.choice(external)
+            outs = [(None, address, pay, script), (key[0], key[1], total - fee - pay, key[2])]
+        else:
+            value = rnd.randint(10000, 10000000)
+            key = rnd.choice(keys)
+            prev_txid = hashlib.sha256(b'%s prev %d' % (name.encode(), n)).digest()
+            ins = [(None, rnd.choice(external)[0], prev_txid, rnd.randint(0, 3), value + fee)]
+            outs = [(key[0], key[1], value, key[2])]
+        input_total = sum(i[4] for i in ins)
+        output_total = sum(o[2] for o in outs)
+        transactions.append({
+            'id': tx_id, 'txid': txid, 'wallet_id': w.wallet_id, 'account_id': 0, 'date': date,
+            'status': 'confirmed', 'confirmations': n_transactions - n + 10, 'block_height': 350000 + n,
+            'fee': input_total - output_total, 'network_name': 'bitcoin', 'witness_type': 'segwit',
+            'input_total': input_total, 'output_total': output_total, 'is_complete': True, 'verified': True})
+        for index_n, (key_id, address, prev_txid, output_n, value) in enumerate(ins):
+            inputs.append({
+                'transaction_id': tx_id, 'index_n': index_n, 'key_id': key_id, 'address': address,
+                'prev_txid': prev_txid, 'output_n': output_n, 'value': value, 'witness_type': 'segwit',
+                'script_type': 'sig_pubkey', 'sequence': 0xffffffff})
+        for output_n, (key_id, address, value, script) in enumerate(outs):
+            output = {
+                'transaction_id': tx_id, 'output_n': output_n, 'key_id': key_id, 'address': address,
+                'value': value, 'script': script, 'script_type': 'p2wpkh', 'spent': False, 'is_change': False}
+            outputs.append(output)
+            if key_id:
+                utxos.append((txid, output_n, value, key_id, address, output))
+    session.bulk_insert_mappings(DbTransaction, transactions)
+    session.bulk_insert_mappings(DbTransactionInput, inputs)
+    session.bulk_insert_mappings(DbTransactionOutput, outputs)
+    session.commit()
+    return w, tagged_addresses
+
+
+def _missing_requirements(method):
+    missing = []
+    for module in BENCHMARK_REQUIREMENTS.get(method, ()):
+        try:
+            __import__(module)
+        except ImportError:
+            missing.append(module)
+    return missing
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=10,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def measure(method, wallet, context, repeat=3):
+    """
+    Time a benchmark method and measure the peak memory allocated while it runs.
+
+    The method is called repeat times without memory tracing, the fastest run is used as run time. Peak memory is
+    measured with tracemalloc in a separate run, because tracing slows down the method. The wallet's analysis cache
+    is cleared before every run, so every run analyses all transactions.
+    """
+    f = BENCHMARK_METHODS[method]
+    times = []
+    for _ in range(repeat):
+        wallet.clear_analysis_cache()
+        start = time.perf_counter()
+        f(wallet, context)
+        times.append(time.perf_counter() - start)
+    wallet.clear_analysis_cache()
+    tracemalloc.start()
+    try:
+        f(wallet, context)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': min(times), 'seconds_all': times, 'peak_memory': peak_memory}
+
+
+def scaling_exponents(results):
+    """
+    Fit run time = a * n_transactions ^ exponent for every method with a least squares fit on a log-log scale.
+    An exponent around 1 means linear scaling, around 2 quadratic.
+    """
+    points = {}
+    for r in results:
+        if r.get('seconds'):
+            points.setdefault(r['method'], []).append((math.log(r['n_transactions']), math.log(r['seconds'])))
+    exponents = {}
+    for method, xy in points.items():
+        if len(set(x for x, _ in xy)) < 2:
+            continue
+        mx = sum(x for x, _ in xy) / len(xy)
+        my = sum(y for _, y in xy) / len(xy)
+        exponents[method] = \
+            round(sum((x - mx) * (y - my) for x, y in xy) / sum((x - mx) ** 2 for x, _ in xy), 3)
+    return exponents
+
+
+def startup_benchmark(repeat=5, budget=STARTUP_BUDGET):
+    """
+    Measure the time to start 'python -m cryptalyse --help' in a new process and check it against the startup
+    budget. Also checks that importing the command line interface doesn't import any of the heavy modules.
+    """
+    env = dict(os.environ)
+    package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join([package_dir] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+
+    def run(args):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            subprocess.run([sys.executable] + args, env=env, check=True, stdout=subprocess.DEVNULL)
+            times.append(time.perf_counter() - start)
+        return min(times)
+
+    python_seconds = run(['-c', 'pass'])
+    seconds = run(['-m', 'cryptalyse', '--help'])
+    check = "import sys, cryptalyse.cli; print(','.join(m for m in %r if m in sys.modules))" % \
+            (STARTUP_HEAVY_MODULES, )
+    heavy_modules = subprocess.run([sys.executable, '-c', check], env=env, check=True, capture_output=True,
+                                   text=True).stdout.strip()
+    heavy_modules = heavy_modules.split(',') if heavy_modules else []
+    overhead = seconds - python_seconds
+    return {'seconds': seconds, 'python_seconds': python_seconds, 'overhead': overhead, 'budget': budget,
+            'heavy_modules': heavy_modules, 'ok': overhead <= budget and not heavy_modules}
+
+
+def run_benchmarks(sizes=(1000, 5000, 20000), methods=None, db_uri=None, repeat=3, n_addresses=50,
+                   inputs_per_transaction=3, years=5, seed=1, output_file=None):
+    """
+    Run the benchmark methods on synthetic wallets with the given numbers of transactions.
+
+    Wallets are generated in the SQLite database db_uri, a temporary database is used if not specified. Use an
+    existing database to skip generation of wallets on the next run.
+
+    Returns a dictionary with the environment, parameters, a result per method and wallet size and the scaling
+    exponents. The results are also written as JSON to output_file if specified.
+    """
+    methods = list(methods or BENCHMARK_METHODS)
+    for method in methods:
+        if method not in BENCHMARK_METHODS:
+            raise ValueError("Unknown benchmark method %s, use one of %s" % (method, list(BENCHMARK_METHODS)))
+    tmp_dir = tempfile.mkdtemp(prefix='cryptalyse_benchmark_')
+    db_uri = db_uri or os.path.join(tmp_dir, 'benchmark.sqlite')
+    date_from = datetime(benchmark_start_year, 1, 1)
+    context = {'date_from': date_from, 'date_to': datetime(benchmark_start_year + years, 12, 31),
+               'output_dir': tmp_dir}
+
+    results = []
+    try:
+        for n_transactions in sizes:
+            start = time.perf_counter()
+            wallet, context['tagged_addresses'] = synthetic_wallet(
+                db_uri, n_transactions, n_addresses, inputs_per_transaction, years, seed)
+            generate_seconds = time.perf_counter() - start
+            print("Wallet with %d transactions ready in %.2f seconds" % (n_transactions, generate_seconds))
+            for method in methods:
+                result = {'method': method, 'n_transactions': n_transactions, 'n_addresses': n_addresses,
+                          'inputs_per_transaction': inputs_per_transaction, 'years': years}
+                missing = _missing_requirements(method)
+                if missing:
+                    result['skipped'] = "Missing libraries: %s" % ', '.join(missing)
+                else:
+                    result.update(measure(method, wallet, context, repeat))
+                    print("  %-28s %10.4f s %12d bytes" % (method, result['seconds'], result['peak_memory']))
+                results.append(result)
+            wallet.session.close()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    startup = startup_benchmark(repeat)
+    print("Startup of the command line interface: %.3f s, %.3f s above Python startup, budget %.3f s" %
+          (startup['seconds'], startup['overhead'], startup['budget']))
+    if not startup['ok']:
+        print("Warning: startup budget exceeded or heavy modules imported: %s" % startup['heavy_modules'])
+
+    report = {
+        'date': datetime.today().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'git_commit': _git_commit(),
+        'parameters': {'sizes': list(sizes), 'repeat': repeat, 'n_addresses': n_addresses,
+                       'inputs_per_transaction': inputs_per_transaction, 'years': years, 'seed': seed},
+        'results': results,
+        'scaling': scaling_exponents(results),
+        'startup': startup,
+    }
+    for method, exponent in report['scaling'].items():
+        if exponent > SCALING_WARNING:
+            print("Warning: run time of %s scales with n^%.2f" % (method, exponent))
+    if output_file:
+        with open(output_file, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    return report
+
+
+def compare_benchmarks(baseline, report, threshold=1.25):
+    """
+    Compare benchmark results with the results of a baseline run, both as returned by run_benchmarks() or as
+    filename of a JSON results file.
+
+    Returns a list of regressions: (method, n_transactions, measure, baseline value, new value) tuples for all run
+    times and peak memory values which grew more than the threshold factor.
+    """
+    if isinstance(baseline, str):
+        with open(baseline) as fp:
+            baseline = json.load(fp)
+    if isinstance(report, str):
+        with open(report) as fp:
+            report = json.load(fp)
+    baseline_results = dict(((r['method'], r['n_transactions']), r) for r in baseline['results'])
+    regressions = []
+    for r in report['results']:
+        old = baseline_results.get((r['method'], r['n_transactions']))
+        if not old:
+            continue
+        for measure_name in ('seconds', 'peak_memory'):
+            if old.get(measure_name) and r.get(measure_name) and r[measure_name] > old[measure_name] * threshold:
+                regressions.append((r['method'], r['n_transactions'], measure_name, old[measure_name],
+                                    r[measure_name]))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analysis and export methods on synthetic wallets")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000],
+                        help="Numbers of transactions of the synthetic wallets")
+    parser.add_argument('--methods', nargs='+', choices=list(BENCHMARK_METHODS), help="Methods to benchmark")
+    parser.add_argument('--database', help="SQLite database file for the synthetic wallets, reused on the next run")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--addresses', type=int, default=50, help="Number of wallet addresses")
+    parser.add_argument('--inputs', type=int, default=3, help="Maximum number of inputs per transaction")
+    parser.add_argument('--years', type=int, default=5, help="Years over which transactions are spread")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to")
+    parser.add_argument('--compare', help="JSON results file of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help="Report a regression if a measure grew more than this factor")
+    parser.add_argument('--startup-only', action='store_true',
+                        help="Only check the startup time of the command line interface")
+    args = parser.parse_args(args)
+
+    if args.startup_only:
+        startup = startup_benchmark(args.repeat)
+        print(json.dumps(startup, indent=1))
+        return 0 if startup['ok'] else 1
+
+    report = run_benchmarks(args.sizes, args.methods, args.database, args.repeat, args.addresses, args.inputs,
+                            args.years, args.seed, args.output)
+    print("Results written to %s" % args.output)
+    status = 0 if report['startup']['ok'] else 1
+    if args.compare:
+        regressions = compare_benchmarks(args.compare, report, args.threshold)
+        for method, n_transactions, measure_name, old, new in regressions:
+            print("Regression %s with %d transactions: %s %s -> %s" % (method, n_transactions, measure_name, old, new))
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Persistent wallet analysis checkpoints, to update an analysis with new transactions only
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import pickle
+import hashlib
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from sqlalchemy.orm import declarative_base
+
+
+Base = declarative_base()
+
+
+class DbAnalysisCheckpoint(Base):
+    """
+    Pickled WalletAnalysis after the first 'transactions' transactions of a wallet, for one set of analysis arguments.
+    The digest identifies the processed transactions and their order.
+    """
+    __tablename__ = 'cryptalyse_analysis_checkpoints'
+    wallet_id = Column(Integer, primary_key=True)
+    key = Column(String(64), primary_key=True)
+    transactions = Column(Integer, nullable=False, default=0)
+    digest = Column(String(64), nullable=False)
+    keys_fingerprint = Column(String(100), nullable=False)
+    date = Column(DateTime, default=datetime.utcnow)
+    data = Column(LargeBinary(length=2 ** 32 - 1), nullable=False)
+
+
+def transactions_digest(rows, digest=None):
+    """
+    Update a blake2b digest with (database id, block height) of the transaction rows, in the given order. A
+    transaction inserted before existing transactions or moved to another block by a reorg changes the digest.
+    """
+    if digest is None:
+        digest = hashlib.blake2b(digest_size=32)
+    for row in rows:
+        digest.update(b'%d:%d;' % (row[0], row[1] or 0))
+    return digest
+
+
+class AnalysisCheckpoints(object):
+    """
+    Analysis checkpoints of wallets in a bitcoinlib database, stored in a table in the same database. Only one
+    checkpoint per wallet and key is kept, the key identifies the analysis arguments.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        Base.metadata.create_all(self.session.get_bind())
+
+    @staticmethod
+    def key(*args):
+        return hashlib.sha256(repr(args).encode()).hexdigest()
+
+    def load(self, wallet_id, key):
+        """
+        Returns the DbAnalysisCheckpoint for this wallet and key, or None
+        """
+        return self.session.query(DbAnalysisCheckpoint).\
+            filter(DbAnalysisCheckpoint.wallet_id == wallet_id, DbAnalysisCheckpoint.key == key).scalar()
+
+    @staticmethod
+    def analysis(checkpoint):
+        return pickle.loads(checkpoint.data)
+
+    def save(self, wallet_id, key, analysis, n_transactions, digest, keys_fingerprint):
+        checkpoint = self.load(wallet_id, key)
+        if checkpoint is None:
+            checkpoint = DbAnalysisCheckpoint(wallet_id=wallet_id, key=key)
+            self.session.add(checkpoint)
+        checkpoint.transactions = n_transactions
+        checkpoint.digest = digest
+        checkpoint.keys_fingerprint = keys_fingerprint
+        checkpoint.date = datetime.utcnow()
+        checkpoint.data = pickle.dumps(analysis, protocol=pickle.HIGHEST_PROTOCOL)
+        self.session.commit()
+
+    def delete(self, wallet_id):
+        self.session.query(DbAnalysisCheckpoint).filter(DbAnalysisCheckpoint.wallet_id == wallet_id).\
+            delete(synchronize_session=False)
+        self.session.commit()
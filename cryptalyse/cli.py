@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Command line interface: python -m cryptalyse <command>
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+# Only light standard library modules are imported here, so starting the command and printing help is fast.
+# bitcoinlib, numpy, pandas and xlsxwriter are imported by the commands which need them.
+import os
+import sys
+import json
+import argparse
+from datetime import datetime
+
+
+def load_tagged_addresses(filename):
+    """
+    Tag store for the --tags argument: a JSON or CSV file, a SQLite tag database or a sorted tag file
+    """
+    from cryptalyse.tags import open_tag_store
+
+    return open_tag_store(filename)
+
+
+def _date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("Invalid date %s, use YYYY-MM-DD" % value)
+
+
+def _open_wallet(args):
+    from bitcoinlib.wallets import wallet_exists
+    from cryptalyse.cryptalyse import CryptalyseWallet
+
+    if not wallet_exists(args.wallet, db_uri=args.database):
+        raise SystemExit("Wallet %s not found" % args.wallet)
+    return CryptalyseWallet(args.wallet, db_uri=args.database, fiat_currency=args.fiat[0],
+                            analysis_checkpoints=args.checkpoints)
+
+
+def _fiat_currencies(args):
+    return args.fiat if len(args.fiat) > 1 else None
+
+
+def _write_json(data, filename=None):
+    if filename:
+        with open(filename, 'w') as fp:
+            json.dump(data, fp, indent=1, default=str)
+    else:
+        json.dump(data, sys.stdout, indent=1, default=str)
+        sys.stdout.write('\n')
+
+
+def cmd_export_csv(args):
+    with _open_wallet(args) as w:
+        tags = load_tagged_addresses(args.tags)
+        if args.output:
+            with open(args.output, 'w', newline='') as fp:
+                w.transactions_export_csv(tags, args.date_from, args.date_to, file=fp,
+                                          fiat_currencies=_fiat_currencies(args))
+        else:
+            w.transactions_export_csv(tags, args.date_from, args.date_to, file=sys.stdout,
+                                      fiat_currencies=_fiat_currencies(args))
+
+
+def cmd_export_xlsx(args):
+    with _open_wallet(args) as w:
+        w.export_to_excel(args.output, load_tagged_addresses(args.tags), args.date_from or datetime(2009, 1, 1),
+                          args.date_to or datetime.today(), totals_period=args.totals_period,
+                          constant_memory=args.constant_memory, fiat_currencies=_fiat_currencies(args))
+
+
+def cmd_totals(args):
+    from cryptalyse.batch import wallet_totals
+
+    with _open_wallet(args) as w:
+        analysis = w.analyse(load_tagged_addresses(args.tags), args.date_from, args.date_to or datetime.today())
+        _write_json(wallet_totals(w, analysis, args.period), args.output)
+
+
+def cmd_clusters(args):
+    with _open_wallet(args) as w:
+        clusters = w.address_clusters()
+        _write_json({'stats': clusters.stats(),
+                     'clusters': sorted([sorted(c) for c in clusters.clusters()], key=lambda c: (-len(c), c))},
+                    args.output)
+
+
+def cmd_cluster_index(args):
+    from cryptalyse.cluster_index import ClusterIndex
+
+    index = ClusterIndex(args.database)
+    if args.rebuild:
+        print("Rebuilt cluster index: %s" % index.rebuild(), file=sys.stderr)
+    elif not args.no_update:
+        print("Updated cluster index: %s" % index.update(), file=sys.stderr)
+    if not args.addresses:
+        _write_json(index.stats(), args.output)
+        return
+    result = {}
+    for address in args.addresses:
+        try:
+            cluster_id = index.cluster_id(address)
+        except KeyError:
+            result[address] = None
+            continue
+        result[address] = {'cluster_id': cluster_id, 'size': index.size(cluster_id),
+                           'addresses': sorted(index.addresses(cluster_id))}
+    _write_json(result, args.output)
+
+
+def cmd_build_tags(args):
+    from cryptalyse.tags import create_tag_store
+
+    store = create_tag_store(args.output, args.source, args.error_rate)
+    print("Created tag store %s with %d addresses" % (args.output, len(store)), file=sys.stderr)
+
+
+def cmd_trace(args):
+    with _open_wallet(args) as w:
+        graph = w.flow_graph(fetch_addresses=args.addresses if args.fetch else None)
+        direction = 'upstream' if args.upstream else 'downstream'
+        if args.taint:
+            result = graph.taint(args.addresses, args.max_hops, direction, args.min_value)
+        else:
+            result = graph.trace(args.addresses, args.max_hops, direction, args.min_value, not args.ignore_time)
+        print("Traced %d addresses in a graph of %d addresses and %d edges" %
+              (len(result), graph.n_nodes, graph.n_edges), file=sys.stderr)
+        _write_json(result, args.output)
+
+
+def cmd_reconstruct(args):
+    with _open_wallet(args) as w:
+        result = w.reconstruct(args.max_rounds, args.max_addresses, args.max_seconds, not args.no_initial_scan,
+                               args.scan_gap_limit)
+        _write_json(result, args.output)
+
+
+def cmd_fetch_prices(args):
+    import asyncio
+    from cryptalyse.kraken_fetch_price_history import fetch_ohlc_pairs, PRICE_DIR
+
+    results = asyncio.run(fetch_ohlc_pairs(args.pairs, args.timeframes, output_dir=args.output_dir or PRICE_DIR,
+                                           concurrency=args.concurrency))
+    if any(isinstance(r, Exception) for r in results.values()):
+        return 1
+
+
+def parser():
+    p = argparse.ArgumentParser(prog='cryptalyse', description="Analyse and export cryptocurrency wallets")
+    commands = p.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    wallet_args = argparse.ArgumentParser(add_help=False)
+    wallet_args.add_argument('wallet', help="Wallet name")
+    wallet_args.add_argument('--database', '-d', help="bitcoinlib database URI, default is the bitcoinlib database")
+    wallet_args.add_argument('--fiat', nargs='+', default=['eur'], type=str.lower,
+                             help="Fiat currency, or several currencies to export values in all of them")
+    wallet_args.add_argument('--tags', help="Tagged addresses: JSON or CSV file, SQLite (.sqlite) or sorted (.tags) "
+                                            "tag store")
+    wallet_args.add_argument('--date-from', type=_date)
+    wallet_args.add_argument('--date-to', type=_date)
+    wallet_args.add_argument('--checkpoints', action='store_true',
+                             help="Store the analysis in the database and only analyse new transactions next time")
+
+    c = commands.add_parser('export-csv', parents=[wallet_args], help="Export transactions as CSV")
+    c.add_argument('--output', '-o', help="CSV file, default is standard output")
+    c.set_defaults(func=cmd_export_csv)
+
+    c = commands.add_parser('export-xlsx', parents=[wallet_args], help="Export wallet report as Excel workbook")
+    c.add_argument('output', help="Excel file")
+    c.add_argument('--totals-period', choices=['day', 'month', 'quarter'], help="Add a sheet with totals per period")
+    c.add_argument('--constant-memory', action='store_true', help="Stream rows to the workbook, for large wallets")
+    c.set_defaults(func=cmd_export_xlsx)
+
+    c = commands.add_parser('totals', parents=[wallet_args], help="Input, output and period totals as JSON")
+    c.add_argument('--period', default='year', choices=['day', 'month', 'quarter', 'year'])
+    c.add_argument('--output', '-o', help="JSON file, default is standard output")
+    c.set_defaults(func=cmd_totals)
+
+    c = commands.add_parser('clusters', parents=[wallet_args], help="Address clusters as JSON")
+    c.add_argument('--output', '-o', help="JSON file, default is standard output")
+    c.set_defaults(func=cmd_clusters)
+
+    c = commands.add_parser('cluster-index', help="Clusters of addresses over all wallets in the database")
+    c.add_argument('addresses', nargs='*', help="Addresses to look up, show index statistics if not specified")
+    c.add_argument('--database', '-d', help="bitcoinlib database URI, default is the bitcoinlib database")
+    c.add_argument('--no-update', action='store_true', help="Don't add new transactions to the index first")
+    c.add_argument('--rebuild', action='store_true', help="Rebuild the index from all transactions")
+    c.add_argument('--output', '-o', help="JSON file, default is standard output")
+    c.set_defaults(func=cmd_cluster_index)
+
+    c = commands.add_parser('trace', parents=[wallet_args], help="Follow funds from addresses over several hops")
+    c.add_argument('addresses', nargs='+', help="Addresses to start from")
+    c.add_argument('--upstream', action='store_true', help="Trace where funds came from instead of where they went")
+    c.add_argument('--max-hops', type=int, default=3)
+    c.add_argument('--min-value', type=int, default=0, help="Only follow flows of at least this value in satoshi")
+    c.add_argument('--taint', action='store_true', help="Output the amount received per address instead of hops")
+    c.add_argument('--ignore-time', action='store_true', help="Also follow flows which happened earlier")
+    c.add_argument('--fetch', action='store_true',
+                   help="Fetch the transactions of the addresses from the service providers first")
+    c.add_argument('--output', '-o', help="JSON file, default is standard output")
+    c.set_defaults(func=cmd_trace)
+
+    c = commands.add_parser('reconstruct', parents=[wallet_args],
+                            help="Import and scan correlated input addresses until no new addresses are found")
+    c.add_argument('--max-rounds', type=int, default=10)
+    c.add_argument('--max-addresses', type=int)
+    c.add_argument('--max-seconds', type=float)
+    c.add_argument('--no-initial-scan', action='store_true')
+    c.add_argument('--scan-gap-limit', type=int, default=5)
+    c.add_argument('--output', '-o', help="JSON file, default is standard output")
+    c.set_defaults(func=cmd_reconstruct)
+
+    c = commands.add_parser('build-tags', help="Create a tag store from a JSON or CSV file with tagged addresses")
+    c.add_argument('source', help="JSON or CSV file with addresses and tags")
+    c.add_argument('output', help="Tag store to create: SQLite database (.sqlite) or sorted file (.tags)")
+    c.add_argument('--error-rate', type=float, default=0.01, help="False positive rate of the Bloom filter")
+    c.set_defaults(func=cmd_build_tags)
+
+    c = commands.add_parser('fetch-prices', help="Update the price history files from Kraken")
+    c.add_argument('--pairs', nargs='+', default=['BTC/EUR', 'BTC/USD'])
+    c.add_argument('--timeframes', nargs='+', default=['1440'],
+                   help="Candle length in minutes: 1 for minute, 60 for hourly and 1440 for daily prices")
+    c.add_argument('--output-dir', help="Directory of the price files, default is the cryptalyse package directory")
+    c.add_argument('--concurrency', type=int, default=4)
+    c.set_defaults(func=cmd_fetch_prices)
+    return p
+
+
+def main(args=None):
+    args = parser().parse_args(args)
+    try:
+        return args.func(args) or 0
+    except BrokenPipeError:
+        # Output is piped to a process which stopped reading, i.e. head. Prevent another error at exit.
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Persistent address cluster index of all wallets in a database
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+from collections import Counter
+from sqlalchemy import Column, Integer, BigInteger, String, Sequence, func
+from sqlalchemy.orm import declarative_base
+from bitcoinlib.db import Db, DbKey, DbTransaction, DbTransactionInput
+from cryptalyse.clustering import AddressClusters
+
+
+Base = declarative_base()
+
+
+class DbClusterAddress(Base):
+    """
+    Cluster of every input address. Addresses point directly to their cluster, so lookups are a single indexed query.
+    """
+    __tablename__ = 'cryptalyse_cluster_addresses'
+    address = Column(String(255), primary_key=True)
+    cluster_id = Column(Integer, index=True, nullable=False)
+
+
+class DbCluster(Base):
+    __tablename__ = 'cryptalyse_clusters'
+    id = Column(Integer, Sequence('cryptalyse_cluster_id_seq'), primary_key=True)
+    size = Column(Integer, nullable=False, default=0)
+
+
+class DbClusterState(Base):
+    __tablename__ = 'cryptalyse_cluster_state'
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger)
+
+
+# Maximum number of parameters in a single IN clause
+_in_chunk_size = 500
+
+
+def _chunks(items, size=_in_chunk_size):
+    items = list(items)
+    for pos in range(0, len(items), size):
+        yield items[pos:pos + size]
+
+
+class ClusterIndex(object):
+    """
+    Common-input-ownership clusters of the input addresses of all transactions in a bitcoinlib database, stored in
+    tables in the same database.
+
+    The index is updated incrementally with update(): only transactions added to the database since the last update
+    are read. Clusters are merged by relabelling the addresses of the smallest cluster, so every address is relabelled
+    at most log(n) times.
+
+    Use cluster_id() and cluster() to look up clusters with indexed queries, without reading any transactions.
+    """
+
+    def __init__(self, db_uri=None, session=None):
+        self.session = session if session is not None else Db(db_uri=db_uri).session
+        Base.metadata.create_all(self.session.get_bind())
+
+    def _state(self, name, for_update=False):
+        qr = self.session.query(DbClusterState).filter(DbClusterState.name == name)
+        if for_update:
+            qr = qr.with_for_update()
+        state = qr.scalar()
+        if state is None:
+            state = DbClusterState(name=name, value=0)
+            self.session.add(state)
+        return state
+
+    @property
+    def last_transaction_id(self):
+        return self._state('last_transaction_id').value
+
+    def update(self, chunk_size=10000, max_seconds=None):
+        """
+        Add the input addresses of all transactions added to the database since the last update. Transactions are
+        processed in chunks of chunk_size database ids, every chunk is committed separately so an interrupted update
+        continues where it stopped.
+
+        Returns a dictionary with the number of transactions and new addresses read and the number of merged clusters.
+        """
+        start = time.time()
+        stats = {'transactions': 0, 'addresses': 0, 'merged': 0}
+        max_id = self.session.query(func.max(DbTransaction.id)).scalar() or 0
+        while True:
+            state = self._state('last_transaction_id', for_update=True)
+            last_id = state.value
+            if last_id >= max_id or (max_seconds and time.time() - start >= max_seconds):
+                self.session.commit()
+                break
+            to_id = min(last_id + chunk_size, max_id)
+            tx_inputs = {}
+            for tx_id, address, key_address in self.session.query(
+                    DbTransactionInput.transaction_id, DbTransactionInput.address, DbKey.address).\
+                    outerjoin(DbKey, DbKey.id == DbTransactionInput.key_id).\
+                    filter(DbTransactionInput.transaction_id > last_id, DbTransactionInput.transaction_id <= to_id):
+                address = address or key_address
+                if address:
+                    tx_inputs.setdefault(tx_id, set()).add(address)
+            added, merged = self._add(tx_inputs.values())
+            state.value = to_id
+            self.session.commit()
+            stats['transactions'] += len(tx_inputs)
+            stats['addresses'] += added
+            stats['merged'] += merged
+        stats['seconds'] = round(time.time() - start, 3)
+        return stats
+
+    def _add(self, address_sets):
+        # Union the address sets in memory, with the existing clusters as extra nodes. Every connected component is
+        # then written to the largest existing cluster in the component, or to a new cluster.
+        address_sets = [s for s in address_sets if s]
+        addresses = set().union(*address_sets) if address_sets else set()
+        known = {}
+        for chunk in _chunks(addresses):
+            known.update(self.session.query(DbClusterAddress.address, DbClusterAddress.cluster_id).
+                         filter(DbClusterAddress.address.in_(chunk)))
+        uf = AddressClusters()
+        for address_set in address_sets:
+            uf.add([('cluster', known[a]) if a in known else a for a in address_set])
+        components = uf.clusters()
+
+        cluster_ids = set(known.values())
+        sizes = {}
+        for chunk in _chunks(cluster_ids):
+            sizes.update(self.session.query(DbCluster.id, DbCluster.size).filter(DbCluster.id.in_(chunk)))
+
+        new_addresses = []
+        new_clusters = []
+        merged = 0
+        for component in components:
+            clusters = [node[1] for node in component if isinstance(node, tuple)]
+            component_addresses = [node for node in component if not isinstance(node, tuple)]
+            if not clusters:
+                cluster = DbCluster(size=len(component_addresses))
+                new_clusters.append((cluster, component_addresses))
+                continue
+            target = max(clusters, key=lambda c: (sizes[c], -c))
+            others = [c for c in clusters if c != target]
+            size = sizes[target] + sum(sizes[c] for c in others) + len(component_addresses)
+            for chunk in _chunks(others):
+                self.session.query(DbClusterAddress).filter(DbClusterAddress.cluster_id.in_(chunk)).\
+                    update({DbClusterAddress.cluster_id: target}, synchronize_session=False)
+                self.session.query(DbCluster).filter(DbCluster.id.in_(chunk)).delete(synchronize_session=False)
+            if size != sizes[target]:
+                self.session.query(DbCluster).filter(DbCluster.id == target).\
+                    update({DbCluster.size: size}, synchronize_session=False)
+            merged += len(others)
+            new_addresses += [{'address': a, 'cluster_id': target} for a in component_addresses]
+
+        if new_clusters:
+            self.session.add_all([c for c, _ in new_clusters])
+            self.session.flush()
+            for cluster, component_addresses in new_clusters:
+                new_addresses += [{'address': a, 'cluster_id': cluster.id} for a in component_addresses]
+        if new_addresses:
+            self.session.bulk_insert_mappings(DbClusterAddress, new_addresses)
+        return len(new_addresses), merged
+
+    def rebuild(self, chunk_size=10000):
+        """
+        Remove the index and build it again from all transactions in the database
+        """
+        self.session.query(DbClusterAddress).delete(synchronize_session=False)
+        self.session.query(DbCluster).delete(synchronize_session=False)
+        self.session.query(DbClusterState).delete(synchronize_session=False)
+        self.session.commit()
+        return self.update(chunk_size)
+
+    def __contains__(self, address):
+        return self.session.query(DbClusterAddress.cluster_id).filter(DbClusterAddress.address == address).\
+            scalar() is not None
+
+    def __len__(self):
+        return self.session.query(func.count(DbClusterAddress.address)).scalar()
+
+    def cluster_id(self, address):
+        """
+        Cluster id of this address. Raises KeyError for unknown addresses.
+
+        Cluster ids can change when clusters are merged by an update.
+        """
+        cluster_id = self.session.query(DbClusterAddress.cluster_id).\
+            filter(DbClusterAddress.address == address).scalar()
+        if cluster_id is None:
+            raise KeyError(address)
+        return cluster_id
+
+    def addresses(self, cluster_id):
+        """
+        Set of all addresses in the cluster with this id
+        """
+        return set(r[0] for r in self.session.query(DbClusterAddress.address).
+                   filter(DbClusterAddress.cluster_id == cluster_id))
+
+    def cluster(self, address):
+        """
+        Set of all addresses in the same cluster as this address
+        """
+        return self.addresses(self.cluster_id(address))
+
+    def size(self, cluster_id):
+        return self.session.query(DbCluster.size).filter(DbCluster.id == cluster_id).scalar() or 0
+
+    def largest(self, n=10):
+        """
+        List of (cluster id, size) tuples of the n largest clusters
+        """
+        return [tuple(r) for r in self.session.query(DbCluster.id, DbCluster.size).
+                order_by(DbCluster.size.desc(), DbCluster.id).limit(n)]
+
+    def stats(self):
+        sizes = Counter(dict(self.session.query(DbCluster.size, func.count(DbCluster.id)).group_by(DbCluster.size)))
+        n_clusters = sum(sizes.values())
+        n_addresses = sum(size * count for size, count in sizes.items())
+        return {
+            'addresses': n_addresses,
+            'clusters': n_clusters,
+            'largest': max(sizes) if sizes else 0,
+            'singletons': sizes.get(1, 0),
+            'mean_size': n_addresses / n_clusters if n_clusters else 0,
+            'size_distribution': dict(sizes),
+            'last_transaction_id': self.last_transaction_id,
+        }
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Address clustering with a disjoint-set (union-find) structure
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+from collections import Counter
+
+
+class AddressClusters(object):
+    """
+    Groups addresses which are used together as inputs of the same transaction (common-input-ownership).
+
+    Addresses are interned to integer ids. Merging uses union by rank and lookups use path compression, so building
+    the clusters for n addresses takes near-linear time.
+
+    Cluster ids are the id of the root address of a cluster and can change when clusters are merged.
+    """
+
+    def __init__(self, address_sets=None):
+        self._ids = {}
+        self.addresses = []
+        self._parent = []
+        self._rank = []
+        for addresses in (address_sets or []):
+            self.add(addresses)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def __contains__(self, address):
+        return address in self._ids
+
+    def address_id(self, address):
+        aid = self._ids.get(address)
+        if aid is None:
+            aid = len(self.addresses)
+            self._ids[address] = aid
+            self.addresses.append(address)
+            self._parent.append(aid)
+            self._rank.append(0)
+        return aid
+
+    def _find(self, aid):
+        parent = self._parent
+        root = aid
+        while parent[root] != root:
+            root = parent[root]
+        while parent[aid] != root:
+            parent[aid], aid = root, parent[aid]
+        return root
+
+    def _union(self, aid1, aid2):
+        root1 = self._find(aid1)
+        root2 = self._find(aid2)
+        if root1 == root2:
+            return root1
+        if self._rank[root1] < self._rank[root2]:
+            root1, root2 = root2, root1
+        self._parent[root2] = root1
+        if self._rank[root1] == self._rank[root2]:
+            self._rank[root1] += 1
+        return root1
+
+    def add(self, addresses):
+        """
+        Add a set of addresses which belong to the same owner, i.e. the inputs of one transaction
+        """
+        aids = [self.address_id(a) for a in addresses]
+        for aid in aids[1:]:
+            self._union(aids[0], aid)
+
+    def union(self, address1, address2):
+        self._union(self.address_id(address1), self.address_id(address2))
+
+    def cluster_id(self, address):
+        """
+        Cluster id of this address. Raises KeyError for unknown addresses.
+        """
+        return self._find(self._ids[address])
+
+    def cluster(self, address):
+        """
+        Set of all addresses in the same cluster as this address
+        """
+        root = self.cluster_id(address)
+        return set([a for aid, a in enumerate(self.addresses) if self._find(aid) == root])
+
+    def clusters(self):
+        """
+        List of clusters as sets of addresses
+        """
+        clusters = {}
+        for aid, address in enumerate(self.addresses):
+            clusters.setdefault(self._find(aid), set()).add(address)
+        return list(clusters.values())
+
+    def sizes(self):
+        """
+        Dictionary with cluster id as key and number of addresses as value
+        """
+        return Counter(self._find(aid) for aid in range(len(self.addresses)))
+
+    def stats(self):
+        sizes = list(self.sizes().values())
+        return {
+            'addresses': len(self.addresses),
+            'clusters': len(sizes),
+            'largest': max(sizes) if sizes else 0,
+            'singletons': sizes.count(1),
+            'mean_size': len(self.addresses) / len(sizes) if sizes else 0,
+            'size_distribution': dict(Counter(sizes)),
+        }
+
+
+class CorrelatedInputs(object):
+    """
+    Incremental common-input-ownership state used for wallet reconstruction.
+
+    Keeps the input addresses of every transaction seen, so when addresses are added to the wallet only the
+    transactions spending from these addresses have to be checked again.
+    """
+
+    def __init__(self, wallet_addresses):
+        self.wallet_addresses = set(wallet_addresses)
+        self.correlated = set()
+        self._tx_inputs = {}
+        self._address_txs = {}
+
+    def add_transaction(self, txid, input_addresses):
+        if txid in self._tx_inputs:
+            return
+        inputs = set([a for a in input_addresses if a])
+        self._tx_inputs[txid] = inputs
+        for address in inputs:
+            self._address_txs.setdefault(address, []).append(txid)
+        if inputs & self.wallet_addresses:
+            self.correlated.update(inputs - self.wallet_addresses)
+
+    def add_wallet_addresses(self, addresses):
+        for address in addresses:
+            if address in self.wallet_addresses:
+                continue
+            self.wallet_addresses.add(address)
+            self.correlated.discard(address)
+            for txid in self._address_txs.get(address, []):
+                self.correlated.update(self._tx_inputs[txid] - self.wallet_addresses)
+
+    def frontier(self):
+        """
+        Correlated input addresses which are not in the wallet yet
+        """
+        return self.correlated - self.wallet_addresses
@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Columnar transactions export: typed NumPy table, optionally written as Parquet or Arrow IPC
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import importlib.util
+import numpy as np
+
+
+# Columns of the transactions export table. Dates are unix timestamps in seconds, amounts in satoshi. The name and
+# address columns contain integer codes, the strings are stored once in the dictionaries of the table.
+TRANSACTION_COLUMNS = [
+    ('transaction_date', np.int64),
+    ('txid', 'S64'),
+    ('in_out', 'S3'),
+    ('value_in', np.int64),
+    ('value_out', np.int64),
+    ('fee', np.int64),
+    ('value_cumulative', np.int64),
+    ('value_fiat', np.float64),
+    ('value_cumulative_fiat', np.float64),
+    ('in_name', np.int32),
+    ('out_name', np.int32),
+    ('in_addresses', np.int32),
+    ('out_addresses', np.int32),
+]
+DICTIONARY_COLUMNS = ('in_name', 'out_name', 'in_addresses', 'out_addresses')
+
+COLUMNAR_FORMATS = ('npz', 'parquet', 'arrow')
+
+
+class ColumnarTable(object):
+    """
+    Transactions export as NumPy structured array with dictionary encoded string columns.
+
+    Use write() to store the table as Parquet or Arrow IPC file if pyarrow is installed, or as NumPy .npz archive.
+    """
+
+    def __init__(self, data, dictionaries, fiat_currency='eur'):
+        self.data = data
+        self.dictionaries = dictionaries
+        self.fiat_currency = fiat_currency
+
+    @classmethod
+    def from_export_tuples(cls, tuples, fiat_currency='eur', denominator=0.00000001, chunk_size=10000):
+        """
+        Build a table from transactions export tuples, as returned by CryptalyseWallet.transactions_export_iter().
+        Tuples are converted per chunk, so a generator is never fully loaded into memory as Python objects.
+        """
+        codes = dict((c, {}) for c in DICTIONARY_COLUMNS)
+        chunks = []
+        chunk = []
+        for tp in tuples:
+            chunk.append(tp)
+            if len(chunk) >= chunk_size:
+                chunks.append(cls._convert_chunk(chunk, codes, denominator))
+                chunk = []
+        if chunk or not chunks:
+            chunks.append(cls._convert_chunk(chunk, codes, denominator))
+        dictionaries = dict((c, list(codes[c])) for c in DICTIONARY_COLUMNS)
+        return cls(np.concatenate(chunks), dictionaries, fiat_currency)
+
+    @staticmethod
+    def _convert_chunk(chunk, codes, denominator):
+        data = np.zeros(len(chunk), dtype=TRANSACTION_COLUMNS)
+        if not chunk:
+            return data
+        data['transaction_date'] = np.array([tp[0] for tp in chunk], dtype='datetime64[s]').astype(np.int64)
+        data['txid'] = [tp[1] for tp in chunk]
+        data['in_out'] = [tp[2] for tp in chunk]
+        # Export tuples contain BTC amounts, convert back to integer satoshi
+        for col, n in (('value_in', 3), ('value_out', 4), ('fee', 5), ('value_cumulative', 6)):
+            data[col] = np.rint(np.array([tp[n] for tp in chunk], dtype=np.float64) / denominator)
+        data['value_fiat'] = [tp[7] for tp in chunk]
+        data['value_cumulative_fiat'] = [tp[8] for tp in chunk]
+        for col, n in zip(DICTIONARY_COLUMNS, (9, 10, 11, 12)):
+            col_codes = codes[col]
+            data[col] = [col_codes.setdefault(tp[n], len(col_codes)) for tp in chunk]
+        return data
+
+    def __len__(self):
+        return len(self.data)
+
+    def column(self, name):
+        """
+        Column as numpy array. Dictionary encoded columns are decoded to strings.
+        """
+        if name in DICTIONARY_COLUMNS:
+            return np.array(self.dictionaries[name], dtype=object)[self.data[name]]
+        return self.data[name]
+
+    def to_arrow(self):
+        """
+        Convert to a pyarrow Table with dictionary arrays for the name and address columns
+        """
+        import pyarrow as pa
+
+        arrays = []
+        names = []
+        for name, _ in TRANSACTION_COLUMNS:
+            col = self.data[name]
+            if name in DICTIONARY_COLUMNS:
+                arr = pa.DictionaryArray.from_arrays(pa.array(col), pa.array(self.dictionaries[name], pa.string()))
+            elif name == 'transaction_date':
+                arr = pa.array(col, pa.timestamp('s'))
+            elif col.dtype.kind == 'S':
+                arr = pa.array(col.astype(str), pa.string())
+            else:
+                arr = pa.array(col)
+            if name in ('value_fiat', 'value_cumulative_fiat'):
+                name = name.replace('fiat', self.fiat_currency)
+            arrays.append(arr)
+            names.append(name)
+        return pa.Table.from_arrays(arrays, names=names)
+
+    def write(self, filename, format=None):
+        """
+        Write table to file. Format is derived from the file extension if not specified: '.parquet', '.arrow' or
+        '.feather' require pyarrow, other extensions are written as NumPy .npz archive.
+        """
+        if format is None:
+            ext = os.path.splitext(filename)[1].lower()
+            format = {'.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow'}.get(ext, 'npz')
+        if format not in COLUMNAR_FORMATS:
+            raise ValueError("Unknown columnar format %s, use one of %s" % (format, COLUMNAR_FORMATS))
+        if format == 'parquet':
+            import pyarrow.parquet as pq
+            pq.write_table(self.to_arrow(), filename)
+        elif format == 'arrow':
+            import pyarrow as pa
+            table = self.to_arrow()
+            with pa.OSFile(filename, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+        else:
+            dictionaries = dict(('dict_' + c, np.array(self.dictionaries[c], dtype=str)) for c in DICTIONARY_COLUMNS)
+            with open(filename, 'wb') as fp:
+                np.savez(fp, data=self.data, fiat_currency=np.array(self.fiat_currency), **dictionaries)
+        return filename
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a table written as .npz archive by write()
+        """
+        with np.load(filename) as npz:
+            dictionaries = dict((c, npz['dict_' + c].tolist()) for c in DICTIONARY_COLUMNS)
+            return cls(npz['data'], dictionaries, str(npz['fiat_currency']))
+
+
+def columnar_formats_available():
+    """
+    List of columnar file formats which can be written with the installed libraries
+    """
+    if importlib.util.find_spec('pyarrow') is None:
+        return ['npz']
+    return list(COLUMNAR_FORMATS)
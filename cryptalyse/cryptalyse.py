@@ -22,23 +22,41 @@
 
 import sys
 import os
-from copy import deepcopy
+import csv
+import time
 from datetime import datetime, timedelta
-import pandas as pd
+from collections.abc import Mapping
+import numpy as np
 from bitcoinlib.wallets import Wallet
-from bitcoinlib.main import *
-
-
-# Old price history (2010+)
-file_price_history = 'cryptalyse/cryptalyse/pricehistory_BTC{currency}_day_2010.csv'
-
-# Price history (2020+), fetched from Kraken API. Update with kraken_fetch_price_history.py
-file_price_history2 = 'cryptalyse/cryptalyse/Kraken_BTC{currency}_day.csv'
+from bitcoinlib.keys import Address
+from bitcoinlib.config.config import BITCOINLIB_VERSION
+from bitcoinlib.db import DbKey, DbTransaction, DbTransactionInput, DbTransactionOutput
+from bitcoinlib.services.services import Service
+from sqlalchemy import or_, func
+from cryptalyse.prices import price_store, rates_at, price_matrix
+from cryptalyse.analysis import WalletAnalysis, TxRecord, tx_records, period_index, period_label, period_end
+from cryptalyse.clustering import AddressClusters, CorrelatedInputs
+from cryptalyse.cluster_index import ClusterIndex
+from cryptalyse.checkpoints import AnalysisCheckpoints, transactions_digest
+from cryptalyse.flow_graph import FlowGraph
+from cryptalyse.columnar import ColumnarTable
+from cryptalyse.instrumentation import Instrumentation, NULL_INSTRUMENTATION, instrumented
+from cryptalyse.result_cache import ResultCache, RESULT_CACHE_SIZE
+from cryptalyse.tags import TagStore, DictTagStore, open_tag_store
 
 
 class CryptalyseWallet(Wallet):
 
-    def __init__(self, *args, fiat_currency=None, **kwargs):
+    # Stage timing and counters, disabled by default. Use instrument() to enable.
+    instrumentation = NULL_INSTRUMENTATION
+
+    def __init__(self, *args, fiat_currency=None, price_fill='previous', price_resolutions=None,
+                 analysis_cache_size=RESULT_CACHE_SIZE, analysis_cache_dir=None, analysis_checkpoints=False, **kwargs):
+        self._address_list = None
+        self._address_index = None
+        self._analysis_cache = ResultCache(analysis_cache_size, analysis_cache_dir)
+        self._tag_stores = {}
+        self.analysis_checkpoints = analysis_checkpoints
         Wallet.__init__(self, *args, **kwargs)
         self._inputs_correlated = []
         self.fiat_currency = 'eur' if not fiat_currency else fiat_currency.lower()
@@ -46,7 +64,9 @@ class CryptalyseWallet(Wallet):
             ["transaction_date", "txid", "in/out", "value_in_btc", "value_out_btc", "fee_btc", "value_cumulative_btc",
              f"value_{self.fiat_currency}", f"value_cumulative_{self.fiat_currency}", "in_name", "out_name",
              "in_addresses", "out_addresses"]
-        self._price_history = {}
+        self.price_fill = price_fill
+        self.price_resolutions = price_resolutions
+        self._price_store = None
         self.total_in = None
         self.total_out = None
         Wallet.strict = False   # Ignore invalid/unrecognised transactions
@@ -55,7 +75,9 @@ class CryptalyseWallet(Wallet):
     def create(cls, name, keys=None, owner='', network=None, account_id=0, purpose=0, scheme='bip32',
                sort_keys=True, password='', witness_type=None, encoding=None, multisig=None, sigs_required=None,
                cosigner_id=None, key_path=None, anti_fee_sniping=True, strict=True, ignore_dust=True, db_uri=None,
-               db_cache_uri=None, db_password=None, fiat_currency=None):
+               db_cache_uri=None, db_password=None, fiat_currency=None, price_fill='previous',
+               price_resolutions=None, analysis_cache_size=RESULT_CACHE_SIZE, analysis_cache_dir=None,
+               analysis_checkpoints=False):
         w = super(CryptalyseWallet, cls).create(name, keys=keys, owner=owner, network=network, account_id=account_id,
                                                 purpose=purpose, scheme=scheme, sort_keys=sort_keys, password=password,
                                                 witness_type=witness_type, encoding=encoding, multisig=multisig,
@@ -64,156 +86,490 @@ class CryptalyseWallet(Wallet):
                                                 ignore_dust=ignore_dust, db_uri=db_uri, db_cache_uri=db_cache_uri,
                                                 db_password=db_password)
         w.fiat_currency = 'eur' if not fiat_currency else fiat_currency.lower()
+        w.price_fill = price_fill
+        w.price_resolutions = price_resolutions
+        w._analysis_cache = ResultCache(analysis_cache_size, analysis_cache_dir)
+        w._tag_stores = {}
+        w.analysis_checkpoints = analysis_checkpoints
         w.columns_transactions_export = \
             ["transaction_date", "txid", "in/out", "value_in_btc", "value_out_btc", "fee_btc", "value_cumulative_btc",
              f"value_{w.fiat_currency}", f"value_cumulative_{w.fiat_currency}", "in_name", "out_name",
              "in_addresses", "out_addresses"]
         return w
 
+    def instrument(self, enabled=True, logger=None, max_calls=100):
+        # Record stage times, counters, database round-trips and cache hit rates per call of the analysis and export
+        # methods, see Instrumentation. Returns the Instrumentation object, the last record is available with
+        # instrumentation.as_dict().
+        if self.instrumentation.enabled:
+            self.instrumentation.detach()
+        if not enabled:
+            self.instrumentation = NULL_INSTRUMENTATION
+            return self.instrumentation
+        self.instrumentation = Instrumentation(logger, max_calls)
+        self.instrumentation.attach(self.session.get_bind())
+        return self.instrumentation
+
+    def _address_index_reset(self):
+        self._address_list = None
+        self._address_index = None
+        self._analysis_cache.clear()
+
+    def addresslist(self, account_id=None, used=None, network=None, change=None, depth=None, key_id=None):
+        # Unfiltered address list is cached, bitcoinlib also calls this for every WalletTransaction it creates
+        if account_id is None and used is None and network is None and change is None and depth is None and \
+                key_id is None:
+            self.instrumentation.cache('address_list', self._address_list is not None)
+            if self._address_list is None:
+                self._address_list = Wallet.addresslist(self)
+            return list(self._address_list)
+        return Wallet.addresslist(self, account_id, used, network, change, depth, key_id)
+
+    @property
+    def address_index(self):
+        # Set of all wallet addresses for fast membership tests. Reset when keys are added to the wallet.
+        self.instrumentation.cache('address_index', self._address_index is not None)
+        if self._address_index is None:
+            if self._address_list is None:
+                self._address_list = Wallet.addresslist(self)
+            self._address_index = set(self._address_list)
+        return self._address_index
+
+    def import_key(self, *args, **kwargs):
+        try:
+            return Wallet.import_key(self, *args, **kwargs)
+        finally:
+            self._address_index_reset()
+
+    def import_master_key(self, *args, **kwargs):
+        try:
+            return Wallet.import_master_key(self, *args, **kwargs)
+        finally:
+            self._address_index_reset()
+
+    def keys_for_path(self, *args, **kwargs):
+        # Used by new_key(), new_keys(), get_keys() and scan() to derive new keys. Lookups of existing keys keep the
+        # address index and cached analyses.
+        keys_before = self._keys_fingerprint()
+        try:
+            return Wallet.keys_for_path(self, *args, **kwargs)
+        finally:
+            if self._keys_fingerprint() != keys_before:
+                self._address_index_reset()
+
+    def scan(self, *args, **kwargs):
+        try:
+            return Wallet.scan(self, *args, **kwargs)
+        finally:
+            self._address_index_reset()
+
+    def transactions_update(self, *args, **kwargs):
+        try:
+            return Wallet.transactions_update(self, *args, **kwargs)
+        finally:
+            self._analysis_cache.clear()
+
+    def _state_fingerprint(self):
+        # Changes when transactions or keys of this wallet are added, removed or updated, also by other processes.
+        # Transactions per status with their last id and total confirmations, and the number of keys and last key id.
+        txs = self.session.query(DbTransaction.status, func.count(DbTransaction.id), func.max(DbTransaction.id),
+                                 func.sum(DbTransaction.confirmations)).\
+            filter(DbTransaction.wallet_id == self.wallet_id).group_by(DbTransaction.status).\
+            order_by(DbTransaction.status).all()
+        return tuple(tuple(r) for r in txs), self._keys_fingerprint()
+
+    def _keys_fingerprint(self):
+        return tuple(self.session.query(func.count(DbKey.id), func.max(DbKey.id)).
+                     filter(DbKey.wallet_id == self.wallet_id).one())
+
     def _fetch_price_history(self):
-        fn = file_price_history.format(currency=self.fiat_currency.upper())
-        fp = open(fn)
-        self._price_history = {}
-        for l in fp.readlines():
-            pl = l.split(',')
-            l_rate = 0
-            try:
-                l_rate = float(pl[6].strip())
-            except:
-                pass
-            self._price_history.update({pl[0]: l_rate})
-        fn2 = file_price_history2.format(currency=self.fiat_currency.upper())
-        fp2 = open(fn2)
-        for l in fp2.readlines():
-            pl = l.split(',')
-            l_rate = 0
-            try:
-                l_rate = float(pl[4].strip())
-            except:
-                pass
-            self._price_history.update({pl[8]: l_rate})
+        self._price_store = price_store(self.fiat_currency)
 
-    def price_history(self, date):
-        if not self._price_history:
+    @property
+    def price_store(self):
+        hit = self._price_store is not None and self._price_store.currency == self.fiat_currency
+        self.instrumentation.cache('price_store', hit)
+        if not hit:
             self._fetch_price_history()
-        return self._price_history[date]
+        return self._price_store
 
-    def input_totals(self, tagged_addresses=None, date_from=None, date_to=None):
-        totals = {}
-        wlt_addresses = self.addresslist()
-        self._inputs_correlated = []
-        if not tagged_addresses:
-            tagged_addresses = {}
-        for t in self.transactions():
-            if t.date and (date_from and t.date < date_from) or (date_to and t.date > date_to):
-                continue
-            wallet_inputs_tots = [o.value for o in t.outputs if o.address in wlt_addresses]
-            total_wallet_input = sum(wallet_inputs_tots)
-            own_wallet_tx = bool([i.address for i in t.inputs if i.address in wlt_addresses])
-            counted_wlt_input = False
-            for i in t.inputs:
-                prev_tx = "%s:%s" % (i.prev_txid.hex(), i.output_n_int)
-                if i.address in wlt_addresses:
-                    own_wallet_tx = True
-                    i_addr = self.name
-                else:
-                    i_addr = tagged_addresses.get(i.address, i.address)
-                if i_addr in totals:
-                    if own_wallet_tx and i.address in wlt_addresses:
-                        new_value = totals[i_addr][0] - i.value
-                    else:
-                        new_value = totals[i_addr][0] + i.value
-                    if isinstance(totals[i_addr][2], set):
-                        totals[i_addr][2].add(i.address)
-                    if isinstance(totals[i_addr][3], list):
-                        totals[i_addr][3].append(prev_tx)
-                    new_total_wallet_input = totals[i_addr][1]
-                    if not counted_wlt_input:
-                        new_total_wallet_input = totals[i_addr][1] + total_wallet_input
-                        counted_wlt_input = True
-                    totals[i_addr] = (new_value, new_total_wallet_input, totals[i_addr][2], totals[i_addr][3])
-                else:
-                    counted_wlt_input = True
-                    totals[i_addr] = (i.value, total_wallet_input, {i.address}, [prev_tx])
-            if own_wallet_tx:
-                cont_inps = [i.address for i in t.inputs if i.address not in wlt_addresses]
-                if cont_inps:
-                    self._inputs_correlated += cont_inps
-        self._inputs_correlated = list(set(self._inputs_correlated))
-        return totals
-
-    def output_totals(self, tagged_addresses=None, date_from=None, date_to=None):
-        totals = {}
-        wlt_addresses = self.addresslist()
-        if not tagged_addresses:
-            tagged_addresses = {}
-        for t in self.transactions_full():
-            if t.date and (date_from and t.date < date_from) or (date_to and t.date > date_to):
-                continue
-            own_wallet_tx = bool([i.address for i in t.inputs if i.address in wlt_addresses])
-            if not own_wallet_tx:
-                continue
-            for o in t.outputs:
-                if o.address in wlt_addresses:
-                    continue
-                else:
-                    o_addr = tagged_addresses.get(o.address, o.address)
-                if o_addr in totals:
-                    new_value = totals[o_addr][0] + o.value
-                    if isinstance(totals[o_addr][1], list):
-                        totals[o_addr][1].append(o.address)
-                    totals[o_addr] = (new_value, totals[o_addr][1], totals[o_addr][2] + [t.txid],
-                                      set([i.address for i in t.inputs]))
-                else:
-                    totals[o_addr] = (o.value, o.address, [t.txid], set([i.address for i in t.inputs]))
-        return totals
+    def price_history(self, date):
+        # Date as 'YYYY-MM-DD' string, date or datetime. Missing days are handled according to self.price_fill
+        return self.price_store.rate(date, self.price_fill)
+
+    def fiat_values(self, dates, values, values_cumulative=None, intraday=False):
+        # Batch valuation: fiat values of satoshi amounts at the given dates in one numpy pass. With intraday=True and
+        # price_resolutions set, i.e. ('minute', 'hour'), amounts are valued at the exact time of the date.
+        with self.instrumentation.stage('prices'):
+            if intraday and self.price_resolutions:
+                rates = rates_at(self.fiat_currency, dates, self.price_fill, self.price_resolutions)
+            else:
+                rates = self.price_store.rates_for(dates, self.price_fill)
+        denominator = self.network.denominator
+        value_fiat = rates * (np.asarray(values, dtype=np.float64) * denominator)
+        if values_cumulative is None:
+            return value_fiat
+        return value_fiat, rates * (np.asarray(values_cumulative, dtype=np.float64) * denominator)
+
+    def fiat_values_matrix(self, dates, values, values_cumulative=None, fiat_currencies=None, intraday=False):
+        # Fiat values for several currencies in one pass over a dates x currencies price matrix. Returns arrays with
+        # one row per date and one column per currency.
+        currencies = self.fiat_currencies(fiat_currencies)
+        with self.instrumentation.stage('prices'):
+            rates = price_matrix(currencies, dates, self.price_fill, self.price_resolutions if intraday else None)
+        denominator = self.network.denominator
+        value_fiat = rates * (np.asarray(values, dtype=np.float64) * denominator)[:, None]
+        if values_cumulative is None:
+            return value_fiat
+        return value_fiat, rates * (np.asarray(values_cumulative, dtype=np.float64) * denominator)[:, None]
+
+    def fiat_currencies(self, fiat_currencies=None):
+        # List of lowercase fiat currency codes to use in exports, defaults to this wallet's fiat currency
+        if not fiat_currencies:
+            return [self.fiat_currency]
+        if isinstance(fiat_currencies, str):
+            fiat_currencies = [fiat_currencies]
+        return [c.lower() for c in fiat_currencies]
+
+    def transactions_export_columns(self, fiat_currencies=None):
+        # Export column names with a value and cumulative value column for every fiat currency
+        columns = self.columns_transactions_export[:7]
+        for currency in self.fiat_currencies(fiat_currencies):
+            columns += [f"value_{currency}", f"value_cumulative_{currency}"]
+        return columns + self.columns_transactions_export[9:]
+
+    @instrumented
+    def analyse(self, tagged_addresses=None, date_from=None, date_to=None, keep_export=True):
+        # Stream the wallet's transactions once and fill all accumulators used by the totals and exports. Results are
+        # cached per arguments and wallet state, see clear_analysis_cache(). Don't modify the returned analysis.
+        # With keep_export=False the transactions export rows are not kept in memory, a cached analysis which has
+        # them is returned if available.
+        tagged_addresses, tags_fingerprint = self._tag_store(tagged_addresses)
+        key = ('analyse', self.wallet_id, tags_fingerprint, date_from, date_to, self.ignore_dust,
+               self._state_fingerprint())
+        analysis = self._analysis_cache.get(key)
+        if analysis is None and not keep_export:
+            key += (keep_export, )
+            analysis = self._analysis_cache.get(key)
+        self.instrumentation.cache('analysis', analysis is not None)
+        if analysis is not None:
+            if analysis.wallet_addresses is None:
+                # Loaded from disk
+                analysis.bind(self.address_index, tagged_addresses)
+            return analysis
+        if date_from or date_to:
+            # Totals for a date range are merged from the month partitions of the analysis of all transactions
+            analysis = self.analyse(tagged_addresses, keep_export=keep_export).\
+                date_range(date_from, date_to, self._transaction_records_between)
+        elif self.analysis_checkpoints:
+            analysis = self._analyse_incremental(tagged_addresses, tags_fingerprint, keep_export)
+        else:
+            analysis = WalletAnalysis(self.name, self.address_index, tagged_addresses, keep_export=keep_export,
+                                      partitions=True)
+            with self.instrumentation.stage('aggregate'):
+                analysis.run(self.instrumentation.records(self.transaction_records(), 'db_load'))
+        self._analysis_cache.put(key, analysis)
+        return analysis
+
+    def _analyse_incremental(self, tagged_addresses, tags_fingerprint, keep_export=True):
+        # Continue from the stored checkpoint if the transactions it contains are still the first transactions of the
+        # wallet in the same order, and rebuild from the first transaction otherwise, i.e. after a reorg, when an
+        # older transaction is added or when keys are added. Unconfirmed transactions are added after the checkpoint
+        # is saved, because their order can still change.
+        checkpoints = AnalysisCheckpoints(self.session)
+        key = checkpoints.key(tags_fingerprint, self.ignore_dust) if keep_export else \
+            checkpoints.key(tags_fingerprint, self.ignore_dust, keep_export)
+        keys_fingerprint = repr(self._keys_fingerprint())
+        with self.instrumentation.stage('db_load'):
+            txs = self._transactions_query(DbTransaction.id, DbTransaction.block_height, DbTransaction.status,
+                                           DbTransaction.txid, DbTransaction.date, DbTransaction.fee).all()
+            checkpoint = checkpoints.load(self.wallet_id, key)
+        n_confirmed = 0
+        while n_confirmed < len(txs) and txs[n_confirmed][2] == 'confirmed':
+            n_confirmed += 1
+
+        analysis = None
+        start = 0
+        if checkpoint is not None and checkpoint.keys_fingerprint == keys_fingerprint and \
+                checkpoint.transactions <= n_confirmed:
+            digest = transactions_digest(txs[:checkpoint.transactions])
+            if digest.hexdigest() == checkpoint.digest:
+                analysis = checkpoints.analysis(checkpoint).bind(self.address_index, tagged_addresses)
+                start = checkpoint.transactions
+        self.instrumentation.cache('checkpoint', analysis is not None)
+        if analysis is None:
+            if checkpoint is not None:
+                self.instrumentation.count('checkpoint_rebuilds')
+            analysis = WalletAnalysis(self.name, self.address_index, tagged_addresses, keep_export=keep_export,
+                                      partitions=True)
+            digest = transactions_digest([])
+        self.instrumentation.count('checkpoint_transactions', start)
+
+        with self.instrumentation.stage('aggregate'):
+            analysis.run(self.instrumentation.records(self._transaction_records(txs[start:n_confirmed]), 'db_load'))
+        if not start or start < n_confirmed:
+            transactions_digest(txs[start:n_confirmed], digest)
+            checkpoints.save(self.wallet_id, key, analysis, n_confirmed, digest.hexdigest(), keys_fingerprint)
+        with self.instrumentation.stage('aggregate'):
+            analysis.run(self.instrumentation.records(self._transaction_records(txs[n_confirmed:]), 'db_load'))
+        return analysis
+
+    def _tag_store(self, tagged_addresses):
+        # Tag store and fingerprint of the tagged_addresses argument of analyse(). Stores are kept per source, so a
+        # JSON or CSV file is only parsed again and a store on disk only fingerprinted again when the file changes.
+        # Dictionaries can be changed in place, so their tags are copied into a DictTagStore and only hashed again
+        # when they differ from this copy.
+        if isinstance(tagged_addresses, str):
+            stat = os.stat(tagged_addresses)
+            source_key, version = tagged_addresses, (stat.st_size, stat.st_mtime_ns)
+        elif isinstance(tagged_addresses, TagStore) and not isinstance(tagged_addresses, DictTagStore):
+            # Stores on disk have a fingerprint from the file size and modification time
+            source_key, version = id(tagged_addresses), tagged_addresses.fingerprint()
+        else:
+            source_key, version = id(tagged_addresses), None
+        tags = tagged_addresses.tags if isinstance(tagged_addresses, DictTagStore) else tagged_addresses
+        cached = self._tag_stores.get(source_key)
+        if cached is not None and (cached[0] is tagged_addresses or isinstance(tagged_addresses, str)):
+            _, cached_version, store, fingerprint = cached
+            if store is tagged_addresses or \
+                    (cached_version == version if version is not None else (tags or {}) == store.tags):
+                return store, fingerprint
+        if version is None and isinstance(tags, Mapping):
+            store = DictTagStore(dict(tags))
+        else:
+            store = open_tag_store(tagged_addresses)
+        fingerprint = store.fingerprint()
+        if len(self._tag_stores) >= 16:
+            self._tag_stores.clear()
+        # The source is kept as well, so its id is not reused while it is in this dictionary
+        self._tag_stores[source_key] = (tagged_addresses, version, store, fingerprint)
+        # Date range analyses call analyse() again with the store
+        self._tag_stores[id(store)] = (store, None, store, fingerprint)
+        return store, fingerprint
+
+    def clear_analysis_cache(self):
+        # Cached results are removed automatically after scan(), transactions_update() and when keys are added
+        self._analysis_cache.clear()
+        self._tag_stores = {}
+
+    def clear_analysis_checkpoints(self):
+        # Remove the stored checkpoints of this wallet, the next analysis starts from the first transaction
+        AnalysisCheckpoints(self.session).delete(self.wallet_id)
+
+    @instrumented
+    def input_totals(self, tagged_addresses=None, date_from=None, date_to=None, analysis=None):
+        if analysis is None:
+            analysis = self.analyse(tagged_addresses, date_from, date_to)
+        self._inputs_correlated = analysis.inputs_correlated
+        return analysis.input_totals
+
+    @instrumented
+    def output_totals(self, tagged_addresses=None, date_from=None, date_to=None, analysis=None):
+        if analysis is None:
+            analysis = self.analyse(tagged_addresses, date_from, date_to)
+        return analysis.output_totals
 
     @property
     def inputs_correlated(self):
         self.input_totals()
         return self._inputs_correlated
 
-    def clusters(self):
-        outputs = self.output_totals()
-        clusters = [r[3] for r in outputs.values()]
-        normalized = False
-        while not normalized:
-            new_clusters = []
-            normalized = True
-            if len(clusters) < 2:
+    @instrumented
+    def address_clusters(self, analysis=None):
+        # Union-find over the input addresses of the outgoing transactions, see AddressClusters
+        outputs = self.output_totals(analysis=analysis)
+        return AddressClusters([r[3] for r in outputs.values()])
+
+    @instrumented
+    def clusters(self, analysis=None):
+        return self.address_clusters(analysis).clusters()
+
+    def cluster_index(self, update=True):
+        # Persistent address clusters of all wallets in this wallet's database, see ClusterIndex. With update=True the
+        # transactions added to the database since the last update are added first.
+        index = ClusterIndex(session=self.session)
+        if update:
+            index.update()
+        return index
+
+    @instrumented
+    def flow_graph(self, transactions=None, fetch_addresses=None, limit=100):
+        # Value weighted address graph for multi-hop tracing of funds, see FlowGraph. Contains this wallet's
+        # transactions and the transactions in the transactions list, as Transaction objects or TxRecords. The
+        # transactions of the addresses in fetch_addresses are fetched from the service providers, at most limit per
+        # address.
+        records = list(self.instrumentation.records(self.transaction_records(), 'db_load'))
+        other = list(transactions or [])
+        if fetch_addresses:
+            srv = Service(network=self.network.name, wallet_name=self.name, providers=self.providers,
+                          cache_uri=self.db_cache_uri, strict=self.strict)
+            for address in fetch_addresses:
+                other += srv.gettransactions(address, limit=limit) or []
+        records += [t for t in other if isinstance(t, TxRecord)]
+        records += tx_records([t for t in other if not isinstance(t, TxRecord)])
+        with self.instrumentation.stage('aggregate'):
+            return FlowGraph.from_records(records)
+
+    def _transaction_rows(self, after_id=0):
+        # (database id, txid, date, fee) of the transactions added to this wallet after the given database id
+        return self.session.query(DbTransaction.id, DbTransaction.txid, DbTransaction.date, DbTransaction.fee).\
+            filter(DbTransaction.wallet_id == self.wallet_id, DbTransaction.id > after_id).\
+            order_by(DbTransaction.id).all()
+
+    @instrumented
+    def reconstruct(self, max_rounds=10, max_addresses=None, max_seconds=None, initial_scan=True, scan_gap_limit=5):
+        """
+        Reconstruct a partially known wallet: import the correlated input addresses, scan them and repeat until no
+        new correlated addresses are found.
+
+        Every round only scans the addresses imported in that round and only reads the transactions found since the
+        previous round. Stops when max_rounds, max_addresses (total number of imported addresses) or max_seconds is
+        reached.
+
+        Returns a dictionary with the reason to stop, a list with statistics per round and a list of errors for the
+        correlated addresses which could not be imported. Round 0 is the initial scan of the wallet.
+        """
+        start = time.time()
+        if initial_scan:
+            self.scan(scan_gap_limit=scan_gap_limit)
+        correlation = CorrelatedInputs(self.address_index)
+        skipped = set()
+        errors = []
+        state = {'last_id': 0}
+
+        def read_new_transactions():
+            txs = self._transaction_rows(state['last_id'])
+            for tx in self.instrumentation.records(self._transaction_records(txs), 'db_load'):
+                correlation.add_transaction(tx.txid, [i[0] for i in tx.inputs])
+            if txs:
+                state['last_id'] = txs[-1][0]
+            return len(txs)
+
+        rounds = [{'round': 0, 'frontier': 0, 'imported': 0, 'transactions_found': read_new_transactions(),
+                   'addresses': len(self.address_index), 'seconds': round(time.time() - start, 3)}]
+        imported = 0
+        while True:
+            frontier = sorted(correlation.frontier() - skipped)
+            if not frontier:
+                stopped = 'converged'
+                break
+            if len(rounds) > max_rounds:
+                stopped = 'max_rounds'
                 break
-            while len(clusters) > 1:
-                c1 = clusters.pop()
-                for c2 in clusters:
-                    if c1 & c2:
-                        c3 = c1.union(c2)
-                        if c1 in new_clusters: new_clusters.remove(c1)
-                        if c2 in new_clusters: new_clusters.remove(c2)
-                        new_clusters.append(c3)
-                        normalized = False
-                        break
-                    else:
-                        new_clusters.append(c1) if c1 not in new_clusters else new_clusters
-                        new_clusters.append(c2) if c2 not in new_clusters else new_clusters
-            clusters = new_clusters
-        return clusters
-
-    def transactions_export_tuples(self, tagged_addresses=None, date_from=None, date_to=None, seperator2=","):
+            if max_seconds and time.time() - start >= max_seconds:
+                stopped = 'max_seconds'
+                break
+            if max_addresses is not None:
+                if imported >= max_addresses:
+                    stopped = 'max_addresses'
+                    break
+                frontier = frontier[:max_addresses - imported]
+
+            round_start = time.time()
+            keys = []
+            for address in frontier:
+                try:
+                    keys.append(self.import_key(Address.parse(address, network=self.network.name)))
+                except Exception as e:
+                    errors.append("Could not import correlated address %s: %s" % (address, e))
+                    skipped.add(address)
+            correlation.add_wallet_addresses([k.address for k in keys])
+            for key in keys:
+                self.scan_key(key)
+            imported += len(keys)
+            rounds.append({'round': len(rounds), 'frontier': len(frontier), 'imported': len(keys),
+                           'transactions_found': read_new_transactions(), 'addresses': len(self.address_index),
+                           'seconds': round(time.time() - round_start, 3)})
+        self._inputs_correlated = sorted(correlation.frontier())
+        return {'stopped': stopped, 'rounds': rounds, 'imported': imported, 'skipped': sorted(skipped),
+                'errors': errors, 'seconds': round(time.time() - start, 3)}
+
+    def _transactions_query(self, *columns, include_new=False):
+        # Query on the transactions of transactions(): of this wallet's default account and network with at least
+        # one wallet input or output, in the same order
+        network, account_id, _ = self._get_account_defaults()
+        wallet_input = self.session.query(DbTransactionInput.transaction_id).\
+            filter(DbTransactionInput.transaction_id == DbTransaction.id, DbTransactionInput.key_id.isnot(None))
+        wallet_output = self.session.query(DbTransactionOutput.transaction_id).\
+            filter(DbTransactionOutput.transaction_id == DbTransaction.id, DbTransactionOutput.key_id.isnot(None))
+        if self.ignore_dust:
+            wallet_output = wallet_output.filter(DbTransactionOutput.value >= self.network.dust_amount)
+        qr = self.session.query(*columns).\
+            filter(DbTransaction.wallet_id == self.wallet_id, DbTransaction.account_id == account_id,
+                   DbTransaction.network_name == network, or_(wallet_input.exists(), wallet_output.exists()))
+        if not include_new:
+            qr = qr.filter(or_(DbTransaction.status == 'confirmed', DbTransaction.status == 'unconfirmed'))
+        return qr.order_by(DbTransaction.confirmations.desc(), DbTransaction.id)
+
+    def transaction_records(self, include_new=False, chunk_size=500):
+        """
+        Transactions of transactions() as lightweight TxRecord tuples, read directly from the database tables.
+
+        Only the columns used by the analysis are selected: one query for the transactions and per chunk of
+        chunk_size transactions a query for the inputs and one for the outputs. No Transaction objects, scripts or
+        witnesses are loaded. Addresses are read from the database, for wallet keys the key's address is used.
+        """
+        txs = self._transactions_query(DbTransaction.id, DbTransaction.txid, DbTransaction.date, DbTransaction.fee,
+                                       include_new=include_new).all()
+        return self._transaction_records(txs, chunk_size)
+
+    def _transaction_records_between(self, start, end):
+        # Records of the transactions with start <= date < end, in the same order as transaction_records()
+        txs = self._transactions_query(DbTransaction.id, DbTransaction.txid, DbTransaction.date, DbTransaction.fee).\
+            filter(DbTransaction.date >= start, DbTransaction.date < end).all()
+        return self.instrumentation.records(self._transaction_records(txs), 'db_load')
+
+    def _transaction_records(self, txs, chunk_size=500):
+        # TxRecords for rows starting with the database id and ending with txid, date and fee
+        for pos in range(0, len(txs), chunk_size):
+            chunk = txs[pos:pos + chunk_size]
+            ids = [t[0] for t in chunk]
+            inputs = dict((tx_id, []) for tx_id in ids)
+            for tx_id, address, key_address, value, prev_txid, output_n in self.session.query(
+                    DbTransactionInput.transaction_id, DbTransactionInput.address, DbKey.address,
+                    DbTransactionInput.value, DbTransactionInput.prev_txid, DbTransactionInput.output_n).\
+                    outerjoin(DbKey, DbKey.id == DbTransactionInput.key_id).\
+                    filter(DbTransactionInput.transaction_id.in_(ids)).\
+                    order_by(DbTransactionInput.transaction_id, DbTransactionInput.index_n):
+                inputs[tx_id].append((address or key_address, value, prev_txid.hex() if prev_txid else '',
+                                      output_n))
+            outputs = dict((tx_id, []) for tx_id in ids)
+            for tx_id, address, key_address, value, output_n in self.session.query(
+                    DbTransactionOutput.transaction_id, DbTransactionOutput.address, DbKey.address,
+                    DbTransactionOutput.value, DbTransactionOutput.output_n).\
+                    outerjoin(DbKey, DbKey.id == DbTransactionOutput.key_id).\
+                    filter(DbTransactionOutput.transaction_id.in_(ids)).\
+                    order_by(DbTransactionOutput.transaction_id, DbTransactionOutput.output_n):
+                outputs[tx_id].append((key_address or address, value, output_n))
+            for row in chunk:
+                txid, date, fee = row[-3:]
+                yield TxRecord(date, txid.hex(), fee or 0, inputs[row[0]], outputs[row[0]])
+
+    def transactions_export_iter(self, tagged_addresses=None, date_from=None, date_to=None, seperator2=",",
+                                 analysis=None, chunk_size=1000, fiat_currencies=None):
+        # Yields the export tuples while the transactions are read. Fiat values are calculated in batches of
+        # chunk_size rows, use chunk_size=0 to value all rows at once. Export rows of the analysis are used if
+        # specified, otherwise the transactions are streamed from the database.
+        # The tuples contain a value and cumulative value for every currency in fiat_currencies.
+        if analysis is None:
+            analysis = WalletAnalysis(self.name, self.address_index, self._tag_store(tagged_addresses)[0], date_from,
+                                      date_to, keep_export=False)
+            records = self.instrumentation.records(self.transaction_records(), 'db_load')
+            export_rows = self.instrumentation.iterate(analysis.export_rows(records), 'aggregate')
+        else:
+            export_rows = analysis.transactions_export
         if not date_from:
-            date_from = datetime(2009, 1, 1)
+            date_from = analysis.date_from or datetime(2009, 1, 1)
         if not date_to:
-            date_to = datetime.today()
-        if not tagged_addresses:
-            tagged_addresses = []
-        denominator = self.network.denominator
-        wlt_addresses = self.addresslist()
-        if not self._price_history:
-            self._fetch_price_history()
+            date_to = analysis.date_to or datetime.today()
+        tagged_addresses = analysis.tagged_addresses
+        wlt_addresses = analysis.wallet_addresses
 
-        tx_list = []
+        tx_rows = []
         prev_value_cumulative = 0
-        for tei in self.transactions_export(skip_change=False):
-            if (date_from and tei[0] < date_from) or (date_to and tei[0] > date_to):
+        for tei in export_rows:
+            # Unconfirmed transactions without a date are always included, like in WalletAnalysis.in_date_range()
+            if tei[0] and ((date_from and tei[0] < date_from) or (date_to and tei[0] > date_to)):
                 prev_value_cumulative = tei[6]
                 continue
 
@@ -226,130 +582,128 @@ class CryptalyseWallet(Wallet):
             for addr in tei[3]:
                 if addr in wlt_addresses:
                     addresses_in_tagged.append("This wallet")
-                elif addr in tagged_addresses:
-                    addresses_in_tagged.append(tagged_addresses[addr])
                 else:
-                    addresses_in_tagged.append(addr)
+                    addresses_in_tagged.append(tagged_addresses.get(addr, addr))
             addresses_in_tagged = list(set(addresses_in_tagged))
 
             addresses_out_tagged = []
             for addr in tei[4]:
                 if addr in wlt_addresses:
                     addresses_out_tagged.append("This wallet")
-                elif addr in tagged_addresses:
-                    addresses_out_tagged.append(tagged_addresses[addr])
                 else:
-                    addresses_out_tagged.append(addr)
+                    addresses_out_tagged.append(tagged_addresses.get(addr, addr))
             addresses_out_tagged = list(set(addresses_out_tagged))
 
-            value_fiat = 0
-            value_date = tei[0].strftime("%Y-%m-%d")
-            if value_date in self._price_history:
-                value_fiat = self.price_history(value_date) * ((value_in - value_out) * denominator)
-            value_fiat_cum = 0
-            value_date = tei[0].strftime("%Y-%m-%d")
-            if value_date in self._price_history:
-                value_fiat_cum = self.price_history(value_date) * tei[6]*denominator
-
             # Derive fee from value_in/out and cumulative values
             tx_fee = (value_in - value_out) + prev_value_cumulative - tei[6]
             prev_value_cumulative = tei[6]
 
-            tx_list.append((tei[0], tei[1], tei[2],
-                            (value_in * denominator), (value_out * denominator), tx_fee * denominator,
-                            (tei[6] * denominator), value_fiat, value_fiat_cum,
-                            seperator2.join(addresses_in_tagged), seperator2.join(addresses_out_tagged),
-                            seperator2.join(list(set(tei[3]))), seperator2.join(list(set(tei[4])))))
+            tx_rows.append((tei, value_in, value_out, tx_fee, addresses_in_tagged, addresses_out_tagged))
+            if chunk_size and len(tx_rows) >= chunk_size:
+                yield from self._export_tuples_valued(tx_rows, seperator2, fiat_currencies)
+                tx_rows = []
+        if tx_rows:
+            yield from self._export_tuples_valued(tx_rows, seperator2, fiat_currencies)
+
+    def _export_tuples_valued(self, tx_rows, seperator2, fiat_currencies=None):
+        denominator = self.network.denominator
+        # Unconfirmed transactions without a date are valued at the current price
+        now = datetime.now()
+        values_fiat, values_fiat_cum = self.fiat_values_matrix([r[0][0] or now for r in tx_rows],
+                                                               [r[1] - r[2] for r in tx_rows],
+                                                               [r[0][6] for r in tx_rows], fiat_currencies,
+                                                               intraday=True)
+        # Value and cumulative value column pair per currency
+        values_fiat = np.stack((values_fiat, values_fiat_cum), axis=2).reshape(len(tx_rows), -1)
+        for (tei, value_in, value_out, tx_fee, addresses_in_tagged, addresses_out_tagged), tx_values_fiat \
+                in zip(tx_rows, values_fiat.tolist()):
+            yield (tei[0], tei[1], tei[2],
+                   (value_in * denominator), (value_out * denominator), tx_fee * denominator,
+                   (tei[6] * denominator)) + tuple(tx_values_fiat) + \
+                  (seperator2.join(addresses_in_tagged), seperator2.join(addresses_out_tagged),
+                   seperator2.join(list(set(tei[3]))), seperator2.join(list(set(tei[4]))))
 
-        return tx_list
+    @instrumented
+    def transactions_export_tuples(self, tagged_addresses=None, date_from=None, date_to=None, seperator2=",",
+                                   analysis=None, fiat_currencies=None):
+        # All rows are returned at once, so the cached analysis of all transactions is used to select the rows
+        if analysis is None:
+            analysis = self.analyse(tagged_addresses)
+        return list(self.transactions_export_iter(tagged_addresses, date_from, date_to, seperator2, analysis,
+                                                  chunk_size=0, fiat_currencies=fiat_currencies))
 
+    @instrumented(stage='csv_write')
     def transactions_export_csv(self, tagged_addresses=None, date_from=None, date_to=None, file=sys.stdout,
-                                seperator=";", seperator2=","):
+                                seperator=";", seperator2=",", analysis=None, chunk_size=1000, fiat_currencies=None):
+        # Streaming export: rows are written in chunks while the transactions are read, so memory use stays flat and
+        # the first rows are available right away when the output is piped to another process
         if not date_from:
             date_from = datetime(2009, 1, 1)
         if not date_to:
             date_to = datetime.today()
-        if not tagged_addresses:
-            tagged_addresses = []
-
-        print(seperator.join(self.columns_transactions_export), file=file)
-        for tp in self.transactions_export_tuples(tagged_addresses, date_from, date_to, seperator2):
-            tx_item = (tp[0].strftime("%Y-%m-%d %H:%M:%S"), tp[1], tp[2],
-                            "%.8f" % tp[3], "%.8f" % tp[4],
-                            "%.2f" % tp[5], "%.8f" % tp[6], "%2f" % tp[7], tp[8], tp[9], tp[10], tp[11])
-            print(seperator.join(tx_item), file=file)
-
-    def export_balance_totals(self, last_year=None):
-        txs = self.transactions_export()
-        txs_totals = [(tei[0].year, 0 if tei[5] < 0 else tei[5], 0 if tei[5] > 0 else -tei[5], tei[6]) for tei in txs]
-        dt_year_totals = {}
+
+        writer = csv.writer(file, delimiter=seperator, lineterminator='\n')
+        writer.writerow(self.transactions_export_columns(fiat_currencies))
+        n_fiat = 2 * len(self.fiat_currencies(fiat_currencies))
+        chunk = []
+        for tp in self.transactions_export_iter(tagged_addresses, date_from, date_to, seperator2, analysis,
+                                                chunk_size, fiat_currencies=fiat_currencies):
+            chunk.append((tp[0].strftime("%Y-%m-%d %H:%M:%S") if tp[0] else '', tp[1], tp[2],
+                          "%.8f" % tp[3], "%.8f" % tp[4], "%.8f" % tp[5], "%.8f" % tp[6]) +
+                         tuple("%.2f" % v for v in tp[7:7 + n_fiat]) + tp[7 + n_fiat:])
+            if len(chunk) >= chunk_size:
+                writer.writerows(chunk)
+                file.flush()
+                chunk = []
+        writer.writerows(chunk)
+        file.flush()
+
+    @instrumented
+    def transactions_export_columnar(self, tagged_addresses=None, date_from=None, date_to=None, filename=None,
+                                     format=None, seperator2=",", analysis=None):
+        # Typed table with unix timestamps, satoshi amounts and dictionary encoded names and addresses, see
+        # ColumnarTable. Written to filename as Parquet, Arrow IPC or NumPy .npz archive if specified.
+        table = ColumnarTable.from_export_tuples(
+            self.transactions_export_iter(tagged_addresses, date_from, date_to, seperator2, analysis),
+            self.fiat_currency, self.network.denominator)
+        if filename:
+            table.write(filename, format)
+        return table
+
+    @instrumented
+    def export_balance_totals(self, last_year=None, analysis=None):
         if not last_year:
             last_year = datetime.today().year
-        last_balance = 0
-        total_in = total_out = 0
-        if txs_totals:
-            # txs_totals[len(txs_totals) - 1][0] + 1
-            for year in range((txs_totals[0][0]), last_year + 1):
-                if not year in [l[0] for l in txs_totals]:
-                    dt_year_totals.update({year: (0, 0, 0, last_balance)})
-                else:
-                    balance = [l[3] for l in txs_totals if l[0] == year][-1]
-                    yr_total_in = sum([l[1] for l in txs_totals if l[0] == year])
-                    yr_total_out = sum([l[2] for l in txs_totals if l[0] == year])
-                    fees = (yr_total_in - yr_total_out) - (balance - last_balance)
-                    dt_year_totals.update({year: (yr_total_in, yr_total_out, fees, balance)})
-                    last_balance = balance
-                    total_in += yr_total_in
-                    total_out += yr_total_out
-
-        return dt_year_totals
-
-    def export_utxos_year(self, last_year=None):
-        utxos = {}
-        year_old = 0
-        year = 0
-        utxos_year = {}
+        return self.export_period_totals('year', datetime(last_year, 12, 31), analysis)
+
+    @instrumented
+    def export_period_totals(self, period='month', last_date=None, analysis=None):
+        # Totals in, out, fees and closing balance per day, month, quarter or year: {period: (in, out, fees, balance)}
+        if not last_date:
+            last_date = datetime.today()
+        if analysis is None:
+            analysis = self.analyse()
+        return analysis.period_totals(period, last_date)
+
+    @instrumented
+    def export_utxos_year(self, last_year=None, analysis=None):
         if not last_year:
             last_year = datetime.today().year
-        txs = self.transactions()
-        for tx in txs:
-            year = tx.date.year
-            utxos_old = deepcopy(utxos)
-            if tx.outgoing_tx:
-                for i in tx.inputs:
-                    del(utxos[(i.prev_txid.hex(), i.output_n_int)])
-                for o in tx.outputs:
-                    if o.address in self.addresslist():
-                        utxos.update({(tx.txid, o.output_n): (o.value, o.address)})
-            else:
-                for o in tx.outputs:
-                    if o.address not in self.addresslist():
-                        continue
-                    utxos.update({(tx.txid, o.output_n): (o.value, o.address)})
-            if year != year_old:
-                if year_old != 0:
-                    for yr in range(year_old, year):
-                        utxos_year.update({yr: utxos_old})
-                year_old = year
-        if year and year < last_year:
-            for yr in range(year, last_year+1):
-                utxos_year.update({yr: utxos})
-
-        return utxos_year
-
-    def export_to_excel(self, filename, tagged_addresses, date_from, date_to, yearly_totals_end_of_year=True):
-        writer = pd.ExcelWriter(filename, engine='xlsxwriter')
-        format_btc = writer.book.add_format({'num_format': '0.00000000'})
-        format_fiat = writer.book.add_format({'num_format': '#,##0.00'})
-        format_header = writer.book.add_format({'font_size': 20, 'bold': True})
-        format_fieldnames = writer.book.add_format({'align': 'left'})
-        all_years = range(date_from.year, date_to.year + 1)
+        if analysis is None:
+            analysis = self.analyse()
+        return analysis.utxos_year(last_year)
 
-        # Export transactions
-        txs_export = self.transactions_export_tuples(tagged_addresses, date_from, date_to)
+    @instrumented
+    def export_address_balances(self, period='year', last_date=None, analysis=None):
+        # Balance per address at the end of each day, month, quarter or year: {period: {address: balance}}
+        if not last_date:
+            last_date = datetime.today()
+        if analysis is None:
+            analysis = self.analyse()
+        return dict(analysis.utxo_snapshots.balances(period, last_date))
 
-        # Create overview sheet
-        wallet_info = [
+    def _excel_wallet_info(self, analysis, date_from, date_to, fiat_currencies=None):
+        return [
             ('%s - Wallet Overview' % self.name, ''),
             ('', ''),
             ('Wallet Name', self.name),
@@ -358,7 +712,7 @@ class CryptalyseWallet(Wallet):
             ('Network', self.network.name),
             ('Currency Code', self.network.currency_code),
             ('Currency Symbol', self.network.currency_symbol),
-            ('Fiat Currency', self.fiat_currency.upper()),
+            ('Fiat Currency', ', '.join(self.fiat_currencies(fiat_currencies)).upper()),
             ('Scheme', self.scheme),
             ('Encoding', self.encoding),
             ('Sort Keys', 'true' if self.sort_keys else 'false'),
@@ -373,11 +727,123 @@ class CryptalyseWallet(Wallet):
             ('Generated by', 'Cryptalyse and Bitcoinlib %s' % BITCOINLIB_VERSION),
             ('Date from', str(date_from)),
             ('Date to', str(date_to)),
-            ('Correlated inputs (Add to wallet!)', self.inputs_correlated if self.inputs_correlated else 'none'),
+            ('Correlated inputs (Add to wallet!)',
+             analysis.inputs_correlated if analysis.inputs_correlated else 'none'),
             ('', ''),
             ('More information can be found on the following tabs:', ''),
         ]
-        df = pd.DataFrame(wallet_info)
+
+    def _excel_sheets_links(self, n_transactions, n_addresses, totals_period):
+        sheets_links = [  # (Name, Link, String)
+            ("Transactions", "internal:'Transactions'!A1", "View %d transactions" % n_transactions),
+            ("Inputs", "internal:'Inputs'!A1", "View Transaction Inputs"),
+            ("Outputs", "internal:'Outputs'!A1", "View Transaction Outputs"),
+            ("Addresses", "internal:'Addresses'!A1", "View %d addresses" % n_addresses),
+            ("Yearly Totals", "internal:'Year Totals'!A1", "View yearly totals"),
+        ]
+        if totals_period and totals_period != 'year':
+            sheets_links.append(("%s Totals" % totals_period.capitalize(),
+                                 "internal:'%s Totals'!A1" % totals_period.capitalize(),
+                                 "View %sly totals" % totals_period.replace('day', 'dai')))
+        return sheets_links
+
+    def _excel_inputs(self, analysis):
+        input_totals = self.input_totals(analysis=analysis)
+        return ['Name', 'Addresses', 'Amount', 'Tx count', 'Previous UTXO\'s'], \
+            [(key, ';'.join(list(value[2])), value[1] * self.network.denominator, len(value[3]), ';'.join(value[3]))
+             for key, value in input_totals.items() if key != self.name]
+
+    def _excel_outputs(self, analysis):
+        output_totals = self.output_totals(analysis=analysis)
+        return ['Name', 'Address', 'Amount', 'Tx count', 'Transaction IDs', 'Wallet addresses'], \
+            [(key, value[1], value[0] * self.network.denominator, len(value[2]), ';'.join(value[2]),
+              ';'.join(list(value[3]))) for key, value in output_totals.items()]
+
+    def _excel_addresses(self):
+        return ['Address', 'Balance'], \
+            [(key.address, key.balance * self.network.denominator) for key in self.keys(depth=self.key_depth)]
+
+    def _excel_address_totals(self, analysis, date_from, date_to):
+        # Balance per address at the end of each year, one row per address and one column per year
+        for issue in analysis.utxo_snapshots.issues:
+            print("Address yearly totals may be incorrect: %s" % issue)
+        all_years = range(date_from.year, date_to.year + 1)
+        address_balances = self.export_address_balances('year', date_to, analysis)
+        addresses = {}
+        for year in all_years:
+            addresses.update((addr, None) for addr in address_balances.get(year, {}))
+        rows = [(addr,) + tuple(address_balances.get(year, {}).get(addr, 0) * self.network.denominator
+                                for year in all_years) for addr in addresses]
+        return [str(year) for year in all_years], rows
+
+    def _excel_year_totals(self, analysis, date_from, date_to, yearly_totals_end_of_year=True, fiat_currencies=None):
+        year_totals = self.export_balance_totals(date_to.year, analysis)
+        yt_list = []
+        for year in year_totals:
+            if year < date_from.year or year > date_to.year:
+                continue
+            if yearly_totals_end_of_year:
+                datestr = '%s-12-31' % year
+                yearstr = year
+            else:
+                yearstr = str(1 + int(year))
+                datestr = '%s-01-01' % yearstr
+            if year == datetime.today().year:
+                datestr =(datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
+            yt_list.append((yearstr, datestr, year_totals[year][0] * self.network.denominator, year_totals[year][1] *
+                            self.network.denominator, year_totals[year][2] * self.network.denominator,
+                            year_totals[year][3] * self.network.denominator, year_totals[year][3]))
+        if yt_list:
+            balances_fiat = self.fiat_values_matrix([np.datetime64(yt[1]) for yt in yt_list], [yt[6] for yt in yt_list],
+                                                    fiat_currencies=fiat_currencies)
+            yt_list = [yt[:6] + tuple(prices_fiat) for yt, prices_fiat in zip(yt_list, balances_fiat.tolist())]
+        return ['Year', 'Date', 'Total In BTC', 'Total Out BTC', 'Fees BTC', 'Balance BTC'] + \
+            [f'Balance {c.upper()}' for c in self.fiat_currencies(fiat_currencies)], yt_list
+
+    def _excel_period_totals(self, analysis, date_from, date_to, totals_period, fiat_currencies=None):
+        period_totals = self.export_period_totals(totals_period, date_to, analysis)
+        pt_list = []
+        for idx in range(period_index(date_from, totals_period), period_index(date_to, totals_period) + 1):
+            label = period_label(idx, totals_period)
+            if label not in period_totals:
+                continue
+            pt = period_totals[label]
+            pt_list.append((label, min(period_end(idx, totals_period), date_to.date()),
+                            pt[0] * self.network.denominator, pt[1] * self.network.denominator,
+                            pt[2] * self.network.denominator, pt[3] * self.network.denominator, pt[3]))
+        if pt_list:
+            balances_fiat = self.fiat_values_matrix([pt[1] for pt in pt_list], [pt[6] for pt in pt_list],
+                                                    fiat_currencies=fiat_currencies)
+            pt_list = [pt[:1] + (pt[1].isoformat(),) + pt[2:6] + tuple(prices_fiat)
+                       for pt, prices_fiat in zip(pt_list, balances_fiat.tolist())]
+        return ['Period', 'Date', 'Total In BTC', 'Total Out BTC', 'Fees BTC', 'Balance BTC'] + \
+            [f'Balance {c.upper()}' for c in self.fiat_currencies(fiat_currencies)], pt_list
+
+    @instrumented(stage='xlsx_write')
+    def export_to_excel(self, filename, tagged_addresses, date_from, date_to, yearly_totals_end_of_year=True,
+                        totals_period=None, constant_memory=False, fiat_currencies=None):
+        if constant_memory:
+            return self._export_to_excel_constant_memory(filename, tagged_addresses, date_from, date_to,
+                                                         yearly_totals_end_of_year, totals_period, fiat_currencies)
+        import pandas as pd
+
+        columns_transactions_export = self.transactions_export_columns(fiat_currencies)
+        n_fiat = len(self.fiat_currencies(fiat_currencies))
+
+        writer = pd.ExcelWriter(filename, engine='xlsxwriter')
+        format_btc = writer.book.add_format({'num_format': '0.00000000'})
+        format_fiat = writer.book.add_format({'num_format': '#,##0.00'})
+        format_header = writer.book.add_format({'font_size': 20, 'bold': True})
+        format_fieldnames = writer.book.add_format({'align': 'left'})
+
+        # Analyse all transactions once, all sheets below read from this result
+        analysis = self.analyse(tagged_addresses, date_from, date_to)
+
+        # Export transactions
+        txs_export = self.transactions_export_tuples(analysis=analysis, fiat_currencies=fiat_currencies)
+
+        # Create overview sheet
+        df = pd.DataFrame(self._excel_wallet_info(analysis, date_from, date_to, fiat_currencies))
         df.to_excel(writer, sheet_name='Wallet', index=False, header=False)
         worksheet_wallet = writer.sheets['Wallet']
         worksheet_wallet.set_column(0, 0, 20)
@@ -385,60 +851,42 @@ class CryptalyseWallet(Wallet):
         worksheet_wallet.set_row(0, height=33, cell_format=format_header)
         worksheet_wallet.set_row(1, height=33)
 
-        sheets_links = [  # (Name, Link, String)
-            ("Transactions", "internal:'Transactions'!A1", "View %d transactions" % len(txs_export)),
-            ("Inputs", "internal:'Inputs'!A1", "View Transaction Inputs"),
-            ("Outputs", "internal:'Outputs'!A1", "View Transaction Outputs"),
-            ("Addresses", "internal:'Addresses'!A1", "View %d addresses" % len(self.addresslist())),
-            ("Yearly Totals", "internal:'Year Totals'!A1", "View yearly totals"),
-        ]
         currow = worksheet_wallet.dim_rowmax + 1
-        for link in sheets_links:
+        for link in self._excel_sheets_links(len(txs_export), len(analysis.wallet_addresses), totals_period):
             worksheet_wallet.write_string(currow, 0, link[0])
             worksheet_wallet.write_url(currow, 1, link[1], string=link[2])
             currow += 1
 
         # Export Transactions
-        df = pd.DataFrame(txs_export, columns=self.columns_transactions_export)
+        df = pd.DataFrame(txs_export, columns=columns_transactions_export)
         df.to_excel(writer, sheet_name='Transactions')
         worksheet_txs = writer.sheets['Transactions']
-        for idx in range(len(self.columns_transactions_export)):
-            col = self.columns_transactions_export[idx]
+        for idx in range(len(columns_transactions_export)):
+            col = columns_transactions_export[idx]
             series = df[col]
-            max_len = max((series.astype(str).map(len).max(), len(str(series.name)))) + 1
+            max_len = max((series.map(str).map(len).max(), len(str(series.name)))) + 1
             worksheet_txs.set_column(idx + 1, idx + 1, max_len)  # set column width
 
         worksheet_txs.set_column(2, 2, 15)  # transaction_id
         worksheet_txs.set_column(4, 7, 20, format_btc)  # value_btc_in + out, fee, value_cumulative_btc
-        worksheet_txs.set_column(8, 9, 20, format_fiat)  # value_fiat
-        worksheet_txs.set_column(10, 13, 40)  # in_name, out_name, in_addresses, out_addresses
+        worksheet_txs.set_column(8, 7 + 2 * n_fiat, 20, format_fiat)  # value_fiat
+        worksheet_txs.set_column(8 + 2 * n_fiat, 11 + 2 * n_fiat, 40)  # in_name, out_name, in_addresses, out_addresses
 
         for idx, txid in enumerate(df.txid):
             worksheet_txs.write_url(idx + 1, 2, 'https://blocksmurfer.io/btc/transaction/%s' % txid, string=txid)
 
         # Export input totals
-        input_totals = self.input_totals(tagged_addresses, date_from, date_to)
-        if self.name in input_totals:
-            del (input_totals[self.name])
-        input_totals_list = [(key, ';'.join(list(value[2])), value[1] * self.network.denominator,
-                              len(value[3]), ';'.join(value[3]))
-                             for key, value in input_totals.items()]
-        df = pd.DataFrame(input_totals_list, columns=['Name', 'Addresses', 'Amount', 'Tx count', 'Previous UTXO\'s'])
-        df.to_excel(writer, sheet_name='Inputs', index=False)
-        worksheet_inputs = writer.sheets['In' \
-                                         'puts']
+        columns, rows = self._excel_inputs(analysis)
+        pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name='Inputs', index=False)
+        worksheet_inputs = writer.sheets['Inputs']
         worksheet_inputs.set_column(0, 1, 40)
         worksheet_inputs.set_column(2, 2, 20, format_btc)
         worksheet_inputs.set_column(3, 3, 10)
         worksheet_inputs.set_column(4, 4, 50)
 
         # Export output totals
-        output_totals = self.output_totals(tagged_addresses, date_from, date_to)
-        output_totals_list = [(key, value[1], value[0] * self.network.denominator, len(value[2]),
-                               ';'.join(value[2]), ';'.join(list(value[3]))) for key, value in output_totals.items()]
-        df = pd.DataFrame(output_totals_list, columns=['Name', 'Address', 'Amount', 'Tx count', 'Transaction IDs',
-                                                       'Wallet addresses'])
-        df.to_excel(writer, sheet_name='Outputs', index=False)
+        columns, rows = self._excel_outputs(analysis)
+        pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name='Outputs', index=False)
         worksheet_outputs = writer.sheets['Outputs']
         worksheet_outputs.set_column(0, 1, 40)
         worksheet_outputs.set_column(2, 2, 20, format_btc)
@@ -446,72 +894,168 @@ class CryptalyseWallet(Wallet):
         worksheet_outputs.set_column(4, 5, 40)
 
         # Export addresses
-        addresses = []
-        # for key in self.keys(depth=self.key_depth):
-        #     addresses.append((key.address, key.id, key.path, key.address, key.name, key.balance * self.network.denominator))
-        # df = pd.DataFrame(addresses)
-        for key in self.keys(depth=self.key_depth):
-            addresses.append((key.address, key.balance * self.network.denominator))
-        df = pd.DataFrame(addresses, columns=['Address', 'Balance'])
-        df.to_excel(writer, sheet_name='Addresses', index=False)
+        columns, rows = self._excel_addresses()
+        pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name='Addresses', index=False)
         worksheet_addresses = writer.sheets['Addresses']
         worksheet_addresses.set_column(0, 0, 50)
         worksheet_addresses.set_column(1, 1, 15, format_btc)
 
         # Export address yearly totals
-        try:
-            utxo_year = self.export_utxos_year(date_to.year)
-            utxo_year_address = []
-            addresses = set()
-            for year in all_years:
-                utxos = utxo_year.get(year, {})
-                addr_balances = {}
-                for utxo in utxos.values():
-                    value = utxo[0] * self.network.denominator
-                    addr = utxo[1]
-                    addresses.add(addr)
-                    if addr in addr_balances:
-                        value += addr_balances[addr]
-                    addr_balances.update({addr: value})
-                utxo_year_address.append(addr_balances)
-
-            df = pd.DataFrame(utxo_year_address, index=[str(year) for year in all_years]).fillna(0)
-            df.transpose().to_excel(writer, sheet_name='Address Totals')
-            worksheet_addresses_year = writer.sheets['Address Totals']
-            worksheet_addresses_year.set_column(0, 0, 50)
-            worksheet_addresses_year.set_column(1, 15, 15, format_btc)
-        except KeyError:
-            print("Could not export address yearly totals!!! Probably order of transactions is incorrect")
-            pass
+        columns, rows = self._excel_address_totals(analysis, date_from, date_to)
+        df = pd.DataFrame([r[1:] for r in rows], index=[r[0] for r in rows], columns=columns)
+        df.to_excel(writer, sheet_name='Address Totals')
+        worksheet_addresses_year = writer.sheets['Address Totals']
+        worksheet_addresses_year.set_column(0, 0, 50)
+        worksheet_addresses_year.set_column(1, 15, 15, format_btc)
 
         # Export yearly totals
-        year_totals = self.export_balance_totals(date_to.year)
-        yt_list = []
-        for year in year_totals:
-            if year < date_from.year or year > date_to.year:
-                continue
-            if yearly_totals_end_of_year:
-                datestr = '%s-12-31' % year
-                yearstr = year
-            else:
-                yearstr = str(1 + int(year))
-                datestr = '%s-01-01' % yearstr
-            if year == datetime.today().year:
-                datestr =(datetime.today() - timedelta(days=1)).strftime("%Y-%m-%d")
-            price_fiat = 0 if not year_totals[year][3] else \
-                self.price_history(datestr) * year_totals[year][3] * self.network.denominator
-            yt_list.append((yearstr, datestr, year_totals[year][0] * self.network.denominator, year_totals[year][1] *
-                            self.network.denominator, year_totals[year][2] * self.network.denominator,
-                            year_totals[year][3] * self.network.denominator, price_fiat))
-        df = pd.DataFrame(yt_list, columns=['Year', 'Date', 'Total In BTC', 'Total Out BTC', 'Fees BTC',
-                                            'Balance BTC', f'Balance {self.fiat_currency.upper()}'])
-
-        df.to_excel(writer, sheet_name='Year Totals', index=False)
+        columns, rows = self._excel_year_totals(analysis, date_from, date_to, yearly_totals_end_of_year,
+                                                fiat_currencies)
+        pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name='Year Totals', index=False)
         worksheet_years = writer.sheets['Year Totals']
         worksheet_years.set_column(0, 0, 15)
         worksheet_years.set_column(1, 1, 20)
         worksheet_years.set_column(2, 5, 20, format_btc)
-        worksheet_years.set_column(6, 6, 20, format_fiat)
+        worksheet_years.set_column(6, 5 + n_fiat, 20, format_fiat)
+
+        # Export day, month or quarter totals
+        if totals_period and totals_period != 'year':
+            sheet_name = "%s Totals" % totals_period.capitalize()
+            columns, rows = self._excel_period_totals(analysis, date_from, date_to, totals_period, fiat_currencies)
+            pd.DataFrame(rows, columns=columns).to_excel(writer, sheet_name=sheet_name, index=False)
+            worksheet_periods = writer.sheets[sheet_name]
+            worksheet_periods.set_column(0, 1, 15)
+            worksheet_periods.set_column(2, 5, 20, format_btc)
+            worksheet_periods.set_column(6, 5 + n_fiat, 20, format_fiat)
 
         writer.close()
 
+    def _export_to_excel_constant_memory(self, filename, tagged_addresses, date_from, date_to,
+                                         yearly_totals_end_of_year=True, totals_period=None, fiat_currencies=None):
+        # Same workbook as export_to_excel(), but rows are written directly with xlsxwriter in constant_memory mode.
+        # Totals are taken from analyse() with keep_export=False, the transactions are streamed from the database
+        # when they are written and are never kept in memory.
+        import xlsxwriter
+
+        columns_transactions_export = self.transactions_export_columns(fiat_currencies)
+        n_fiat = len(self.fiat_currencies(fiat_currencies))
+
+        workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+        format_btc = workbook.add_format({'num_format': '0.00000000'})
+        format_fiat = workbook.add_format({'num_format': '#,##0.00'})
+        format_header = workbook.add_format({'font_size': 20, 'bold': True})
+        format_fieldnames = workbook.add_format({'align': 'left'})
+        format_date = workbook.add_format({'num_format': 'YYYY-MM-DD HH:MM:SS'})
+
+        def write_value(worksheet, row, col, value):
+            if isinstance(value, datetime):
+                return worksheet.write_datetime(row, col, value, format_date)
+            if isinstance(value, (list, tuple, set)):
+                value = str(value)
+            return worksheet.write(row, col, value)
+
+        def write_table(worksheet, columns, rows):
+            for col, name in enumerate(columns):
+                worksheet.write(0, col, name)
+            for row, values in enumerate(rows):
+                for col, value in enumerate(values):
+                    write_value(worksheet, row + 1, col, value)
+
+        # Worksheets are added in the final order, rows of each sheet are written top to bottom
+        sheet_names = ['Wallet', 'Transactions', 'Inputs', 'Outputs', 'Addresses', 'Address Totals', 'Year Totals']
+        if totals_period and totals_period != 'year':
+            sheet_names.append("%s Totals" % totals_period.capitalize())
+        worksheets = dict((name, workbook.add_worksheet(name)) for name in sheet_names)
+
+        # Same analysis as export_to_excel(), without keeping the transactions export rows in memory
+        analysis = self.analyse(tagged_addresses, date_from, date_to, keep_export=False)
+
+        # Export Transactions, rows are streamed from the database if the analysis doesn't contain them
+        worksheet_txs = worksheets['Transactions']
+        worksheet_txs.set_column(2, 2, 15)  # transaction_id
+        worksheet_txs.set_column(4, 7, 20, format_btc)  # value_btc_in + out, fee, value_cumulative_btc
+        worksheet_txs.set_column(8, 7 + 2 * n_fiat, 20, format_fiat)  # value_fiat
+        worksheet_txs.set_column(8 + 2 * n_fiat, 11 + 2 * n_fiat, 40)  # in_name, out_name, in_addresses, out_addresses
+        write_table(worksheet_txs, [''] + columns_transactions_export, [])
+        # Track column widths while streaming, only the date and in/out columns don't have a fixed width
+        col_widths = {1: len(columns_transactions_export[0]), 3: len(columns_transactions_export[2])}
+        n_transactions = 0
+        for tp in self.transactions_export_iter(tagged_addresses, date_from, date_to,
+                                                analysis=analysis if analysis.keep_export else None,
+                                                fiat_currencies=fiat_currencies):
+            n_transactions += 1
+            worksheet_txs.write_number(n_transactions, 0, n_transactions - 1)
+            write_value(worksheet_txs, n_transactions, 1, tp[0])
+            worksheet_txs.write_url(n_transactions, 2, 'https://blocksmurfer.io/btc/transaction/%s' % tp[1],
+                                    string=tp[1])
+            for col, value in enumerate(tp[2:]):
+                write_value(worksheet_txs, n_transactions, col + 3, value)
+            col_widths[1] = max(col_widths[1], len(str(tp[0])))
+            col_widths[3] = max(col_widths[3], len(tp[2]))
+        for col, width in col_widths.items():
+            worksheet_txs.set_column(col, col, width + 1)
+
+        # Create overview sheet
+        worksheet_wallet = worksheets['Wallet']
+        worksheet_wallet.set_column(0, 0, 20)
+        worksheet_wallet.set_column(1, 1, 30, format_fieldnames)
+        worksheet_wallet.set_row(0, height=33, cell_format=format_header)
+        worksheet_wallet.set_row(1, height=33)
+        wallet_info = self._excel_wallet_info(analysis, date_from, date_to, fiat_currencies)
+        for row, (field, value) in enumerate(wallet_info):
+            write_value(worksheet_wallet, row, 0, field)
+            write_value(worksheet_wallet, row, 1, value)
+        currow = len(wallet_info)
+        for link in self._excel_sheets_links(n_transactions, len(analysis.wallet_addresses), totals_period):
+            worksheet_wallet.write_string(currow, 0, link[0])
+            worksheet_wallet.write_url(currow, 1, link[1], string=link[2])
+            currow += 1
+
+        # Export input totals
+        worksheet_inputs = worksheets['Inputs']
+        worksheet_inputs.set_column(0, 1, 40)
+        worksheet_inputs.set_column(2, 2, 20, format_btc)
+        worksheet_inputs.set_column(3, 3, 10)
+        worksheet_inputs.set_column(4, 4, 50)
+        write_table(worksheet_inputs, *self._excel_inputs(analysis))
+
+        # Export output totals
+        worksheet_outputs = worksheets['Outputs']
+        worksheet_outputs.set_column(0, 1, 40)
+        worksheet_outputs.set_column(2, 2, 20, format_btc)
+        worksheet_outputs.set_column(3, 3, 10)
+        worksheet_outputs.set_column(4, 5, 40)
+        write_table(worksheet_outputs, *self._excel_outputs(analysis))
+
+        # Export addresses
+        worksheet_addresses = worksheets['Addresses']
+        worksheet_addresses.set_column(0, 0, 50)
+        worksheet_addresses.set_column(1, 1, 15, format_btc)
+        write_table(worksheet_addresses, *self._excel_addresses())
+
+        # Export address yearly totals
+        worksheet_addresses_year = worksheets['Address Totals']
+        worksheet_addresses_year.set_column(0, 0, 50)
+        worksheet_addresses_year.set_column(1, 15, 15, format_btc)
+        columns, rows = self._excel_address_totals(analysis, date_from, date_to)
+        write_table(worksheet_addresses_year, [''] + columns, rows)
+
+        # Export yearly totals
+        worksheet_years = worksheets['Year Totals']
+        worksheet_years.set_column(0, 0, 15)
+        worksheet_years.set_column(1, 1, 20)
+        worksheet_years.set_column(2, 5, 20, format_btc)
+        worksheet_years.set_column(6, 5 + n_fiat, 20, format_fiat)
+        write_table(worksheet_years, *self._excel_year_totals(analysis, date_from, date_to,
+                                                              yearly_totals_end_of_year, fiat_currencies))
+
+        # Export day, month or quarter totals
+        if totals_period and totals_period != 'year':
+            worksheet_periods = worksheets["%s Totals" % totals_period.capitalize()]
+            worksheet_periods.set_column(0, 1, 15)
+            worksheet_periods.set_column(2, 5, 20, format_btc)
+            worksheet_periods.set_column(6, 5 + n_fiat, 20, format_fiat)
+            write_table(worksheet_periods, *self._excel_period_totals(analysis, date_from, date_to, totals_period,
+                                                                      fiat_currencies))
+
+        workbook.close()
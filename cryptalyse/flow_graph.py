@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Compact address flow graph for multi-hop tracing of funds
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import numpy as np
+
+
+DIRECTIONS = ('downstream', 'upstream')
+
+
+def _expand(indptr, nodes):
+    # Positions of all edges of the nodes in a CSR graph and the node of every edge, without a Python loop
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    total = int(counts.sum())
+    offsets = np.repeat(starts - (np.cumsum(counts) - counts), counts)
+    return np.repeat(nodes, counts), offsets + np.arange(total, dtype=np.int64)
+
+
+class FlowGraph(object):
+    """
+    Value weighted address graph in compressed sparse row (CSR) format. Addresses are nodes with integer ids, an
+    edge from address a to address b holds the value that flowed from a to b in all transactions.
+
+    Within a transaction the value of every output is attributed to the inputs in proportion to their input values.
+    Edges also keep the number of transactions and the first and last transaction time as unix timestamp, so traces
+    can follow the order in which funds moved.
+
+    Use from_records() to build a graph from TxRecords, trace() for hop distances and taint() to propagate amounts
+    over several hops.
+    """
+
+    def __init__(self, addresses, indptr, indices, values, tx_counts, first_times, last_times):
+        self.addresses = list(addresses)
+        self.node_ids = dict((a, n) for n, a in enumerate(self.addresses))
+        self.indptr = indptr
+        self.indices = indices
+        self.values = values
+        self.tx_counts = tx_counts
+        self.first_times = first_times
+        self.last_times = last_times
+        self.out_values = np.bincount(self._sources(), weights=values, minlength=len(self.addresses))
+        self._reverse = None
+
+    @classmethod
+    def from_records(cls, records):
+        """
+        Build a graph from an iterable of TxRecords, i.e. from CryptalyseWallet.transaction_records(). Transactions
+        with the same txid are only added once.
+        """
+        node_ids = {}
+        seen = set()
+        sources = []
+        targets = []
+        values = []
+        times = []
+        for tx in records:
+            if tx.txid in seen:
+                continue
+            seen.add(tx.txid)
+            inputs = [(node_ids.setdefault(i[0], len(node_ids)), i[1] or 0) for i in tx.inputs if i[0]]
+            outputs = [(node_ids.setdefault(o[0], len(node_ids)), o[1]) for o in tx.outputs if o[0]]
+            if not inputs or not outputs:
+                continue
+            total_in = sum(v for _, v in inputs)
+            for src, in_value in inputs:
+                share = in_value / total_in if total_in else 1 / len(inputs)
+                for dst, out_value in outputs:
+                    sources.append(src)
+                    targets.append(dst)
+                    values.append(out_value * share)
+            times += [tx.date] * (len(inputs) * len(outputs))
+        times = np.array(times, dtype='datetime64[s]').astype(np.int64)
+        return cls._from_edges(list(node_ids), np.array(sources, dtype=np.int64), np.array(targets, dtype=np.int32),
+                               np.array(values, dtype=np.float64), times, times)
+
+    @classmethod
+    def _from_edges(cls, addresses, sources, targets, values, first_times, last_times, tx_counts=None):
+        # Merge edges with the same source and target and sort them by source
+        n = max(len(addresses), 1)
+        if tx_counts is None:
+            tx_counts = np.ones(len(sources), dtype=np.int32)
+        keys = sources.astype(np.int64) * n + targets
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+        indptr = np.zeros(len(addresses) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys[starts] // n, minlength=len(addresses)), out=indptr[1:])
+
+        def reduce(ufunc, column, dtype):
+            if not len(keys):
+                return np.zeros(0, dtype=dtype)
+            return ufunc.reduceat(column[order], starts).astype(dtype)
+
+        return cls(addresses, indptr, (keys[starts] % n).astype(np.int32), reduce(np.add, values, np.float64),
+                   reduce(np.add, tx_counts, np.int32), reduce(np.minimum, first_times, np.int64),
+                   reduce(np.maximum, last_times, np.int64))
+
+    def _sources(self):
+        return np.repeat(np.arange(len(self.addresses), dtype=np.int64), np.diff(self.indptr))
+
+    @property
+    def n_nodes(self):
+        return len(self.addresses)
+
+    @property
+    def n_edges(self):
+        return len(self.indices)
+
+    def reverse(self):
+        """
+        Graph with all edges reversed, used for upstream queries. Created once and cached.
+        """
+        if self._reverse is None:
+            self._reverse = self._from_edges(self.addresses, self.indices, self._sources(), self.values,
+                                             self.first_times, self.last_times, self.tx_counts)
+            self._reverse._reverse = self
+        return self._reverse
+
+    def _graph(self, direction):
+        if direction not in DIRECTIONS:
+            raise ValueError("Unknown direction %s, use one of %s" % (direction, DIRECTIONS))
+        return self if direction == 'downstream' else self.reverse()
+
+    def _node_ids(self, addresses):
+        if isinstance(addresses, str):
+            addresses = [addresses]
+        return np.array(sorted(set(self.node_ids[a] for a in addresses if a in self.node_ids)), dtype=np.int64)
+
+    def edges(self, address, direction='downstream'):
+        """
+        List of (address, value, transaction count) tuples of the edges of an address
+        """
+        graph = self._graph(direction)
+        node = self.node_ids.get(address)
+        if node is None:
+            return []
+        pos = range(graph.indptr[node], graph.indptr[node + 1])
+        return [(self.addresses[graph.indices[p]], float(graph.values[p]), int(graph.tx_counts[p])) for p in pos]
+
+    def trace(self, sources, max_hops=3, direction='downstream', min_value=0, follow_time=True):
+        """
+        Breadth-first search from the source addresses. Returns {address: hops} of all addresses reached within
+        max_hops, only following edges with a value of at least min_value satoshi.
+
+        With follow_time=True an edge is only followed if it has a transaction at or after the time funds first
+        arrived at the address, for upstream traces at or before the time funds left the address. Times are per
+        merged edge, so this is an approximation when an edge contains several transactions.
+        """
+        graph = self._graph(direction)
+        downstream = direction == 'downstream'
+        hops = np.full(self.n_nodes, -1, dtype=np.int32)
+        # Time funds arrive at an address downstream, or leave an address upstream. Unbounded for the sources.
+        earliest, latest = np.iinfo(np.int64).min, np.iinfo(np.int64).max
+        arrival = np.full(self.n_nodes, latest if downstream else earliest, dtype=np.int64)
+        frontier = self._node_ids(sources)
+        hops[frontier] = 0
+        arrival[frontier] = earliest if downstream else latest
+        for hop in range(1, max_hops + 1):
+            if not len(frontier):
+                break
+            owners, pos = _expand(graph.indptr, frontier)
+            mask = graph.values[pos] >= min_value
+            if follow_time:
+                mask &= graph.last_times[pos] >= arrival[owners] if downstream else \
+                    graph.first_times[pos] <= arrival[owners]
+            owners, pos = owners[mask], pos[mask]
+            targets = graph.indices[pos]
+            new = hops[targets] < 0
+            if follow_time:
+                # Earliest possible arrival downstream, latest possible departure upstream
+                if downstream:
+                    np.minimum.at(arrival, targets[new], np.maximum(graph.first_times[pos[new]], arrival[owners[new]]))
+                else:
+                    np.maximum.at(arrival, targets[new], np.minimum(graph.last_times[pos[new]], arrival[owners[new]]))
+            frontier = np.unique(targets[new])
+            hops[frontier] = hop
+        return dict((self.addresses[n], int(hops[n])) for n in np.flatnonzero(hops >= 0))
+
+    def taint(self, sources, max_hops=3, direction='downstream', min_value=0):
+        """
+        Propagate amounts from the source addresses along the edges, hop by hop. sources is a dictionary
+        {address: amount} or a list of addresses, which are then tainted with their total outgoing (or incoming for
+        upstream) value. At every hop the amount received by an address is divided over its edges in proportion to
+        the edge values, amounts below min_value satoshi are not propagated further. Transaction times are not taken
+        into account.
+
+        Returns {address: amount} with the total amount received by every address within max_hops, including the
+        source addresses.
+        """
+        graph = self._graph(direction)
+        if isinstance(sources, dict):
+            amounts = dict((self.node_ids[a], v) for a, v in sources.items() if a in self.node_ids)
+        else:
+            amounts = dict((n, graph.out_values[n]) for n in self._node_ids(sources))
+        received = np.zeros(self.n_nodes, dtype=np.float64)
+        pending = np.zeros(self.n_nodes, dtype=np.float64)
+        for node, amount in amounts.items():
+            received[node] += amount
+            pending[node] += amount
+        frontier = np.array(sorted(amounts), dtype=np.int64)
+        for _ in range(max_hops):
+            if not len(frontier):
+                break
+            owners, pos = _expand(graph.indptr, frontier)
+            out_values = graph.out_values[owners]
+            amounts = np.divide(pending[owners] * graph.values[pos], out_values, out=np.zeros(len(pos)),
+                                where=out_values > 0)
+            mask = amounts >= min_value if min_value else amounts > 0
+            pending[frontier] = 0
+            targets = graph.indices[pos[mask]]
+            np.add.at(pending, targets, amounts[mask])
+            np.add.at(received, targets, amounts[mask])
+            frontier = np.unique(targets)
+        return dict((self.addresses[n], float(received[n])) for n in np.flatnonzero(received))
+
+    def save(self, filename):
+        """
+        Write the graph as NumPy .npz archive
+        """
+        with open(filename, 'wb') as fp:
+            np.savez(fp, addresses=np.array(self.addresses, dtype=str), indptr=self.indptr, indices=self.indices,
+                     values=self.values, tx_counts=self.tx_counts, first_times=self.first_times,
+                     last_times=self.last_times)
+        return filename
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Load a graph written by save()
+        """
+        with np.load(filename) as npz:
+            return cls(npz['addresses'].tolist(), npz['indptr'], npz['indices'], npz['values'], npz['tx_counts'],
+                       npz['first_times'], npz['last_times'])
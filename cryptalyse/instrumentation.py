@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Optional timing and counter instrumentation of the wallet analysis and exports
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import json
+import time
+import functools
+from datetime import datetime
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from sqlalchemy import event
+
+
+# Stages recorded by CryptalyseWallet
+#   db_load: reading transactions from the database
+#   aggregate: analysis accumulators, see WalletAnalysis
+#   prices: fiat price lookups and valuation
+#   csv_write, xlsx_write: formatting and writing the export files
+INSTRUMENTATION_STAGES = ('db_load', 'aggregate', 'prices', 'csv_write', 'xlsx_write')
+
+_null_context = nullcontext()
+
+
+class NullInstrumentation(object):
+    """
+    Default instrumentation of a wallet, all methods do nothing
+    """
+    enabled = False
+    last_call = None
+
+    def call(self, name, wallet=None):
+        return _null_context
+
+    def stage(self, name):
+        return _null_context
+
+    def records(self, records, stage=None):
+        return records
+
+    def iterate(self, iterable, stage):
+        return iterable
+
+    def count(self, name, n=1):
+        pass
+
+    def cache(self, name, hit):
+        pass
+
+    def as_dict(self):
+        return {}
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
+
+
+class Instrumentation(object):
+    """
+    Records wall time per stage, counters and cache hits per call of an instrumented wallet method.
+
+    Stage times are exclusive: time spent in a nested stage, i.e. price lookups during the CSV export, is only counted
+    in the nested stage. Time not spent in any stage is reported as 'untracked'. Nested calls of instrumented methods
+    are recorded in the outermost call, stages and counters outside of a call are ignored.
+
+    The last max_calls records are kept in calls. If a logger is specified every record is logged as JSON message
+    at info level, with the record dictionary as 'cryptalyse_stats' attribute of the log record.
+    """
+    enabled = True
+
+    def __init__(self, logger=None, max_calls=100):
+        self.logger = logger
+        self.calls = deque(maxlen=max_calls)
+        self._current = None
+        self._depth = 0
+        self._stages = []
+        self._engine = None
+
+    @property
+    def last_call(self):
+        return self.calls[-1] if self.calls else None
+
+    def attach(self, engine):
+        # Count database round-trips on this SQLAlchemy engine
+        self.detach()
+        event.listen(engine, 'before_cursor_execute', self._before_cursor_execute)
+        self._engine = engine
+
+    def detach(self):
+        if self._engine is not None:
+            event.remove(self._engine, 'before_cursor_execute', self._before_cursor_execute)
+            self._engine = None
+
+    def _before_cursor_execute(self, *args, **kwargs):
+        self.count('db_queries')
+
+    @contextmanager
+    def call(self, name, wallet=None):
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        self._current = {'call': name, 'wallet': wallet, 'date': datetime.now().isoformat(), 'seconds': 0,
+                         'stages': {}, 'counters': {}, 'cache': {}}
+        self._depth = 1
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self._current
+            record['seconds'] = time.perf_counter() - start
+            record['stages']['untracked'] = record['seconds'] - sum(record['stages'].values())
+            record['cache_hit_rates'] = dict((cache, hits / (hits + misses))
+                                             for cache, (hits, misses) in record.pop('cache').items())
+            self._current = None
+            self._depth = 0
+            self._stages = []
+            self.calls.append(record)
+            if self.logger:
+                self.logger.info(json.dumps(record), extra={'cryptalyse_stats': record})
+
+    @contextmanager
+    def stage(self, name):
+        if self._current is None:
+            yield
+            return
+        # [name, nested stages time]
+        frame = [name, 0.0]
+        self._stages.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._stages.pop()
+            if self._stages:
+                self._stages[-1][1] += elapsed
+            stages = self._current['stages']
+            stages[name] = stages.get(name, 0.0) + elapsed - frame[1]
+
+    def records(self, records, stage=None):
+        """
+        Count transactions, inputs and outputs of a TxRecord iterator. If stage is specified, the time spent to
+        read each record is recorded in this stage.
+        """
+        it = iter(records)
+        while True:
+            if stage:
+                with self.stage(stage):
+                    tx = next(it, None)
+            else:
+                tx = next(it, None)
+            if tx is None:
+                return
+            self.count('transactions')
+            self.count('inputs', len(tx.inputs))
+            self.count('outputs', len(tx.outputs))
+            yield tx
+
+    def iterate(self, iterable, stage):
+        """
+        Record the time spent to produce each item of an iterator in this stage
+        """
+        it = iter(iterable)
+        sentinel = object()
+        while True:
+            with self.stage(stage):
+                item = next(it, sentinel)
+            if item is sentinel:
+                return
+            yield item
+
+    def count(self, name, n=1):
+        if self._current is not None:
+            counters = self._current['counters']
+            counters[name] = counters.get(name, 0) + n
+
+    def cache(self, name, hit):
+        if self._current is not None:
+            hits = self._current['cache'].setdefault(name, [0, 0])
+            hits[0 if hit else 1] += 1
+
+    def as_dict(self):
+        """
+        Record of the last instrumented call as dictionary
+        """
+        return self.last_call or {}
+
+
+def instrumented(method=None, stage=None):
+    """
+    Decorator for wallet methods which are recorded as call when the wallet's instrumentation is enabled. With stage
+    the time spent in the method itself, outside of nested stages, is recorded in this stage.
+    """
+    if method is None:
+        return functools.partial(instrumented, stage=stage)
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        instrumentation = self.instrumentation
+        if not instrumentation.enabled:
+            return method(self, *args, **kwargs)
+        with instrumentation.call(method.__name__, self.name):
+            if stage:
+                with instrumentation.stage(stage):
+                    return method(self, *args, **kwargs)
+            return method(self, *args, **kwargs)
+    return wrapper
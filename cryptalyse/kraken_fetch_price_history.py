@@ -1,68 +1,207 @@
 # Source https://www.cryptodatadownload.com/blog/kraken_how_to_script.py
 # First import the libraries that we need to use
 import os
-import pandas as pd
+import time
+import asyncio
+from datetime import datetime, timezone
 import requests
 import json
 
 
-def fetch_OHLC_data(symbol, timeframe):
-    """This function will get Open/High/Low/Close, Volume and tradecount data for the pair passed and save to CSV"""
+KRAKEN_API_URL = 'https://api.kraken.com'
+
+# Price history files are stored next to this module, see cryptalyse/prices.py
+PRICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+OHLC_TIMEFRAMES = {'1': 'minute', '60': 'hour', '1440': 'day'}
+OHLC_COLUMNS = ['unix', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'tradecount', 'date', 'volume_from']
+OHLC_START = 1581465600
+
+# Kraken error messages which are worth a retry
+KRAKEN_RETRY_ERRORS = ('EAPI:Rate limit exceeded', 'EGeneral:Too many requests', 'EService:Unavailable',
+                       'EService:Busy')
+
+
+class KrakenError(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+    Allow at most 'rate' requests per second over all concurrent tasks, with bursts of up to 'burst' requests
+    """
+
+    def __init__(self, rate=1.0, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def ohlc_filename(symbol, timeframe, output_dir=PRICE_DIR):
     pair_split = symbol.split('/')  # symbol must be in format XXX/XXX ie. BTC/USD
-    symbol = pair_split[0] + pair_split[1]
+    return os.path.join(output_dir, f'Kraken_{pair_split[0] + pair_split[1]}_{OHLC_TIMEFRAMES.get(timeframe, "")}.csv')
 
-    if timeframe == '1':
-        tf = 'minute'
-    elif timeframe == '60':
-        tf = 'hour'
-    elif timeframe == '1440':
-        tf = 'day'
-    else:
-        tf = ''
-    filename = f'Kraken_{symbol}_{tf}.csv'
 
-    since = 1581465600
-    if os.path.isfile(filename):
-        with open(filename, 'r') as f:
-            last_line = f.readlines()[-1]
-            since = last_line.split(',')[0]
+def last_timestamp(filename, tail_size=4096):
+    """
+    Unix timestamp of the last row in a Kraken OHLC file. Only reads the tail of the file. An incomplete last line
+    left by an interrupted write is removed.
+    """
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        offset = size
+        data = b''
+        while offset > 0:
+            offset = max(0, offset - tail_size)
+            f.seek(offset)
+            data = f.read(size - offset)
+            if data.count(b'\n') >= 2 or not offset:
+                break
+        if data and not data.endswith(b'\n'):
+            f.truncate(offset + data.rfind(b'\n') + 1)
+            data = data[:data.rfind(b'\n') + 1]
+    for line in reversed(data.splitlines()):
+        try:
+            return int(line.split(b',')[0])
+        except ValueError:
+            continue
+    return None
 
-    url = f'https://api.kraken.com/0/public/OHLC?pair={symbol}&interval={timeframe}&since={since}'
-    print("Open url: %s" % url)
 
-    response = requests.get(url)
-    if response.status_code == 200:  # check to make sure the response from server is good
-        j = json.loads(response.text)
-        result = j['result']
-        keys = []
-        for item in result:
-            keys.append(item)
-        if keys[0] != 'last':
-            data = pd.DataFrame(result[keys[0]],
-                                columns=['unix', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'tradecount'])
-        else:
-            data = pd.DataFrame(result[keys[1]],
-                                columns=['unix', 'open', 'high', 'low', 'close', 'vwap', 'volume', 'tradecount'])
+def append_rows(filename, rows, timeframe='1440'):
+    """
+    Append OHLC rows to a CSV file with a single write call, so readers and other writers never see a partial
+    block of rows. The header is written if the file is new.
+    """
+    date_format = '%Y-%m-%d' if timeframe == '1440' else '%Y-%m-%d %H:%M:%S'
+    lines = []
+    for r in rows:
+        date = datetime.fromtimestamp(int(r[0]), tz=timezone.utc).strftime(date_format)
+        volume_from = float(r[6]) * float(r[4])
+        lines.append(','.join([str(r[0])] + [str(v) for v in r[1:8]] + [date, repr(volume_from)]))
+    data = '\n'.join(lines) + '\n'
+    fd = os.open(filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        if not os.fstat(fd).st_size:
+            data = ','.join(OHLC_COLUMNS) + '\n' + data
+        os.write(fd, data.encode())
+        os.fsync(fd)
+    finally:
+        os.close(fd)
 
-        data['date'] = pd.to_datetime(data['unix'], unit='s')
-        data['volume_from'] = data['volume'].astype(float) * data['close'].astype(float)
 
-        # unix, open, high, low, close, vwap, volume, tradecount, date, volume_from
-        # Date, Symbol, Open, High, Low, Close, Average
+async def _kraken_get(session, url, params, limiter, retries=5, backoff=1.0, timeout=30):
+    # GET request in a worker thread with retries and exponential backoff on network, HTTP and Kraken rate errors
+    for attempt in range(retries + 1):
+        await limiter.acquire()
+        try:
+            response = await asyncio.to_thread(session.get, url, params=params, timeout=timeout)
+            if response.status_code == 200:
+                j = response.json()
+                if not j.get('error'):
+                    return j['result']
+                if not any(e in KRAKEN_RETRY_ERRORS for e in j['error']):
+                    raise KrakenError(', '.join(j['error']))
+                error = ', '.join(j['error'])
+            elif response.status_code in (429, 500, 502, 503, 504, 520, 522):
+                error = "HTTP status %d" % response.status_code
+            else:
+                raise KrakenError("Did not receive OK response from Kraken API: HTTP status %d" %
+                                  response.status_code)
+        except requests.RequestException as e:
+            error = str(e)
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+    raise KrakenError("Request to %s failed after %d retries: %s" % (url, retries, error))
+
+
+async def fetch_ohlc(session, symbol, timeframe, limiter, base_url=KRAKEN_API_URL, output_dir=PRICE_DIR, retries=5,
+                     backoff=1.0):
+    """
+    Fetch new OHLC candles for one pair and timeframe and append them to the Kraken CSV file. Follows the 'last'
+    cursor of the Kraken API until no new candles are returned. The current, not yet committed candle is skipped and
+    rows which are already in the file are never written again.
+
+    Returns the number of appended rows.
+    """
+    filename = ohlc_filename(symbol, timeframe, output_dir)
+    last_written = last_timestamp(filename)
+    since = last_written or OHLC_START
+    url = base_url.rstrip('/') + '/0/public/OHLC'
+    pair = symbol.replace('/', '')
+    n_rows = 0
+    while True:
+        result = await _kraken_get(session, url, {'pair': pair, 'interval': timeframe, 'since': since}, limiter,
+                                   retries, backoff)
+        candles = [v for k, v in result.items() if k != 'last'][0]
+        # Last entry is the current, not yet committed timeframe
+        rows = [c for c in candles[:-1] if last_written is None or int(c[0]) > last_written]
+        if rows:
+            append_rows(filename, rows, timeframe)
+            last_written = int(rows[-1][0])
+            n_rows += len(rows)
+        last = int(result.get('last', 0))
+        if not rows or last <= since:
+            break
+        since = last
+    print("Fetched %d records from Kraken for %s %s" % (n_rows, symbol, OHLC_TIMEFRAMES.get(timeframe, timeframe)))
+    return n_rows
 
-        # if we failed to get any data, print an error...otherwise write the file
-        if data is None:
-            print("Did not return any data from Kraken for this symbol")
-        else:
-            data.to_csv(filename, index=False, mode='a', header=False)
-            print("Fetched %d records from Kraken" % len(data))
-    else:
-        print("Did not receive OK response from Kraken API")
+
+async def fetch_ohlc_pairs(symbols, timeframes=('1440',), base_url=KRAKEN_API_URL, output_dir=PRICE_DIR,
+                           concurrency=4, rate=1.0, retries=5, backoff=1.0):
+    """
+    Update the OHLC files of all symbols and timeframes concurrently over a pooled HTTP session.
+
+    Returns a dictionary {(symbol, timeframe): number of appended rows or the exception raised}
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    limiter = RateLimiter(rate)
+    semaphore = asyncio.Semaphore(concurrency)
+    jobs = list(dict.fromkeys((symbol, timeframe) for symbol in symbols for timeframe in timeframes))
+
+    async def job(symbol, timeframe):
+        async with semaphore:
+            return await fetch_ohlc(session, symbol, timeframe, limiter, base_url, output_dir, retries, backoff)
+
+    try:
+        results = await asyncio.gather(*[job(s, tf) for s, tf in jobs], return_exceptions=True)
+    finally:
+        session.close()
+    for (symbol, timeframe), r in zip(jobs, results):
+        if isinstance(r, Exception):
+            print("Error fetching %s %s: %s" % (symbol, timeframe, r))
+    return dict(zip(jobs, results))
+
+
+def fetch_OHLC_data(symbol, timeframe):
+    """This function will get Open/High/Low/Close, Volume and tradecount data for the pair passed and save to CSV"""
+    return asyncio.run(fetch_ohlc_pairs([symbol], [timeframe]))[(symbol, timeframe)]
 
 
 def fetch_SPREAD_data(symbol):
     """This function will return the nearest bid/ask and calculate the spread for the symbol passed and save
         the results to a CSV file"""
+    import pandas as pd
+
     pair_split = symbol.split('/')  # symbol must be in format XXX/XXX ie. BTC/USD
     symbol = pair_split[0] + pair_split[1]
     url = f'https://api.kraken.com/0/public/Spread?pair={symbol}'
@@ -92,6 +231,8 @@ def fetch_SPREAD_data(symbol):
 
 def fetch_PRINTS_data(symbol):
     """This function will return historical trade prints for the symbol passed and save the results to a CSV file"""
+    import pandas as pd
+
     pair_split = symbol.split('/')  # symbol must be in format XXX/XXX ie. BTC/USD
     symbol = pair_split[0] + pair_split[1]
     url = f'https://api.kraken.com/0/public/Trades?pair={symbol}'
@@ -125,13 +266,9 @@ def fetch_PRINTS_data(symbol):
 
 if __name__ == "__main__":
     # we set which pair we want to retrieve data for
-    pair = "BTC/EUR"
+    pairs = ["BTC/EUR", "BTC/USD"]
     # full timeframe intervals found here: https://www.kraken.com/en-us/features/api#get-ohlc-data
-    # fetch_OHLC_data(symbol=pair, timeframe='1') # fetches minute data
-    # fetch_OHLC_data(symbol=pair, timeframe='60')  # fetches hourly data
-    fetch_OHLC_data(symbol=pair, timeframe='1440')  # fetches daily data
-    # fetch_SPREAD_data(symbol=pair) # gets bid/ask spread data
-    # fetch_PRINTS_data(symbol=pair) # gets historical trade print data
-
-    pair = "BTC/USD"
-    fetch_OHLC_data(symbol=pair, timeframe='1440')
\ No newline at end of file
+    # '1' fetches minute data, '60' hourly data and '1440' daily data
+    asyncio.run(fetch_ohlc_pairs(pairs, timeframes=['1440']))
+    # fetch_SPREAD_data(symbol="BTC/EUR") # gets bid/ask spread data
+    # fetch_PRINTS_data(symbol="BTC/EUR") # gets historical trade print data
\ No newline at end of file
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Price history store: dense daily fiat rates shared by all wallets in a process
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+from datetime import datetime, date
+import numpy as np
+
+
+PRICE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Old price history (2010+)
+file_price_history = os.path.join(PRICE_DIR, 'pricehistory_BTC{currency}_day_2010.csv')
+
+# Price history (2020+), fetched from Kraken API. Update with kraken_fetch_price_history.py
+file_price_history2 = os.path.join(PRICE_DIR, 'Kraken_BTC{currency}_day.csv')
+
+# Binary sidecar with the dense daily rates. Rebuilt automatically when one of the CSV files is newer
+file_price_store = os.path.join(PRICE_DIR, 'pricestore_BTC{currency}_day.npy')
+
+# Hourly and minute candles fetched from Kraken, with binary sidecars for the sorted timestamps and the rates
+file_price_intraday = os.path.join(PRICE_DIR, 'Kraken_BTC{currency}_{resolution}.csv')
+file_price_intraday_store = os.path.join(PRICE_DIR, 'pricestore_BTC{currency}_{resolution}_{array}.npy')
+
+# Fiat exchange rates fetched from Kraken, i.e. Kraken_EURUSD_day.csv. Used to derive cross rates for currencies
+# without a BTC price history file.
+file_fiat_history = os.path.join(PRICE_DIR, 'Kraken_{pair}_day.csv')
+CROSS_BASE_CURRENCIES = ('eur', 'usd')
+
+# Intraday resolutions and their candle length in seconds
+PRICE_RESOLUTIONS = {'minute': 60, 'hour': 3600}
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+# Policies for days without a known rate
+#   previous: use the last known rate before this day, 0 before the first known rate
+#   zero: use 0
+#   raise: raise a KeyError
+PRICE_FILL_POLICIES = ('previous', 'zero', 'raise')
+
+_price_stores = {}
+_intraday_prices = {}
+
+
+def day_number(d):
+    """
+    Convert a date, datetime, unix timestamp or 'YYYY-MM-DD' string to the number of days since 1970-01-01
+    """
+    if isinstance(d, str):
+        d = datetime.strptime(d[:10], "%Y-%m-%d")
+    if isinstance(d, (datetime, date)):
+        return d.toordinal() - EPOCH_ORDINAL
+    return int(d) // 86400
+
+
+def day_numbers(dates):
+    """
+    Vectorized day_number() for a sequence of datetimes, numpy datetime64 values or unix timestamps
+    """
+    arr = np.asarray(dates)
+    if arr.dtype == object:
+        arr = arr.astype('datetime64[s]')
+    if arr.dtype.kind == 'M':
+        return arr.astype('datetime64[D]').astype(np.int64)
+    return arr.astype(np.int64) // 86400
+
+
+def unix_timestamps(dates):
+    """
+    Vectorized conversion of datetimes, numpy datetime64 values or unix timestamps to int64 unix timestamps
+    """
+    arr = np.asarray(dates)
+    if arr.dtype == object:
+        arr = arr.astype('datetime64[s]')
+    if arr.dtype.kind == 'M':
+        return arr.astype('datetime64[s]').astype(np.int64)
+    return arr.astype(np.int64)
+
+
+class PriceStore(object):
+    """
+    Daily fiat rates for one currency, stored in a float array indexed by day number.
+
+    Days without a known rate are stored as NaN and resolved with a fill policy on lookup, see PRICE_FILL_POLICIES.
+    """
+
+    def __init__(self, currency, first_day, rates):
+        self.currency = currency.lower()
+        self.first_day = int(first_day)
+        self.rates = rates
+        self._filled = {}
+
+    @staticmethod
+    def _read_day_rates(files, day_rates=None):
+        # Parse (filename, date column, rate column) CSV files into a dictionary {day number: rate}
+        day_rates = {} if day_rates is None else day_rates
+        for fn, date_col, rate_col in files:
+            if not os.path.isfile(fn):
+                continue
+            with open(fn, encoding='utf-8-sig') as fp:
+                for l in fp:
+                    pl = l.split(',')
+                    try:
+                        day_rates[day_number(pl[date_col].strip())] = float(pl[rate_col].strip())
+                    except (ValueError, IndexError):
+                        pass
+        return day_rates
+
+    @classmethod
+    def from_csv(cls, currency):
+        """
+        Parse the old (2010+) and Kraken (2020+) price history files. Kraken rates override the old rates.
+        """
+        cur = currency.upper()
+        return cls.from_day_rates(currency, cls._read_day_rates([(file_price_history.format(currency=cur), 0, 6),
+                                                                 (file_price_history2.format(currency=cur), 8, 4)]))
+
+    @classmethod
+    def from_day_rates(cls, currency, day_rates):
+        if not day_rates:
+            return cls(currency, 0, np.empty(0))
+        first_day = min(day_rates)
+        rates = np.full(max(day_rates) - first_day + 1, np.nan)
+        days = np.fromiter(day_rates.keys(), dtype=np.int64, count=len(day_rates))
+        rates[days - first_day] = np.fromiter(day_rates.values(), dtype=np.float64, count=len(day_rates))
+        return cls(currency, first_day, rates)
+
+    @classmethod
+    def load(cls, currency):
+        """
+        Memory-map the binary sidecar file if it is up to date, otherwise parse the CSV files and write a new sidecar
+        """
+        cur = currency.upper()
+        fn = file_price_store.format(currency=cur)
+        sources = [f.format(currency=cur) for f in (file_price_history, file_price_history2)]
+        sources_mtime = max([os.path.getmtime(f) for f in sources if os.path.isfile(f)] or [0])
+        if os.path.isfile(fn) and os.path.getmtime(fn) >= sources_mtime:
+            # First element holds the first day number, the rest are the daily rates
+            data = np.load(fn, mmap_mode='r')
+            return cls(currency, data[0], data[1:])
+        ps = cls.from_csv(currency)
+        ps.save(fn)
+        return ps
+
+    def save(self, filename):
+        try:
+            tmp_fn = filename + '.tmp.npy'
+            np.save(tmp_fn, np.concatenate(([self.first_day], self.rates)))
+            os.replace(tmp_fn, filename)
+        except OSError:
+            pass  # Read-only installation, parse CSV files on next cold start
+
+    def _rates_filled(self, fill):
+        if fill not in self._filled:
+            if fill == 'previous':
+                known = ~np.isnan(self.rates)
+                idx = np.maximum.accumulate(np.where(known, np.arange(len(self.rates)), -1))
+                filled = np.where(idx >= 0, self.rates[np.maximum(idx, 0)], 0.0)
+            else:
+                filled = np.nan_to_num(self.rates, nan=0.0)
+            self._filled[fill] = filled
+        return self._filled[fill]
+
+    def rate(self, d, fill='previous'):
+        """
+        Rate for a single day. Days before the first known rate have rate 0, other missing days use the fill policy.
+        """
+        if fill not in PRICE_FILL_POLICIES:
+            raise ValueError("Unknown price fill policy %s, use one of %s" % (fill, PRICE_FILL_POLICIES))
+        idx = day_number(d) - self.first_day
+        n = len(self.rates)
+        if fill == 'raise':
+            if idx < 0 or idx >= n or np.isnan(self.rates[idx]):
+                raise KeyError("No %s price known for %s" % (self.currency.upper(), d))
+            return float(self.rates[idx])
+        if not n or idx < 0:
+            return 0.0
+        if idx >= n:
+            return float(self._rates_filled(fill)[-1]) if fill == 'previous' else 0.0
+        return float(self._rates_filled(fill)[idx])
+
+    def rates_for(self, dates, fill='previous'):
+        """
+        Vectorized rate() lookup. Returns a float array with the rate for each date in one numpy pass.
+        """
+        if fill not in PRICE_FILL_POLICIES:
+            raise ValueError("Unknown price fill policy %s, use one of %s" % (fill, PRICE_FILL_POLICIES))
+        idx = day_numbers(dates) - self.first_day
+        n = len(self.rates)
+        if not n:
+            if fill == 'raise' and len(idx):
+                raise KeyError("No %s prices known" % self.currency.upper())
+            return np.zeros(len(idx))
+        in_range = (idx >= 0) & (idx < n)
+        if fill == 'raise':
+            if not in_range.all() or np.isnan(self.rates[idx]).any():
+                raise KeyError("No %s price known for all dates" % self.currency.upper())
+            return np.asarray(self.rates[idx], dtype=np.float64)
+        rates = self._rates_filled(fill)[np.clip(idx, 0, n - 1)]
+        rates[idx < 0] = 0.0
+        if fill != 'previous':
+            rates[idx >= n] = 0.0
+        return rates
+
+    def values(self, dates, amounts, denominator=1, fill='previous'):
+        """
+        Fiat value of amounts at the given dates, amounts are multiplied by denominator first (i.e. satoshi to BTC)
+        """
+        return self.rates_for(dates, fill) * (np.asarray(amounts, dtype=np.float64) * denominator)
+
+    def __contains__(self, d):
+        idx = day_number(d) - self.first_day
+        return 0 <= idx < len(self.rates) and not np.isnan(self.rates[idx])
+
+    def __len__(self):
+        return len(self.rates)
+
+
+class IntradayPrices(object):
+    """
+    Hourly or minute rates for one currency as sorted int64 unix timestamps of the candle start and the closing rate
+    of each candle. Lookups use a binary search, timestamps without a candle return NaN.
+    """
+
+    def __init__(self, currency, resolution, timestamps, rates):
+        if resolution not in PRICE_RESOLUTIONS:
+            raise ValueError("Unknown price resolution %s, use one of %s" % (resolution, list(PRICE_RESOLUTIONS)))
+        self.currency = currency.lower()
+        self.resolution = resolution
+        self.interval = PRICE_RESOLUTIONS[resolution]
+        self.timestamps = timestamps
+        self.rates = rates
+
+    @classmethod
+    def from_csv(cls, currency, resolution):
+        fn = file_price_intraday.format(currency=currency.upper(), resolution=resolution)
+        timestamps = []
+        rates = []
+        if os.path.isfile(fn):
+            with open(fn) as fp:
+                for l in fp:
+                    pl = l.split(',', 6)
+                    try:
+                        ts, rate = int(pl[0]), float(pl[4])
+                    except (ValueError, IndexError):
+                        continue
+                    timestamps.append(ts)
+                    rates.append(rate)
+        timestamps = np.array(timestamps, dtype=np.int64)
+        rates = np.array(rates, dtype=np.float64)
+        # Sort and remove duplicate candles
+        timestamps, idx = np.unique(timestamps, return_index=True)
+        return cls(currency, resolution, timestamps, rates[idx])
+
+    @classmethod
+    def load(cls, currency, resolution):
+        """
+        Memory-map the binary sidecar files if they are up to date, otherwise parse the CSV file and write new sidecars
+        """
+        cur = currency.upper()
+        source = file_price_intraday.format(currency=cur, resolution=resolution)
+        fn_ts, fn_rates = [file_price_intraday_store.format(currency=cur, resolution=resolution, array=a)
+                           for a in ('unix', 'rate')]
+        source_mtime = os.path.getmtime(source) if os.path.isfile(source) else 0
+        if os.path.isfile(fn_ts) and os.path.isfile(fn_rates) and \
+                min(os.path.getmtime(fn_ts), os.path.getmtime(fn_rates)) >= source_mtime:
+            return cls(currency, resolution, np.load(fn_ts, mmap_mode='r'), np.load(fn_rates, mmap_mode='r'))
+        ip = cls.from_csv(currency, resolution)
+        if len(ip):
+            ip.save(fn_ts, fn_rates)
+        return ip
+
+    def save(self, filename_timestamps, filename_rates):
+        try:
+            for filename, arr in ((filename_timestamps, self.timestamps), (filename_rates, self.rates)):
+                tmp_fn = filename + '.tmp.npy'
+                np.save(tmp_fn, arr)
+                os.replace(tmp_fn, filename)
+        except OSError:
+            pass
+
+    def lookup(self, timestamps):
+        """
+        Closing rate of the candle containing each unix timestamp, NaN if there is no candle for that time
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        rates = np.full(len(timestamps), np.nan)
+        if not len(self.timestamps):
+            return rates
+        idx = np.searchsorted(self.timestamps, timestamps, side='right') - 1
+        found = idx >= 0
+        found[found] = timestamps[found] - self.timestamps[idx[found]] < self.interval
+        rates[found] = self.rates[idx[found]]
+        return rates
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def intraday_prices(currency, resolution):
+    """
+    Get the process-wide IntradayPrices for this fiat currency and resolution
+    """
+    key = (currency.lower(), resolution)
+    if key not in _intraday_prices:
+        _intraday_prices[key] = IntradayPrices.load(currency, resolution)
+    return _intraday_prices[key]
+
+
+def rates_at(currency, dates, fill='previous', resolutions=('minute', 'hour')):
+    """
+    Rates at the exact time of each date. Uses the candle of the first resolution which covers the timestamp and
+    falls back to the daily rates of the PriceStore.
+    """
+    timestamps = unix_timestamps(dates)
+    rates = np.full(len(timestamps), np.nan)
+    for resolution in resolutions:
+        missing = np.isnan(rates)
+        if not missing.any():
+            break
+        ip = intraday_prices(currency, resolution)
+        if len(ip):
+            rates[missing] = ip.lookup(timestamps[missing])
+    missing = np.isnan(rates)
+    if missing.any():
+        rates[missing] = price_store(currency).rates_for(timestamps[missing], fill)
+    return rates
+
+
+def has_price_history(currency):
+    cur = currency.upper()
+    return any(os.path.isfile(f.format(currency=cur)) for f in (file_price_history, file_price_history2))
+
+
+def cross_price_store(currency):
+    """
+    Derive BTC rates for a currency without price history files from the BTC rates of a base currency and the daily
+    exchange rate between the base currency and this currency. Returns None if no exchange rate file is found.
+    """
+    for base in CROSS_BASE_CURRENCIES:
+        if base == currency or not has_price_history(base):
+            continue
+        for pair, invert in ((base + currency, False), (currency + base, True)):
+            fn = file_fiat_history.format(pair=pair.upper())
+            if not os.path.isfile(fn):
+                continue
+            fx = PriceStore.from_day_rates(pair, PriceStore._read_day_rates([(fn, 8, 4)]))
+            base_store = price_store(base)
+            days = base_store.first_day + np.arange(len(base_store))
+            # Days without exchange rate, i.e. weekends, use the previous exchange rate. Missing BTC rates are left
+            # for the fill policy of the derived store.
+            idx = np.minimum(days - fx.first_day, len(fx) - 1)
+            fx_rates = np.full(len(days), np.nan)
+            known = idx >= 0
+            fx_rates[known] = fx._rates_filled('previous')[idx[known]]
+            if invert:
+                fx_rates = 1 / fx_rates
+            return PriceStore(currency, base_store.first_day, base_store.rates * fx_rates)
+    return None
+
+
+def price_store(currency):
+    """
+    Get the process-wide PriceStore for this fiat currency. Built or memory-mapped once and shared by all wallets.
+    Cross rates are used for currencies without price history files, see cross_price_store().
+    """
+    currency = currency.lower()
+    if currency not in _price_stores:
+        ps = None
+        if not has_price_history(currency):
+            ps = cross_price_store(currency)
+        _price_stores[currency] = ps if ps is not None else PriceStore.load(currency)
+    return _price_stores[currency]
+
+
+def price_matrix(currencies, dates, fill='previous', resolutions=None):
+    """
+    Rates for all dates and currencies as array with one row per date and one column per currency. With resolutions,
+    i.e. ('minute', 'hour'), the rates at the exact time are used, see rates_at().
+    """
+    timestamps = unix_timestamps(dates)
+    if resolutions:
+        return np.column_stack([rates_at(c, timestamps, fill, resolutions) for c in currencies])
+    return np.column_stack([price_store(c).rates_for(timestamps, fill) for c in currencies])
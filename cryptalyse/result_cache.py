@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    LRU cache of analysis results with optional persistence on disk
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import pickle
+import hashlib
+from collections import OrderedDict
+
+
+# Number of analysis results kept in memory per wallet
+RESULT_CACHE_SIZE = 8
+
+
+class ResultCache(object):
+    """
+    Least recently used cache of results. Keys must be tuples of strings, numbers, dates and other values with a
+    stable repr(), so they can also be used as filename on disk.
+
+    If a directory is specified every result is also pickled to a file in this directory, and results not in memory
+    are loaded from there. Only use a private directory: cache files are unpickled, and are never removed by the
+    cache itself. Keys should contain a fingerprint of the source data, so outdated files are never read.
+    """
+
+    def __init__(self, maxsize=RESULT_CACHE_SIZE, directory=None):
+        self.maxsize = maxsize
+        self.directory = directory
+        self._items = OrderedDict()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _filename(self, key):
+        return os.path.join(self.directory, hashlib.sha256(repr(key).encode()).hexdigest() + '.pickle')
+
+    def get(self, key, default=None):
+        if key in self._items:
+            self._items.move_to_end(key)
+            return self._items[key]
+        if not self.directory:
+            return default
+        try:
+            with open(self._filename(key), 'rb') as fp:
+                stored_key, value = pickle.load(fp)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+            return default
+        if stored_key != key:
+            return default
+        self._store(key, value)
+        return value
+
+    def _store(self, key, value):
+        if not self.maxsize:
+            return
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def put(self, key, value):
+        self._store(key, value)
+        if self.directory:
+            # Write to a temporary file first, so other processes never read a partially written file
+            filename = self._filename(key)
+            tmp_filename = '%s.%d.tmp' % (filename, os.getpid())
+            with open(tmp_filename, 'wb') as fp:
+                pickle.dump((key, value), fp, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_filename, filename)
+
+    def clear(self):
+        # Only the results in memory are removed, files on disk are ignored anyway after the source data changed
+        self._items.clear()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
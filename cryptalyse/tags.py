@@ -0,0 +1,383 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Tagged address stores: in memory, SQLite or sorted memory-mapped file with a Bloom filter prefilter
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU Affero General Public License as
+#    published by the Free Software Foundation, either version 3 of the
+#    License, or (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Affero General Public License for more details.
+#
+#    You should have received a copy of the GNU Affero General Public License
+#    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import csv
+import json
+import math
+import mmap
+import struct
+import sqlite3
+import hashlib
+from collections.abc import Mapping
+
+
+# Sorted tag file: magic, header with number of entries, offsets position, Bloom filter position, bits and hashes,
+# followed by 'address\ttag\n' entries sorted by address, the entry offsets and the Bloom filter bits
+TAG_FILE_MAGIC = b'CRYPTALYSE-TAGS1'
+_tag_file_header = struct.Struct('<QQQQI')
+
+# Number of lookups cached per store
+TAG_CACHE_SIZE = 65536
+
+
+class BloomFilter(object):
+    """
+    Bloom filter for address strings. A negative answer is always correct, a positive answer is wrong with a
+    probability of about error_rate for the number of items the filter was created for.
+    """
+
+    def __init__(self, capacity=None, error_rate=0.01, n_bits=None, n_hashes=None, data=None):
+        if n_bits is None:
+            capacity = max(capacity or 0, 1)
+            n_bits = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+            n_hashes = max(1, int(round(n_bits / capacity * math.log(2))))
+        self.n_bits = n_bits
+        self.n_hashes = n_hashes
+        self.data = bytearray(data) if data is not None else bytearray((n_bits + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.n_bits for i in range(self.n_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.data[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        data = self.data
+        for pos in self._positions(item):
+            if not data[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class TagStore(Mapping):
+    """
+    Read-only mapping of addresses to tags. Subclasses implement _lookup(), lookups are cached and checked against the
+    Bloom filter first if the store has one, so addresses which are not tagged rarely need a lookup in the store.
+
+    Tag stores can be used everywhere a tagged_addresses dictionary is accepted.
+    """
+    bloom = None
+
+    def __init__(self, cache_size=TAG_CACHE_SIZE):
+        self._cache = {}
+        self.cache_size = cache_size
+
+    def _lookup(self, address):
+        raise NotImplementedError
+
+    def get(self, address, default=None):
+        cache = self._cache
+        if address in cache:
+            tag = cache[address]
+        elif self.bloom is not None and address not in self.bloom:
+            return default
+        else:
+            tag = self._lookup(address)
+            if len(cache) >= self.cache_size:
+                cache.clear()
+            cache[address] = tag
+        return default if tag is None else tag
+
+    def __getitem__(self, address):
+        tag = self.get(address)
+        if tag is None:
+            raise KeyError(address)
+        return tag
+
+    def __contains__(self, address):
+        return self.get(address) is not None
+
+    def fingerprint(self):
+        """
+        String which changes when the tags in the store change, for use in cache keys. Computed from all tags, the
+        stores on disk use the size and modification time of the file instead.
+        """
+        total = 0
+        for address, tag in self.items():
+            digest = hashlib.blake2b(('%s\t%s' % (address, tag)).encode(), digest_size=8).digest()
+            total += int.from_bytes(digest, 'little')
+        return '%s:%d:%016x' % (type(self).__name__, len(self), total % 2 ** 64)
+
+    def _file_fingerprint(self):
+        stat = os.stat(self.filename)
+        return '%s:%s:%d:%d' % (type(self).__name__, os.path.abspath(self.filename), stat.st_size, stat.st_mtime_ns)
+
+
+class DictTagStore(TagStore):
+    """
+    Tag store on a dictionary in memory
+    """
+
+    def __init__(self, tags=None):
+        TagStore.__init__(self, 0)
+        self.tags = tags if tags is not None else {}
+
+    def get(self, address, default=None):
+        return self.tags.get(address, default)
+
+    def __contains__(self, address):
+        return address in self.tags
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def items(self):
+        return self.tags.items()
+
+
+class SQLiteTagStore(TagStore):
+    """
+    Tag store in a SQLite database table. Use create() to create the database, the table has an address primary key.
+    A Bloom filter of all addresses is stored in the database when it is created.
+    """
+
+    def __init__(self, filename, cache_size=TAG_CACHE_SIZE):
+        TagStore.__init__(self, cache_size)
+        self.filename = filename
+        self._open()
+
+    def _open(self):
+        if not os.path.isfile(self.filename):
+            raise FileNotFoundError("Tag database %s not found" % self.filename)
+        self.db = sqlite3.connect('file:%s?mode=ro' % self.filename, uri=True, check_same_thread=False)
+        meta = dict(self.db.execute("SELECT name, value FROM meta"))
+        if 'bloom' in meta:
+            self.bloom = BloomFilter(n_bits=int(meta['bloom_bits']), n_hashes=int(meta['bloom_hashes']),
+                                     data=meta['bloom'])
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'], state['cache_size'])
+
+    @classmethod
+    def create(cls, filename, tags, error_rate=0.01, batch_size=100000):
+        """
+        Create a tag database from a dictionary or an iterable of (address, tag) tuples
+        """
+        items = tags.items() if isinstance(tags, Mapping) else tags
+        db = sqlite3.connect(filename)
+        try:
+            db.execute("DROP TABLE IF EXISTS tags")
+            db.execute("DROP TABLE IF EXISTS meta")
+            db.execute("CREATE TABLE tags (address TEXT PRIMARY KEY, tag TEXT NOT NULL) WITHOUT ROWID")
+            db.execute("CREATE TABLE meta (name TEXT PRIMARY KEY, value)")
+            batch = []
+            for address, tag in items:
+                batch.append((address, tag))
+                if len(batch) >= batch_size:
+                    db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?)", batch)
+                    batch = []
+            db.executemany("INSERT OR REPLACE INTO tags VALUES (?, ?)", batch)
+            n_items = db.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+            bloom = BloomFilter(n_items, error_rate)
+            for (address, ) in db.execute("SELECT address FROM tags"):
+                bloom.add(address)
+            db.executemany("INSERT INTO meta VALUES (?, ?)", [('bloom', bytes(bloom.data)),
+                                                              ('bloom_bits', bloom.n_bits),
+                                                              ('bloom_hashes', bloom.n_hashes)])
+            db.commit()
+        finally:
+            db.close()
+        return cls(filename)
+
+    def _lookup(self, address):
+        row = self.db.execute("SELECT tag FROM tags WHERE address = ?", (address, )).fetchone()
+        return row[0] if row else None
+
+    def __iter__(self):
+        return (r[0] for r in self.db.execute("SELECT address FROM tags ORDER BY address"))
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM tags").fetchone()[0]
+
+    def fingerprint(self):
+        return self._file_fingerprint()
+
+    def close(self):
+        self.db.close()
+
+
+class SortedFileTagStore(TagStore):
+    """
+    Tag store in a memory-mapped file with entries sorted by address, lookups use a binary search. Use create() to
+    write the file. The file is only read by the pages touched by the lookups, so opening it is instant and the
+    pages are shared by all processes using the same file.
+    """
+
+    def __init__(self, filename, cache_size=TAG_CACHE_SIZE):
+        TagStore.__init__(self, cache_size)
+        self.filename = filename
+        self._open()
+
+    def _open(self):
+        with open(self.filename, 'rb') as fp:
+            self._mm = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(TAG_FILE_MAGIC)] != TAG_FILE_MAGIC:
+            raise ValueError("%s is not a cryptalyse tag file" % self.filename)
+        self._n, self._offsets_pos, bloom_pos, bloom_bits, bloom_hashes = \
+            _tag_file_header.unpack_from(self._mm, len(TAG_FILE_MAGIC))
+        self.bloom = BloomFilter(n_bits=bloom_bits, n_hashes=bloom_hashes,
+                                 data=self._mm[bloom_pos:bloom_pos + (bloom_bits + 7) // 8])
+
+    def __getstate__(self):
+        return {'filename': self.filename, 'cache_size': self.cache_size}
+
+    def __setstate__(self, state):
+        self.__init__(state['filename'], state['cache_size'])
+
+    @classmethod
+    def create(cls, filename, tags, error_rate=0.01):
+        """
+        Write a tag file from a dictionary or an iterable of (address, tag) tuples. If an address occurs more than
+        once the last tag is used.
+        """
+        items = tags.items() if isinstance(tags, Mapping) else tags
+        entries = {}
+        for address, tag in items:
+            if '\t' in address or '\n' in address or '\t' in tag or '\n' in tag:
+                raise ValueError("Address and tag can not contain tabs or newlines: %s" % address)
+            entries[address.encode()] = tag.encode()
+        bloom = BloomFilter(len(entries), error_rate)
+        for address in entries:
+            bloom.add(address.decode())
+        header_size = len(TAG_FILE_MAGIC) + _tag_file_header.size
+        offsets = []
+        pos = header_size
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as fp:
+            fp.write(b'\0' * header_size)
+            for address in sorted(entries):
+                offsets.append(pos)
+                entry = address + b'\t' + entries[address] + b'\n'
+                fp.write(entry)
+                pos += len(entry)
+            offsets.append(pos)
+            fp.write(struct.pack('<%dQ' % len(offsets), *offsets))
+            bloom_pos = pos + 8 * len(offsets)
+            fp.write(bloom.data)
+            fp.seek(0)
+            fp.write(TAG_FILE_MAGIC + _tag_file_header.pack(len(entries), pos, bloom_pos, bloom.n_bits,
+                                                             bloom.n_hashes))
+        os.replace(tmp_filename, filename)
+        return cls(filename)
+
+    def _offset(self, n):
+        return struct.unpack_from('<Q', self._mm, self._offsets_pos + 8 * n)[0]
+
+    def _entry(self, n):
+        start = self._offset(n)
+        end = self._offset(n + 1) - 1
+        sep = self._mm.find(b'\t', start, end)
+        return self._mm[start:sep], self._mm[sep + 1:end]
+
+    def _lookup(self, address):
+        key = address.encode()
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = self._offset(mid)
+            sep = self._mm.find(b'\t', start)
+            mid_key = self._mm[start:sep]
+            if mid_key < key:
+                lo = mid + 1
+            elif mid_key > key:
+                hi = mid
+            else:
+                return self._mm[sep + 1:self._offset(mid + 1) - 1].decode()
+        return None
+
+    def __iter__(self):
+        return (self._entry(n)[0].decode() for n in range(self._n))
+
+    def __len__(self):
+        return self._n
+
+    def fingerprint(self):
+        return self._file_fingerprint()
+
+    def close(self):
+        self._mm.close()
+
+
+def read_tags_file(filename):
+    """
+    Read (address, tag) tuples from a JSON file with an {address: tag} object, or from a CSV file with address and tag
+    columns separated by a ';' or ','
+    """
+    with open(filename, newline='') as fp:
+        if filename.lower().endswith('.json'):
+            yield from json.load(fp).items()
+            return
+        first_line = fp.readline()
+        fp.seek(0)
+        delimiter = ';' if ';' in first_line else ','
+        for row in csv.reader(fp, delimiter=delimiter):
+            if len(row) >= 2:
+                yield row[0].strip(), row[1].strip()
+
+
+def open_tag_store(source):
+    """
+    Tag store for a dictionary, a tag store, or a filename: '.sqlite' and '.db' files are opened as SQLiteTagStore,
+    '.tags' files as SortedFileTagStore, JSON and CSV files are loaded into memory. Returns an empty store if
+    source is None or empty.
+    """
+    if isinstance(source, TagStore):
+        return source
+    if isinstance(source, Mapping):
+        return DictTagStore(source)
+    if not source:
+        return DictTagStore()
+    if isinstance(source, str):
+        ext = os.path.splitext(source)[1].lower()
+        if ext in ('.sqlite', '.db'):
+            return SQLiteTagStore(source)
+        if ext == '.tags':
+            return SortedFileTagStore(source)
+        return DictTagStore(dict(read_tags_file(source)))
+    raise TypeError("Tagged addresses should be a dictionary, a TagStore or a filename, not %s" %
+                    type(source).__name__)
+
+
+def create_tag_store(filename, tags, error_rate=0.01):
+    """
+    Create a SQLite ('.sqlite', '.db') or sorted file ('.tags') tag store from a dictionary, an iterable of
+    (address, tag) tuples or a JSON or CSV filename
+    """
+    if isinstance(tags, str):
+        tags = read_tags_file(tags)
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in ('.sqlite', '.db'):
+        return SQLiteTagStore.create(filename, tags, error_rate)
+    if ext == '.tags':
+        return SortedFileTagStore.create(filename, tags, error_rate)
+    raise ValueError("Unknown tag store extension %s, use .sqlite, .db or .tags" % ext)
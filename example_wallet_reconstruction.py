@@ -28,9 +28,12 @@ print(', '.join(known_addresses))
 
 found_addrs = w.inputs_correlated
 print("\nFound %d correlated input addresses: %s" % (len(found_addrs), ', '.join(found_addrs)))
-print("\nAdd them to wallet and rescan")
-for addr in found_addrs:
-    key = Address.import_address(addr)
-    w.import_key(key)
-w.scan()
+print("\nAdd them to wallet and scan the new addresses, repeat until no new correlated addresses are found")
+result = w.reconstruct(max_rounds=5, initial_scan=False)
+for r in result['rounds'][1:]:
+    print("Round %d: imported %d addresses, found %d new transactions" %
+          (r['round'], r['imported'], r['transactions_found']))
+for error in result['errors']:
+    print(error)
+print("Stopped: %s" % result['stopped'])
 w.info()
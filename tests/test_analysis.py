@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the wallet analysis accumulators
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+import pickle
+from datetime import datetime
+from cryptalyse.analysis import TxRecord, UtxoSnapshots, WalletAnalysis
+
+
+def test_utxo_snapshots_spend_before_creation():
+    # Spend is added and dated before the transaction which creates the output
+    snapshots = UtxoSnapshots({'w1'})
+    snapshots.add(TxRecord(datetime(2016, 1, 5), 's', 0, [('w1', 100, 'c', 0)], [('x', 90, 0)]))
+    snapshots.add(TxRecord(datetime(2017, 1, 5), 'c', 0, [('y', 110, 'p', 0)], [('w1', 100, 0)]))
+    snapshots.add(TxRecord(datetime(2018, 1, 5), 'd', 0, [('y', 60, 'p', 1)], [('w1', 50, 0)]))
+
+    utxos = dict(snapshots.snapshots('year'))
+    assert utxos[2016] == {}
+    assert utxos[2017] == {}
+    assert utxos[2018] == {('d', 0): (50, 'w1')}
+    balances = dict(snapshots.balances('year'))
+    assert balances == {2016: {}, 2017: {}, 2018: {'w1': 50}}
+    assert len(snapshots.issues) == 1
+
+
+def test_wallet_analysis_pickle_without_addresses():
+    records = [TxRecord(datetime(2017, 1, 5), 'c', 0, [('y', 110, 'p', 0)], [('w1', 100, 0)])]
+    analysis = WalletAnalysis('wallet', {'w1'}, {'y': 'exchange'}).run(records)
+    loaded = pickle.loads(pickle.dumps(analysis))
+    assert loaded.wallet_addresses is None
+    assert loaded.tagged_addresses is None
+    assert loaded.utxo_snapshots.wallet_addresses is None
+    assert analysis.wallet_addresses == {'w1'}
+    assert loaded.input_totals == analysis.input_totals
+
+    wallet_addresses = {'w1'}
+    loaded.bind(wallet_addresses, {'y': 'exchange'})
+    assert loaded.utxo_snapshots.wallet_addresses is wallet_addresses
+    assert loaded.tagged_addresses.get('y') == 'exchange'
+
+
+def test_wallet_analysis_undated_transaction():
+    # Unconfirmed transactions can have no date
+    records = [
+        TxRecord(datetime(2017, 1, 5), 'c', 0, [('y', 110, 'p', 0)], [('w1', 100, 0)]),
+        TxRecord(None, 'u', 10, [('w1', 100, 'c', 0)], [('x', 90, 0)]),
+    ]
+    analysis = WalletAnalysis('wallet', {'w1'}, {}, partitions=True).run(records)
+    assert set(analysis.input_totals) == {'y', 'wallet'}
+    assert list(analysis.output_totals) == ['x']
+    assert len(analysis.transactions_export) == 2
+    assert analysis.utxo_snapshots.utxos == {}
+    assert dict(analysis.utxo_snapshots.balances('year')) == {2017: {'w1': 100}}
+    assert analysis.period_totals('year') == {2017: (100, 0, 0, 100)}
+
+    date_range = analysis.date_range(datetime(2018, 1, 1), None, lambda start, end: [])
+    assert list(date_range.input_totals) == ['wallet']
+    assert list(date_range.output_totals) == ['x']
@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the command line interface
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+from cryptalyse.benchmark import startup_benchmark
+
+
+def test_cli_startup_budget():
+    result = startup_benchmark(repeat=3)
+    assert result['heavy_modules'] == []
+    assert result['ok'], "CLI startup overhead %.3f s exceeds budget of %.3f s" % (result['overhead'],
+                                                                                     result['budget'])
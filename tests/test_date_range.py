@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for input and output totals of a date range
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+from datetime import datetime
+import pytest
+from bitcoinlib.db import DbTransaction, DbTransactionInput, DbTransactionOutput
+from sqlalchemy import func
+from cryptalyse.analysis import TxRecord, WalletAnalysis
+from cryptalyse.benchmark import synthetic_wallet
+
+
+DATE_RANGES = [
+    (datetime(2016, 3, 14, 12, 30), datetime(2017, 8, 20, 18)),
+    (datetime(2016, 5, 3), datetime(2016, 5, 27, 6)),
+    (datetime(2016, 5, 1), datetime(2016, 7, 1)),
+    (datetime(2018, 2, 10, 9), None),
+    (None, datetime(2016, 9, 9, 9)),
+]
+
+EMPTY_DATE_RANGES = [
+    (datetime(2010, 1, 1), datetime(2014, 12, 31)),
+    (datetime(2030, 1, 1), None),
+    (datetime(2017, 6, 20), datetime(2017, 6, 10)),
+]
+
+
+@pytest.fixture(scope='module')
+def wallet(tmp_path_factory):
+    return synthetic_wallet(str(tmp_path_factory.mktemp('db') / 'wallet.sqlite'), 300, n_addresses=20)
+
+
+@pytest.fixture(scope='module')
+def unconfirmed_wallet(tmp_path_factory):
+    # Wallet with an unconfirmed transaction without date, which spends a wallet output
+    w, tags = synthetic_wallet(str(tmp_path_factory.mktemp('db') / 'wallet.sqlite'), 100, n_addresses=10)
+    session = w.session
+    utxo = session.query(DbTransactionOutput).\
+        filter(DbTransactionOutput.key_id.isnot(None), DbTransactionOutput.spent.is_(False)).first()
+    prev_txid = session.query(DbTransaction.txid).filter(DbTransaction.id == utxo.transaction_id).scalar()
+    tx_id = session.query(func.max(DbTransaction.id)).scalar() + 1
+    session.add(DbTransaction(
+        id=tx_id, txid=b'\x11' * 32, wallet_id=w.wallet_id, account_id=0, status='unconfirmed', confirmations=0,
+        fee=1000, network_name='bitcoin', witness_type='segwit', input_total=utxo.value,
+        output_total=utxo.value - 1000))
+    session.add(DbTransactionInput(
+        transaction_id=tx_id, index_n=0, key_id=utxo.key_id, address=utxo.address, prev_txid=prev_txid,
+        output_n=utxo.output_n, value=utxo.value, witness_type='segwit', script_type='sig_pubkey'))
+    session.add(DbTransactionOutput(
+        transaction_id=tx_id, output_n=0, address='bc1qunconfirmedoutput', value=utxo.value - 1000, script=b'',
+        script_type='p2wpkh'))
+    session.flush()
+    session.query(DbTransaction).filter(DbTransaction.id == tx_id).update({'date': None})
+    session.commit()
+    w.clear_analysis_cache()
+    return w, tags
+
+
+def full_analysis(wallet, date_from, date_to):
+    w, tags = wallet
+    return WalletAnalysis(w.name, w.address_index, tags, date_from, date_to).run(list(w.transaction_records()))
+
+
+@pytest.mark.parametrize('date_from, date_to', DATE_RANGES + EMPTY_DATE_RANGES)
+def test_date_range_totals(wallet, date_from, date_to):
+    w, tags = wallet
+    analysis = w.analyse(tags, date_from, date_to)
+    expected = full_analysis(wallet, date_from, date_to)
+    # Same totals in the same order
+    assert list(analysis.input_totals.items()) == list(expected.input_totals.items())
+    assert list(analysis.output_totals.items()) == list(expected.output_totals.items())
+
+
+@pytest.mark.parametrize('date_from, date_to', DATE_RANGES)
+def test_date_range_not_empty(wallet, date_from, date_to):
+    w, tags = wallet
+    analysis = w.analyse(tags).date_range(date_from, date_to, w._transaction_records_between)
+    assert analysis.input_totals
+    assert analysis.input_totals != w.analyse(tags).input_totals
+
+
+@pytest.mark.parametrize('date_from, date_to', EMPTY_DATE_RANGES)
+def test_date_range_empty(wallet, date_from, date_to):
+    w, tags = wallet
+    analysis = w.analyse(tags, date_from, date_to)
+    assert analysis.input_totals == {}
+    assert analysis.output_totals == {}
+
+
+@pytest.mark.parametrize('date_from, date_to', [(None, None)] + DATE_RANGES + EMPTY_DATE_RANGES)
+def test_date_range_unconfirmed(unconfirmed_wallet, date_from, date_to):
+    w, tags = unconfirmed_wallet
+    assert list(w.transaction_records())[-1].date is None
+    analysis = w.analyse(tags, date_from, date_to)
+    expected = full_analysis(unconfirmed_wallet, date_from, date_to)
+    assert list(analysis.input_totals.items()) == list(expected.input_totals.items())
+    assert list(analysis.output_totals.items()) == list(expected.output_totals.items())
+    assert 'bc1qunconfirmedoutput' in analysis.output_totals
+
+
+def test_exports_unconfirmed(unconfirmed_wallet):
+    w, tags = unconfirmed_wallet
+    rows = w.transactions_export_tuples(tags, datetime(2016, 1, 1), datetime(2016, 12, 31))
+    assert rows[-1][0] is None
+    assert rows[-1][1] == '11' * 32
+    assert w.export_balance_totals()
+    assert w.clusters() is not None
+
+
+def test_in_date_range():
+    analysis = WalletAnalysis('wallet', set(), date_from=datetime(2016, 1, 1), date_to=datetime(2016, 12, 31))
+    assert analysis.in_date_range(None)
+    assert analysis.in_date_range(datetime(2016, 6, 1))
+    assert not analysis.in_date_range(datetime(2015, 6, 1))
+    assert not analysis.in_date_range(datetime(2017, 6, 1))
+
+    # Undated transactions were compared with date_to, the date check only applied to date_from
+    analysis = WalletAnalysis('wallet', set(), date_to=datetime(2016, 12, 31))
+    assert analysis.in_date_range(None)
+    assert analysis.in_date_range(datetime(2015, 6, 1))
+    assert not analysis.in_date_range(datetime(2017, 6, 1))
+
+
+@pytest.mark.parametrize('date_from, date_to', [
+    (datetime(2016, 1, 1), None),
+    (None, datetime(2016, 12, 31)),
+    (datetime(2016, 1, 1), datetime(2016, 12, 31)),
+])
+def test_totals_exclude_transactions_outside_range(date_from, date_to):
+    records = [
+        TxRecord(datetime(2015, 6, 1), 'a', 0, [('x1', 100, 'p', 0)], [('w1', 100, 0)]),
+        TxRecord(datetime(2016, 6, 1), 'b', 0, [('x2', 200, 'p', 1)], [('w1', 200, 0)]),
+        TxRecord(datetime(2017, 6, 1), 'c', 500, [('w1', 300, 'b', 0)], [('x3', 299500, 0)]),
+    ]
+    analysis = WalletAnalysis('wallet', {'w1'}, {}, date_from, date_to).run(records)
+    expected = {'x2'}
+    if not date_from:
+        expected.add('x1')
+    if not date_to:
+        expected.add('wallet')
+    assert set(analysis.input_totals) == expected
+    assert list(analysis.output_totals) == ([] if date_to else ['x3'])
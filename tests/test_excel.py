@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the Excel export
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+from datetime import datetime
+import pytest
+from cryptalyse.benchmark import synthetic_wallet
+
+pd = pytest.importorskip('pandas')
+pytest.importorskip('openpyxl')
+pytest.importorskip('xlsxwriter')
+
+
+@pytest.fixture(scope='module')
+def wallet(tmp_path_factory):
+    return synthetic_wallet(str(tmp_path_factory.mktemp('db') / 'wallet.sqlite'), 200, n_addresses=10)
+
+
+def read_workbook(filename):
+    sheets = pd.read_excel(filename, sheet_name=None, header=None)
+    wallet = sheets['Wallet']
+    sheets['Wallet'] = wallet[wallet[0] != 'Date generated'].reset_index(drop=True)
+    return sheets
+
+
+@pytest.mark.parametrize('date_from, date_to', [
+    (datetime(2016, 3, 14, 12), datetime(2018, 8, 20)),
+    (datetime(2015, 1, 1), datetime(2030, 1, 1)),
+])
+@pytest.mark.parametrize('constant_memory_first', [False, True])
+def test_export_to_excel_constant_memory(wallet, tmp_path, date_from, date_to, constant_memory_first):
+    # Both modes should write the same workbook, also when the other mode already cached an analysis
+    w, tags = wallet
+    w.clear_analysis_cache()
+    for constant_memory in ([True, False] if constant_memory_first else [False, True]):
+        w.export_to_excel(str(tmp_path / ('%s.xlsx' % constant_memory)), tags, date_from, date_to,
+                          totals_period='month', constant_memory=constant_memory)
+
+    expected = read_workbook(str(tmp_path / 'False.xlsx'))
+    sheets = read_workbook(str(tmp_path / 'True.xlsx'))
+    assert len(expected['Transactions']) > 1
+    assert list(sheets) == list(expected)
+    for name, df in expected.items():
+        pd.testing.assert_frame_equal(sheets[name], df, obj=name)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the Kraken OHLC fetcher, against a local stand-in for the Kraken API
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+import json
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+import pytest
+from cryptalyse.kraken_fetch_price_history import OHLC_COLUMNS, OHLC_START, append_rows, fetch_ohlc_pairs, \
+    ohlc_filename
+
+DAY = 86400
+# Committed daily candles and the current, not yet committed candle which Kraken always adds as last entry
+CANDLES = [[str(OHLC_START + n * DAY), '100.0', '110.0', '90.0', '%d.0' % (100 + n), '101.0', '2.5', 10 + n]
+           for n in range(10)]
+CURRENT = [str(OHLC_START + 10 * DAY), '100.0', '110.0', '90.0', '999.0', '101.0', '0.1', 1]
+PAGE_SIZE = 3
+
+
+class KrakenStandIn(BaseHTTPRequestHandler):
+    # Serves pages of PAGE_SIZE candles after 'since', the second request gets a rate limit error
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        requests = self.server.requests
+        requests.append((url.path, query))
+        if len(requests) == 2:
+            body = {'error': ['EAPI:Rate limit exceeded'], 'result': {}}
+        else:
+            since = int(query['since'][0])
+            page = [c for c in CANDLES if int(c[0]) > since][:PAGE_SIZE]
+            body = {'error': [], 'result': {'XXBTZEUR': page + [CURRENT],
+                                            'last': int(page[-1][0]) if page else since}}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def kraken_server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), KrakenStandIn)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def fetch(server, output_dir):
+    base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+    return asyncio.run(fetch_ohlc_pairs(['BTC/EUR'], ['1440'], base_url=base_url, output_dir=output_dir,
+                                        rate=1000, backoff=0.01))
+
+
+def test_fetch_ohlc_resume(kraken_server, tmp_path):
+    filename = ohlc_filename('BTC/EUR', '1440', str(tmp_path))
+    append_rows(filename, CANDLES[:4])
+    # Incomplete line left by an interrupted write
+    with open(filename, 'a') as f:
+        f.write(CANDLES[4][0] + ',100.0,11')
+
+    assert fetch(kraken_server, str(tmp_path)) == {('BTC/EUR', '1440'): 6}
+    sinces = [int(query['since'][0]) for _, query in kraken_server.requests]
+    # Resumes after the last complete row, retries after the rate limit error and follows the 'last' cursor
+    assert sinces == [int(CANDLES[3][0]), int(CANDLES[6][0]), int(CANDLES[6][0]), int(CANDLES[9][0])]
+    assert all(path == '/0/public/OHLC' for path, _ in kraken_server.requests)
+    assert all(query['pair'] == ['BTCEUR'] and query['interval'] == ['1440'] for _, query in kraken_server.requests)
+
+    with open(filename) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == ','.join(OHLC_COLUMNS)
+    rows = [line.split(',') for line in lines[1:]]
+    assert [r[0] for r in rows] == [c[0] for c in CANDLES]
+    assert [r[4] for r in rows] == [c[4] for c in CANDLES]
+    assert rows[0][8] == '2020-02-12'
+    assert float(rows[-1][9]) == 2.5 * 109
+
+    # Nothing new, the current candle is never written
+    assert fetch(kraken_server, str(tmp_path)) == {('BTC/EUR', '1440'): 0}
+    with open(filename) as f:
+        assert f.read().splitlines() == lines
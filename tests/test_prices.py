@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the fiat price stores
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+import os
+from datetime import date, timedelta
+import numpy as np
+import pytest
+from cryptalyse import prices
+from cryptalyse.prices import PriceStore, cross_price_store, day_number
+
+
+# BTC/EUR rates from Monday 2024-01-01 to Sunday 2024-01-14
+FIRST_DAY = date(2024, 1, 1)
+BTC_EUR = [100.0 + 10 * n for n in range(14)]
+
+
+def write_fx_file(filename, day_rates):
+    # Kraken OHLC file, the date is in column 8 and the close rate in column 4
+    with open(filename, 'w') as f:
+        f.write('unix,open,high,low,close,vwap,volume,tradecount,date,volume_from\n')
+        for d, rate in day_rates.items():
+            f.write('0,0,0,0,%s,0,0,0,%s,0\n' % (rate, d.isoformat()))
+
+
+@pytest.fixture
+def fx_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(prices, 'file_fiat_history', os.path.join(str(tmp_path), 'Kraken_{pair}_day.csv'))
+    monkeypatch.setattr(prices, 'has_price_history', lambda currency: currency == 'eur')
+    monkeypatch.setattr(prices, '_price_stores', {'eur': PriceStore('eur', day_number(FIRST_DAY), np.array(BTC_EUR))})
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize('invert', [False, True])
+def test_cross_price_store_fx_gaps(fx_dir, invert):
+    # Exchange rates on weekdays only, from Tuesday 2024-01-02 up to Friday 2024-01-12
+    fx = dict((FIRST_DAY + timedelta(days=n), 0.8 + 0.01 * n) for n in range(1, 12) if n % 7 not in (5, 6))
+    if invert:
+        write_fx_file(os.path.join(fx_dir, 'Kraken_GBPEUR_day.csv'), dict((d, 1 / r) for d, r in fx.items()))
+    else:
+        write_fx_file(os.path.join(fx_dir, 'Kraken_EURGBP_day.csv'), fx)
+
+    store = cross_price_store('gbp')
+    friday, saturday, sunday = date(2024, 1, 5), date(2024, 1, 6), date(2024, 1, 7)
+    assert store.rate(friday) == pytest.approx(BTC_EUR[4] * fx[friday])
+    # Weekend BTC moves are kept, only the exchange rate of Friday is used
+    assert store.rate(saturday) == pytest.approx(BTC_EUR[5] * fx[friday])
+    assert store.rate(sunday) == pytest.approx(BTC_EUR[6] * fx[friday])
+    assert store.rate(date(2024, 1, 8)) == pytest.approx(BTC_EUR[7] * fx[date(2024, 1, 8)])
+    # After the last exchange rate
+    assert store.rate(date(2024, 1, 14)) == pytest.approx(BTC_EUR[13] * fx[date(2024, 1, 12)])
+    # Before the first exchange rate
+    assert store.rate(FIRST_DAY) == 0
+    assert list(store.rates_for([saturday, sunday])) == pytest.approx([store.rate(saturday), store.rate(sunday)])
+
+
+def test_cross_price_store_without_fx_file(fx_dir):
+    assert cross_price_store('gbp') is None
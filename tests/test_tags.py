@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+#
+#    Analyse and Export Crypto wallets
+#
+#    Unit tests for the tags used by cached wallet analyses
+#
+#    © 2026 - 1200 Web Development <http://1200wd.com/>
+#
+
+from datetime import datetime
+import json
+import pytest
+from cryptalyse.benchmark import synthetic_wallet
+from cryptalyse.tags import DictTagStore
+
+
+@pytest.fixture(scope='module')
+def wallet(tmp_path_factory):
+    return synthetic_wallet(str(tmp_path_factory.mktemp('db') / 'wallet.sqlite'), 200, n_addresses=10)
+
+
+def names(analysis):
+    return set(analysis.input_totals) | set(analysis.output_totals)
+
+
+@pytest.mark.parametrize('date_from', [None, datetime(2016, 3, 14)])
+def test_analyse_dict_changed_in_place(wallet, date_from):
+    w, tags = wallet
+    w.clear_analysis_cache()
+    tags = dict(tags)
+    analysis = w.analyse(tags, date_from)
+    assert w.analyse(tags, date_from) is analysis
+    assert 'Tag 1' in names(analysis)
+
+    # Relabel a tag, the number of tags stays the same
+    for address, tag in tags.items():
+        if tag == 'Tag 1':
+            tags[address] = 'Relabelled'
+    analysis = w.analyse(tags, date_from)
+    assert 'Relabelled' in names(analysis)
+    assert 'Tag 1' not in names(analysis)
+
+    # Replace a tagged address by another address
+    untagged = sorted(a for a in analysis.input_totals if a.startswith('bc1'))[0]
+    del tags[next(a for a, tag in tags.items() if tag == 'Tag 2')]
+    tags[untagged] = 'Replaced'
+    analysis = w.analyse(tags, date_from)
+    assert 'Replaced' in names(analysis)
+    assert untagged not in names(analysis)
+
+
+def test_analyse_tag_store_changed_in_place(wallet):
+    w, tags = wallet
+    w.clear_analysis_cache()
+    store = DictTagStore(dict(tags))
+    analysis = w.analyse(store)
+    assert w.analyse(store) is analysis
+    for address, tag in store.items():
+        if tag == 'Tag 3':
+            store.tags[address] = 'Relabelled'
+    assert 'Relabelled' in names(w.analyse(store))
+
+
+def test_analyse_tags_file(wallet, tmp_path):
+    w, tags = wallet
+    w.clear_analysis_cache()
+    filename = str(tmp_path / 'tags.json')
+    with open(filename, 'w') as f:
+        json.dump(tags, f)
+    analysis = w.analyse(filename)
+    assert w.analyse(filename) is analysis
+    assert names(analysis) == names(w.analyse(dict(tags)))